@@ -4,12 +4,166 @@ import firebase_admin
 from firebase_admin import credentials, storage, firestore
 import pyrebase
 from dotenv import load_dotenv
+import concurrent.futures
 import datetime
+import hashlib
+import threading
+import time
 import uuid
 
+from api.resumable_upload import ResumableUpload, object_url
+
 # Load environment variables
 load_dotenv()
 
+# Files upload_folder uploads at once
+UPLOAD_WORKERS = int(os.getenv("FIREBASE_UPLOAD_WORKERS", "8"))
+
+# Attempts per file before its upload fails, and the wait before the first retry (doubled after each)
+UPLOAD_ATTEMPTS = 4
+UPLOAD_RETRY_DELAY = 1.0
+
+# Files this large are uploaded in resumable chunks, so a failed attempt doesn't start over
+RESUMABLE_THRESHOLD = int(os.getenv("FIREBASE_RESUMABLE_THRESHOLD", str(64 * 1024 * 1024)))
+
+# Minimum time between two progress callbacks, in seconds
+PROGRESS_INTERVAL = 0.1
+
+# Most writes Firestore accepts in one batch commit
+MAX_BATCH_WRITES = 500
+
+# Most values Firestore accepts in one "in" filter
+MAX_IN_VALUES = 30
+
+# Bytes read at once when hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class TransferCancelled(Exception):
+    """Raised inside an upload or download when it is cancelled."""
+
+def file_fingerprint(path):
+    """
+    Size and SHA-256 of a file, stored in its metadata so unchanged files needn't be uploaded again.
+
+    Returns:
+        dict: {"size": bytes, "sha256": hex digest}
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+def is_unchanged(existing, fingerprint, cloud_path):
+    """Whether existing file metadata describes an upload of the same content to cloud_path."""
+    return (existing is not None and existing.get("url") and existing.get("path") == cloud_path
+            and existing.get("size") == fingerprint["size"] and existing.get("sha256") == fingerprint["sha256"])
+
+class _BatchWriter:
+    """Collects Firestore writes and commits them in batches of up to MAX_BATCH_WRITES."""
+
+    def __init__(self, db):
+        self.db = db
+        self.batch = None
+        self.count = 0
+
+    def set(self, reference, data, merge=False):
+        self._batch().set(reference, data, merge=merge)
+        self._added()
+
+    def update(self, reference, data):
+        self._batch().update(reference, data)
+        self._added()
+
+    def commit(self):
+        """Commit the writes not committed yet."""
+        if self.count:
+            self.batch.commit()
+        self.batch = None
+        self.count = 0
+
+    def _batch(self):
+        if self.batch is None:
+            self.batch = self.db.batch()
+        return self.batch
+
+    def _added(self):
+        self.count += 1
+        if self.count >= MAX_BATCH_WRITES:
+            self.commit()
+
+class _TransferProgress:
+    """Bytes and files done of an upload or download, shared by its threads."""
+
+    def __init__(self, total_bytes, total_files, progress_func=None):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.bytes_done = 0
+        self.files_done = 0
+        self.progress_func = progress_func
+        self.last_report = 0.0
+        self.lock = threading.Lock()
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes_done += count
+            self._report(force=False)
+
+    def file_done(self):
+        with self.lock:
+            self.files_done += 1
+            self._report(force=True)
+
+    def _report(self, force):
+        if self.progress_func is None:
+            return
+        now = time.monotonic()
+        if force or now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            self.progress_func(self.bytes_done, self.total_bytes, self.files_done, self.total_files)
+
+class _ProgressReader:
+    """
+    File object handed to the storage upload, counting the bytes it reads and raising
+    TransferCancelled from read() once should_stop() is true, which aborts the request.
+    """
+
+    def __init__(self, path, progress=None, should_stop=None):
+        self.file = open(path, 'rb')
+        self.size = os.path.getsize(path)
+        self.read_bytes = 0
+        self.progress = progress
+        self.should_stop = should_stop
+
+    def read(self, size=-1):
+        if self.should_stop is not None and self.should_stop():
+            raise TransferCancelled(self.file.name)
+        data = self.file.read(size)
+        self.read_bytes += len(data)
+        if self.progress is not None:
+            self.progress.add_bytes(len(data))
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 class FirebaseClient:
     """Client for interacting with Firebase services."""
     
@@ -53,6 +207,7 @@ class FirebaseClient:
             database_id=self.database_name
         )
         self.storage = self.firebase.storage()
+        self._local = threading.local()
      
     def check_internet_connection(self):
         """
@@ -68,6 +223,150 @@ class FirebaseClient:
             return True
         except OSError:
             return False    
+
+    def _thread_storage(self):
+        """Storage reference of the calling thread; child() keeps the path on the reference, so threads can't share one."""
+        thread_storage = getattr(self._local, "storage", None)
+        if thread_storage is None:
+            thread_storage = self._local.storage = self.firebase.storage()
+        return thread_storage
+
+    def _upload_with_retry(self, local_path, cloud_path, progress=None, should_stop=None, fingerprint=None):
+        """
+        Upload one file to Firebase Storage, retrying failed attempts with exponential backoff.
+
+        Files of RESUMABLE_THRESHOLD bytes or more are uploaded in resumable chunks: a retry,
+        or the next upload after the app was closed, continues from the last committed chunk.
+
+        Returns:
+            str: Download URL of the uploaded file
+        """
+        resumable = None
+        if os.path.getsize(local_path) >= RESUMABLE_THRESHOLD:
+            resumable = ResumableUpload(self.config["storageBucket"], local_path, cloud_path, fingerprint)
+            committed = [0]
+
+            def on_chunk(committed_bytes):
+                if should_stop is not None and should_stop():
+                    raise TransferCancelled(local_path)
+                if progress is not None:
+                    progress.add_bytes(committed_bytes - committed[0])
+                committed[0] = committed_bytes
+
+        attempt = 0
+        while True:
+            reader = None
+            committed_before = committed[0] if resumable is not None else 0
+            try:
+                if resumable is not None:
+                    resumable.upload(on_chunk)
+                    return object_url(resumable.base_url, resumable.bucket, cloud_path)
+                reader = _ProgressReader(local_path, progress, should_stop)
+                with reader:
+                    file_storage = self._thread_storage()
+                    file_storage.child(cloud_path).put(reader)
+                    return file_storage.child(cloud_path).get_url(None)
+            except TransferCancelled:
+                raise
+            except Exception as e:
+                # The bytes of the failed attempt are sent again (resumable uploads only resend uncommitted chunks)
+                if progress is not None and reader is not None:
+                    progress.add_bytes(-reader.read_bytes)
+                # A resumable upload only gives up after UPLOAD_ATTEMPTS attempts in a row that committed nothing
+                if resumable is not None and committed[0] > committed_before:
+                    attempt = 0
+                attempt += 1
+                if attempt == UPLOAD_ATTEMPTS:
+                    raise
+                delay = UPLOAD_RETRY_DELAY * 2 ** (attempt - 1)
+                print(f"Uploading {local_path} failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+                if should_stop is not None and should_stop():
+                    raise TransferCancelled(local_path)
+
+    def _download_with_retry(self, cloud_path, local_path, should_stop=None):
+        """Download one file from Firebase Storage, retrying failed attempts with exponential backoff."""
+        for attempt in range(UPLOAD_ATTEMPTS):
+            if should_stop is not None and should_stop():
+                raise TransferCancelled(cloud_path)
+            try:
+                self._thread_storage().child(cloud_path).download(path=cloud_path, filename=local_path)
+                return
+            except Exception as e:
+                if attempt == UPLOAD_ATTEMPTS - 1:
+                    raise
+                delay = UPLOAD_RETRY_DELAY * 2 ** attempt
+                print(f"Downloading {cloud_path} failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+
+    def _download_files(self, downloads, check_cancel_func=None, progress_func=None, max_workers=None):
+        """
+        Download (cloud path, local path, size) files max_workers at a time.
+
+        Returns:
+            (cancelled, files downloaded)
+        """
+        progress = _TransferProgress(sum(download[2] for download in downloads), len(downloads), progress_func)
+        aborted = threading.Event()
+
+        def should_stop():
+            return aborted.is_set() or (check_cancel_func is not None and check_cancel_func())
+
+        def download(cloud_path, local_path):
+            self._download_with_retry(cloud_path, local_path, should_stop)
+            progress.add_bytes(os.path.getsize(local_path))
+            progress.file_done()
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers or UPLOAD_WORKERS)
+        pending = {executor.submit(download, cloud_path, local_path) for cloud_path, local_path, size in downloads}
+        cancelled = False
+        try:
+            while pending and not cancelled:
+                done, pending = concurrent.futures.wait(pending, timeout=PROGRESS_INTERVAL,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                cancelled = should_stop()
+                for future in done:
+                    try:
+                        future.result()
+                    except TransferCancelled:
+                        pass
+        finally:
+            aborted.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+        # A cancel arriving after the last file finished didn't cut anything short
+        return cancelled and progress.files_done < len(downloads), progress.files_done
+
+    def _query_in(self, collection, field, values):
+        """Stream the documents of a collection whose field is one of values, MAX_IN_VALUES values per query."""
+        for start in range(0, len(values), MAX_IN_VALUES):
+            query = self.db.collection(collection).where(field, "in", values[start:start + MAX_IN_VALUES])
+            for doc in query.stream():
+                data = doc.to_dict()
+                data["id"] = doc.id
+                yield data
+
+    def _fetch_subtree(self, folder_data):
+        """
+        Fetch the metadata of all folders and files below a folder.
+
+        Subfolders are fetched a level at a time, so this takes a query per level (and per
+        MAX_IN_VALUES folders) rather than one per folder.
+
+        Returns:
+            (folders, files): the folders by ID in breadth-first order starting with folder_data, and the files in them
+        """
+        folders = {folder_data["id"]: folder_data}
+        level = [folder_data["id"]]
+        while level:
+            next_level = []
+            for subfolder in self._query_in("folders", "parent_folder_id", level):
+                if subfolder["id"] not in folders:
+                    folders[subfolder["id"]] = subfolder
+                    next_level.append(subfolder["id"])
+            level = next_level
+        files = list(self._query_in("files", "folder_id", list(folders)))
+        return folders, files
+
     def upload_file(self, file_path, cloud_path=None, folder_id=None):
         """
         Upload a file to Firebase Storage.
@@ -78,7 +377,8 @@ class FirebaseClient:
             folder_id (str, optional): ID of the folder to upload to
             
         Returns:
-            str: Public URL of the uploaded file
+            str: Public URL of the uploaded file. A file whose content is already stored at cloud_path
+                isn't uploaded again; the URL of the stored file is returned.
         """
         if not self.check_internet_connection():
             raise ConnectionError("No internet connection available. Please connect to the internet and try again.")
@@ -98,11 +398,21 @@ class FirebaseClient:
         if cloud_path is None:
             cloud_path = os.path.basename(file_path)
             
-        # Upload the file
-        self.storage.child(cloud_path).put(file_path)
-        
-        # Get the download URL
-        url = self.storage.child(cloud_path).get_url(None)
+        # Create a document ID based on the file path
+        if folder_id:
+            doc_id = f"{folder_id}_{cloud_path.replace('/', '_')}"
+        else:
+            doc_id = cloud_path.replace('/', '_')
+
+        # Skip the upload if the same content is already stored there
+        fingerprint = file_fingerprint(file_path)
+        existing_doc = self.db.collection("files").document(doc_id).get()
+        existing = existing_doc.to_dict() if existing_doc.exists else None
+        if is_unchanged(existing, fingerprint, cloud_path):
+            return existing["url"]
+            
+        # Upload the file and get its download URL
+        url = self._upload_with_retry(file_path, cloud_path, fingerprint=fingerprint)
         
         # Store metadata in Firestore in the "files" collection
         file_metadata = {
@@ -110,45 +420,40 @@ class FirebaseClient:
             "path": cloud_path,
             "url": url,
             "uploaded_at": datetime.datetime.now().isoformat(),
-            "folder_id": folder_id  # Add folder_id reference if provided
+            "folder_id": folder_id,  # Add folder_id reference if provided
+            **fingerprint
         }
         
-        # Create a document ID based on the file path
+        # Add the file to Firestore with the path-based ID, and to its folder's file list in the same commit.
+        # The folder is updated with server-side transforms, so it isn't read and rewritten per upload.
+        batch = self.db.batch()
+        batch.set(self.db.collection("files").document(doc_id), file_metadata)
         if folder_id:
-            doc_id = f"{folder_id}_{cloud_path.replace('/', '_')}"
-        else:
-            doc_id = cloud_path.replace('/', '_')
-        
-        # Add the file to Firestore with the path-based ID
-        self.db.collection("files").document(doc_id).set(file_metadata)
-        
-        # If folder_id is provided, update the folder's file list
-        if folder_id:
-            # Get the folder document
-            folder_doc = self.db.collection("folders").document(folder_id).get()
-            if folder_doc.exists:
-                folder_data = folder_doc.to_dict()
-                
-                # Update the folder's file list
-                files = folder_data.get("files", [])
-                files.append(file_metadata)
-                
-                # Update the folder document
-                self.db.collection("folders").document(folder_id).update({
-                    "files": files,
-                    "file_count": len(files)
-                })
+            batch.update(self.db.collection("folders").document(folder_id), {
+                "files": firestore.ArrayUnion([file_metadata]),
+                "file_count": firestore.Increment(1)
+            })
+        batch.commit()
         
         return url
         
-    def upload_folder(self, folder_path, cloud_base_path=None, check_cancel_func=None):
+    def upload_folder(self, folder_path, cloud_base_path=None, check_cancel_func=None, progress_func=None,
+                      max_workers=None):
         """
         Upload all files in a folder to Firebase Storage, maintaining folder structure.
+
+        Files are uploaded max_workers at a time, each retried with backoff if it fails. Files
+        whose size and SHA-256 match the metadata of their earlier upload aren't sent again.
+        Cancelling aborts the uploads in flight; the files uploaded until then are kept and
+        added to the file lists of the folder documents, next to the files recorded earlier.
         
         Args:
             folder_path (str): Path to the local folder
             cloud_base_path (str, optional): Base path in cloud storage
             check_cancel_func (callable, optional): Function to call to check if upload should be cancelled
+            progress_func (callable, optional): Called with (bytes_done, total_bytes, files_done, total_files)
+                from the upload threads, at most every PROGRESS_INTERVAL seconds
+            max_workers (int, optional): Files uploaded at once, UPLOAD_WORKERS by default
                 
         Returns:
             dict: Dictionary with folder metadata and URLs of uploaded files
@@ -186,8 +491,13 @@ class FirebaseClient:
             "parent_dir": parent_dir if parent_dir else None
         }
         
-        # Add the folder to Firestore with custom ID in the "folders" collection
-        self.db.collection("folders").document(folder_id).set(folder_metadata)
+        # Metadata is written in batches: the folder documents before the uploads, the file
+        # documents as the uploads finish and the folder file lists at the end
+        metadata = _BatchWriter(self.db)
+        
+        # Add the folder to Firestore with custom ID in the "folders" collection, merged into
+        # the document of an earlier upload so its file list survives until this one is done
+        metadata.set(self.db.collection("folders").document(folder_id), folder_metadata, merge=True)
         
         urls = []
         file_metadata_list = []
@@ -201,7 +511,15 @@ class FirebaseClient:
         for root, dirs, files in os.walk(folder_path):
             # Check for cancellation if function provided
             if check_cancel_func and check_cancel_func():
-                return {"folder_id": folder_id, "urls": urls}
+                metadata.commit()
+                return {
+                    "folder_id": folder_id,
+                    "folder_name": folder_name,
+                    "urls": urls,
+                    "file_count": 0,
+                    "unchanged_count": 0,
+                    "cancelled": True
+                }
                 
             # Check internet connection periodically
             if not self.check_internet_connection():
@@ -244,13 +562,11 @@ class FirebaseClient:
                         "parent_dir": os.path.dirname(rel_path) if os.path.dirname(rel_path) else folder_name,
                         "parent_folder_id": parent_folder_id,
                         "relative_path": rel_path,
-                        "files": [],  # Initialize empty file list
-                        "file_count": 0,
                         "is_subfolder": True
                     }
                     
-                    # Add the subfolder to Firestore
-                    self.db.collection("folders").document(subfolder_id).set(subfolder_metadata)
+                    # Add the subfolder to Firestore; its file list is written once the uploads are done
+                    metadata.set(self.db.collection("folders").document(subfolder_id), subfolder_metadata, merge=True)
                     created_subfolders.add(rel_path)
                     
                     # Map the relative path to the subfolder ID for file assignment
@@ -258,7 +574,8 @@ class FirebaseClient:
                     # Initialize file list for this subfolder
                     subfolder_files[subfolder_id] = []
         
-        # Second pass: upload files and assign them to the correct folders
+        # Second pass: list the files and the folders they belong to
+        uploads = []
         for root, dirs, files in os.walk(folder_path):
             # Process each file in the current directory
             for file in files:
@@ -276,46 +593,111 @@ class FirebaseClient:
                 else:
                     # File is in the root folder
                     file_folder_id = folder_id
-                
-                # Upload the file
-                self.storage.child(cloud_path).put(local_path)
-                download_url = self.storage.child(cloud_path).get_url(None)
-                urls.append(download_url)
-                
-                # Create file metadata
-                file_metadata = {
-                    "filename": file,
-                    "path": cloud_path,
-                    "url": download_url,
-                    "relative_path": rel_path,
-                    "uploaded_at": datetime.datetime.now().isoformat(),
-                    "folder_id": file_folder_id  # Assign to correct folder (root or subfolder)
-                }
-                
-                # Create a document ID based on the folder and file path
-                doc_id = f"{file_folder_id}/{rel_path}".replace('/', '_')
-                
-                # Add individual file to "files" collection with path-based ID
-                self.db.collection("files").document(doc_id).set(file_metadata)
-                
-                # Track files for their respective folders
-                if file_folder_id == folder_id:
-                    # File is in the root folder
-                    file_metadata_list.append(file_metadata)
-                else:
-                    # File is in a subfolder
-                    subfolder_files[file_folder_id].append(file_metadata)
-        
+                uploads.append((file, local_path, rel_path, cloud_path, file_folder_id))
+
+        metadata.commit()
+
+        # Metadata of the files uploaded from this folder before, by document ID
+        existing_files = {file["id"]: file for file in
+                          self._query_in("files", "folder_id", [folder_id] + list(subfolder_id_map.values()))}
+
+        # Upload the files concurrently and record each one as it finishes
+        progress = _TransferProgress(sum(os.path.getsize(upload[1]) for upload in uploads), len(uploads), progress_func)
+        aborted = threading.Event()
+
+        def should_stop():
+            return aborted.is_set() or (check_cancel_func is not None and check_cancel_func())
+
+        def sync_file(local_path, cloud_path, existing):
+            """Upload a file unless its content is already stored. Returns (url, fingerprint, uploaded)."""
+            if should_stop():
+                raise TransferCancelled(local_path)
+            fingerprint = file_fingerprint(local_path)
+            if is_unchanged(existing, fingerprint, cloud_path):
+                progress.add_bytes(fingerprint["size"])
+                return existing["url"], fingerprint, False
+            return self._upload_with_retry(local_path, cloud_path, progress, should_stop, fingerprint), fingerprint, True
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers or UPLOAD_WORKERS)
+        futures = {}
+        for upload in uploads:
+            doc_id = f"{upload[4]}/{upload[2]}".replace('/', '_')
+            futures[executor.submit(sync_file, upload[1], upload[3], existing_files.get(doc_id))] = upload
+        pending = set(futures)
+        cancelled = False
+        unchanged_count = 0
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=PROGRESS_INTERVAL,
+                                                        return_when=concurrent.futures.FIRST_COMPLETED)
+                if should_stop():
+                    cancelled = True
+                for future in done:
+                    try:
+                        download_url, fingerprint, uploaded = future.result()
+                    except TransferCancelled:
+                        continue
+                    file, local_path, rel_path, cloud_path, file_folder_id = futures[future]
+                    progress.file_done()
+                    urls.append(download_url)
+                    
+                    # Create a document ID based on the folder and file path
+                    doc_id = f"{file_folder_id}/{rel_path}".replace('/', '_')
+                    
+                    if uploaded:
+                        # Create file metadata
+                        file_metadata = {
+                            "filename": file,
+                            "path": cloud_path,
+                            "url": download_url,
+                            "relative_path": rel_path,
+                            "uploaded_at": datetime.datetime.now().isoformat(),
+                            "folder_id": file_folder_id,  # Assign to correct folder (root or subfolder)
+                            **fingerprint
+                        }
+                        
+                        # Add individual file to "files" collection with path-based ID
+                        metadata.set(self.db.collection("files").document(doc_id), file_metadata)
+                    else:
+                        # Unchanged since its last upload, its document stays as it is
+                        file_metadata = {key: value for key, value in existing_files[doc_id].items() if key != "id"}
+                        unchanged_count += 1
+                    
+                    # Track files for their respective folders
+                    if file_folder_id == folder_id:
+                        # File is in the root folder
+                        file_metadata_list.append(file_metadata)
+                    else:
+                        # File is in a subfolder
+                        subfolder_files[file_folder_id].append(file_metadata)
+                if cancelled:
+                    break
+        finally:
+            # After a cancel or a failed file, stop the uploads in flight and drop the rest
+            aborted.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            # Record the files that were uploaded, even if a later one failed
+            metadata.commit()
+        
+        folder_files = {folder_id: file_metadata_list, **subfolder_files}
+        if cancelled:
+            # Only some files were synced, keep the entries earlier uploads recorded for the others
+            for recorded_folder_id, recorded in self._recorded_files(folder_files).items():
+                synced = {file["relative_path"] for file in folder_files[recorded_folder_id]}
+                folder_files[recorded_folder_id] = [file for file in recorded if file.get("relative_path") not in synced] \
+                    + folder_files[recorded_folder_id]
+
         # Update the main folder document with root-level file information and parent-child relationships
-        self.db.collection("folders").document(folder_id).update({
-            "files": file_metadata_list,
-            "file_count": len(file_metadata_list),
+        metadata.update(self.db.collection("folders").document(folder_id), {
+            "files": folder_files[folder_id],
+            "file_count": len(folder_files[folder_id]),
             "subfolders": subfolder_paths,
             "child_folders": parent_map.get(folder_id, [])
         })
         
         # Update each subfolder document with its files and child folders
-        for subfolder_id, files_in_subfolder in subfolder_files.items():
+        for subfolder_id in subfolder_files:
+            files_in_subfolder = folder_files[subfolder_id]
             update_data = {
                 "files": files_in_subfolder,
                 "file_count": len(files_in_subfolder)
@@ -325,26 +707,45 @@ class FirebaseClient:
             if subfolder_id in parent_map:
                 update_data["child_folders"] = parent_map[subfolder_id]
                 
-            self.db.collection("folders").document(subfolder_id).update(update_data)
+            metadata.update(self.db.collection("folders").document(subfolder_id), update_data)
+        metadata.commit()
         
         return {
             "folder_id": folder_id,
             "folder_name": folder_name,
             "urls": urls,
-            "file_count": len(file_metadata_list)
+            "file_count": len(file_metadata_list),
+            "unchanged_count": unchanged_count,
+            "cancelled": cancelled
         }
         
-    def download_folder_recursive(self, folder_id, destination=None, _current_path=None):
+    def _recorded_files(self, folder_ids):
+        """The file lists currently recorded in the given folder documents, by folder ID."""
+        recorded = {}
+        for folder_id in folder_ids:
+            folder_doc = self.db.collection("folders").document(folder_id).get()
+            recorded[folder_id] = folder_doc.to_dict().get("files", []) if folder_doc.exists else []
+        return recorded
+
+    def download_folder_recursive(self, folder_id, destination=None, check_cancel_func=None, progress_func=None,
+                                  max_workers=None):
         """
-        Recursively download a folder and all its subfolders with their files.
+        Download a folder and all its subfolders with their files.
+
+        The metadata of the whole folder tree is fetched first, then the files are downloaded
+        max_workers at a time.
         
         Args:
             folder_id (str): ID of the folder to download
-            destination (str, optional): Local destination directory. If None, creates a folder in Downloads
-            _current_path (str, optional): Internal parameter for recursion - current path being built
+            destination (str, optional): Local directory to download the folder into. If None, the folder is created in Downloads
+            check_cancel_func (callable, optional): Function to call to check if the download should be cancelled
+            progress_func (callable, optional): Called with (bytes_done, total_bytes, files_done, total_files)
+                from the download threads
+            max_workers (int, optional): Files downloaded at once, UPLOAD_WORKERS by default
             
         Returns:
-            str: Path to the downloaded folder
+            dict: {"path": path to the downloaded folder, "file_count": files downloaded,
+                "cancelled": whether the download was cancelled before all files were downloaded}
         """
         if not self.check_internet_connection():
             raise ConnectionError("No internet connection available. Please connect to the internet and try again.")
@@ -357,66 +758,51 @@ class FirebaseClient:
                 raise ValueError(f"Folder with ID {folder_id} not found")
                 
             folder_data = folder_doc.to_dict()
+            folder_data["id"] = folder_id
             folder_name = folder_data.get("name", "downloaded_folder")
             
             # Determine the destination path
             if destination is None:
-                # This is the root call, create base destination
                 destination = os.path.join(os.path.expanduser("~"), "Downloads", folder_name)
-                current_destination = destination
+                root_destination = destination
             else:
-                # This is a recursive call, append folder name to current path
-                current_destination = os.path.join(destination, folder_name)
-            
-            # Ensure the directory exists
-            os.makedirs(current_destination, exist_ok=True)
-            
-            # Download all files directly in this folder
-            files = self.list_files(limit=1000, folder_id=folder_id)
-            
-            for file in files:
-                file_path = file.get("path")
-                filename = file.get("filename")
-                relative_path = file.get("relative_path", filename)
-                
-                if file_path:
-                    # For files in subfolders, we only want the filename since we're already in the correct folder
-                    # The relative_path contains the full path from the root, but we're already in the subfolder
-                    file_destination = os.path.join(current_destination, filename)
-                    
-                    # Ensure the file's directory exists
-                    file_dir = os.path.dirname(file_destination)
-                    if file_dir:
-                        os.makedirs(file_dir, exist_ok=True)
-                    
-                    # Download the file
-                    self.storage.child(file_path).download(path=file_path, filename=file_destination)
-            
-            # Find and recursively download all subfolders
-            # Get all folders that have this folder as parent
-            subfolder_query = self.db.collection("folders").where("parent_folder_id", "==", folder_id)
-            
-            for subfolder_doc in subfolder_query.stream():
-                subfolder_id = subfolder_doc.id
-                # Recursively download the subfolder
-                self.download_folder_recursive(subfolder_id, current_destination)
+                root_destination = os.path.join(destination, folder_name)
+
+            folders, files = self._fetch_subtree(folder_data)
+
+            # Lay out the folder tree locally; parents come before their subfolders
+            folder_paths = {}
+            for subfolder_id, subfolder in folders.items():
+                parent_path = folder_paths.get(subfolder.get("parent_folder_id"))
+                if subfolder_id == folder_id or parent_path is None:
+                    folder_paths[subfolder_id] = root_destination
+                else:
+                    folder_paths[subfolder_id] = os.path.join(parent_path, subfolder.get("name", subfolder_id))
+                os.makedirs(folder_paths[subfolder_id], exist_ok=True)
+
+            downloads = [(file["path"], os.path.join(folder_paths[file["folder_id"]], file["filename"]), file.get("size", 0))
+                         for file in files if file.get("path")]
+            cancelled, file_count = self._download_files(downloads, check_cancel_func, progress_func, max_workers)
             
-            # Return the root destination path
-            return destination if _current_path is None else current_destination
+            return {"path": destination, "file_count": file_count, "cancelled": cancelled}
             
         except Exception as e:
             raise Exception(f"Error downloading folder recursively: {str(e)}")
             
-    def download_folder(self, folder_id, destination=None):
+    def download_folder(self, folder_id, destination=None, check_cancel_func=None, progress_func=None, max_workers=None):
         """
         Download all files in a folder to a local directory.
         
         Args:
             folder_id (str): ID of the folder to download
             destination (str, optional): Local destination directory. If None, creates a folder in Downloads
+            check_cancel_func (callable, optional): Function to call to check if the download should be cancelled
+            progress_func (callable, optional): Called with (bytes_done, total_bytes, files_done, total_files)
+            max_workers (int, optional): Files downloaded at once, UPLOAD_WORKERS by default
             
         Returns:
-            str: Path to the downloaded folder
+            dict: {"path": path to the downloaded folder, "file_count": files downloaded,
+                "cancelled": whether the download was cancelled before all files were downloaded}
         """
         if not self.check_internet_connection():
             raise ConnectionError("No internet connection available. Please connect to the internet and try again.")
@@ -439,20 +825,13 @@ class FirebaseClient:
             os.makedirs(destination, exist_ok=True)
             
             # Get all files in the folder
-            files = self.list_files(limit=1000, folder_id=folder_id)
-            
-            if not files:
-                return destination  # Return early if no files to download
+            files = self.list_files(limit=None, folder_id=folder_id)
             
-            # Download each file
-            for file in files:
-                file_path = file.get("path")
-                filename = file.get("filename")
-                if file_path:
-                    file_destination = os.path.join(destination, filename)
-                    self.storage.child(file_path).download(path=file_path, filename=file_destination)
+            downloads = [(file["path"], os.path.join(destination, file["filename"]), file.get("size", 0))
+                         for file in files if file.get("path")]
+            cancelled, file_count = self._download_files(downloads, check_cancel_func, progress_func, max_workers)
             
-            return destination
+            return {"path": destination, "file_count": file_count, "cancelled": cancelled}
         except Exception as e:
             raise Exception(f"Error downloading folder: {str(e)}")
         
@@ -517,7 +896,7 @@ class FirebaseClient:
         List recent files, optionally filtered by folder.
         
         Args:
-            limit (int): Maximum number of files to return
+            limit (int): Maximum number of files to return, None for all of them
             folder_id (str, optional): If provided, only return files from this folder
             
         Returns:
@@ -529,9 +908,11 @@ class FirebaseClient:
         files = []
         
         if folder_id:
-            query = self.db.collection("files").where("folder_id", "==", folder_id).limit(limit)
+            query = self.db.collection("files").where("folder_id", "==", folder_id)
         else:
-            query = self.db.collection("files").order_by("uploaded_at", direction=firestore.Query.DESCENDING).limit(limit)
+            query = self.db.collection("files").order_by("uploaded_at", direction=firestore.Query.DESCENDING)
+        if limit is not None:
+            query = query.limit(limit)
         
         for doc in query.stream():
             data = doc.to_dict()
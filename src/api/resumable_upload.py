@@ -0,0 +1,194 @@
+"""
+Resumable chunked uploads to Firebase Storage.
+
+Large logs are sent in CHUNK_SIZE chunks over the storage resumable upload protocol
+(X-Goog-Upload-* headers). The upload session is saved locally when it starts, so an upload
+interrupted by a network error, or by closing the app, asks the server how much it has
+committed and continues from the last committed chunk instead of from zero.
+
+Set FIREBASE_STORAGE_EMULATOR_HOST (e.g. "127.0.0.1:9199") to upload to the Firebase
+Storage emulator or another local stand-in server instead of the real bucket.
+"""
+import datetime
+import hashlib
+import json
+import mimetypes
+import os
+from urllib.parse import quote
+
+import requests
+
+from api.config import CHUNK_SIZE, REQUEST_TIMEOUT
+
+STORAGE_URL = "https://firebasestorage.googleapis.com/v0/b/"
+
+# Where sessions of unfinished uploads are kept
+SESSION_DIR = os.getenv("FIREBASE_UPLOAD_SESSION_DIR",
+                        os.path.join(os.path.expanduser("~"), ".can_log_uploader", "upload_sessions"))
+
+# Chunks other than the last must be a multiple of this many bytes
+CHUNK_GRANULARITY = 256 * 1024
+
+
+class UploadSessionExpired(Exception):
+    """Raised when the server no longer knows a saved upload session."""
+
+
+def storage_url():
+    """Base URL of the storage REST API, pointing at the emulator if one is configured."""
+    emulator_host = os.getenv("FIREBASE_STORAGE_EMULATOR_HOST")
+    if emulator_host:
+        return f"http://{emulator_host}/v0/b/"
+    return STORAGE_URL
+
+
+class ResumableUpload:
+    """An upload of one local file to one storage path, resumable across attempts and restarts."""
+
+    def __init__(self, bucket, local_path, cloud_path, fingerprint=None, chunk_size=CHUNK_SIZE,
+                 session_dir=SESSION_DIR, base_url=None):
+        self.bucket = bucket
+        self.local_path = os.path.abspath(local_path)
+        self.cloud_path = cloud_path
+        # Round down to the chunk granularity, but send at least one granule per request
+        self.chunk_size = max(chunk_size // CHUNK_GRANULARITY, 1) * CHUNK_GRANULARITY
+        self.base_url = base_url or storage_url()
+        stat = os.stat(self.local_path)
+        # The file a session was started for: a session for a file that changed since is discarded
+        self.file_signature = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": fingerprint["sha256"] if fingerprint else None,
+        }
+        key = hashlib.sha256(f"{self.bucket}\n{self.local_path}\n{cloud_path}".encode("utf-8")).hexdigest()
+        self.session_path = os.path.join(session_dir, f"{key}.json")
+        self.http = requests.Session()
+
+    @property
+    def size(self):
+        return self.file_signature["size"]
+
+    def upload(self, on_progress=None):
+        """
+        Upload the file, resuming a saved session if there is one.
+
+        Args:
+            on_progress (callable, optional): Called before every chunk with the bytes committed by the
+                server so far. An exception raised by it stops the upload and keeps the session to resume.
+
+        Returns:
+            dict: Object metadata returned by the server for the finished upload
+        """
+        upload_url = self._load_session()
+        offset = None
+        if upload_url is not None:
+            try:
+                offset, final = self._query(upload_url)
+            except UploadSessionExpired:
+                upload_url = None
+            else:
+                if final:
+                    self._delete_session()
+                    return {"name": self.cloud_path, "size": str(self.size)}
+                print(f"Resuming upload of {self.local_path} at {offset / 1e6:.1f} of {self.size / 1e6:.1f} MB")
+        if upload_url is None:
+            upload_url = self._start()
+            offset = 0
+
+        with open(self.local_path, 'rb') as file:
+            while True:
+                if on_progress is not None:
+                    on_progress(offset)
+                file.seek(offset)
+                chunk = file.read(self.chunk_size)
+                last = offset + len(chunk) >= self.size
+                response = self.http.post(upload_url, data=chunk, timeout=REQUEST_TIMEOUT, headers={
+                    "X-Goog-Upload-Command": "upload, finalize" if last else "upload",
+                    "X-Goog-Upload-Offset": str(offset),
+                })
+                if response.status_code in (404, 410):
+                    self._delete_session()
+                    raise UploadSessionExpired(self.local_path)
+                response.raise_for_status()
+                if last:
+                    self._delete_session()
+                    if on_progress is not None:
+                        on_progress(self.size)
+                    return response.json()
+                offset = int(response.headers.get("X-Goog-Upload-Size-Received", offset + len(chunk)))
+
+    def _start(self):
+        """Start a new upload session and save it."""
+        content_type = mimetypes.guess_type(self.local_path)[0] or "application/octet-stream"
+        response = self.http.post(
+            f"{self.base_url}{self.bucket}/o",
+            params={"name": self.cloud_path, "uploadType": "resumable"},
+            data=json.dumps({"name": self.cloud_path, "contentType": content_type}),
+            timeout=REQUEST_TIMEOUT,
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(self.size),
+                "X-Goog-Upload-Header-Content-Type": content_type,
+            })
+        response.raise_for_status()
+        upload_url = response.headers["X-Goog-Upload-URL"]
+
+        os.makedirs(os.path.dirname(self.session_path), exist_ok=True)
+        session = {
+            "upload_url": upload_url,
+            "bucket": self.bucket,
+            "local_path": self.local_path,
+            "cloud_path": self.cloud_path,
+            "started_at": datetime.datetime.now().isoformat(),
+            **self.file_signature,
+        }
+        # Write and rename, so an interrupted write never leaves a broken session behind
+        temp_path = self.session_path + ".tmp"
+        with open(temp_path, 'w') as session_file:
+            json.dump(session, session_file)
+        os.replace(temp_path, self.session_path)
+        return upload_url
+
+    def _query(self, upload_url):
+        """
+        Ask the server how much of a session it has committed.
+
+        Returns:
+            (bytes committed, whether the upload is already finished)
+        """
+        response = self.http.post(upload_url, timeout=REQUEST_TIMEOUT, headers={"X-Goog-Upload-Command": "query"})
+        if response.status_code in (404, 410):
+            self._delete_session()
+            raise UploadSessionExpired(self.local_path)
+        response.raise_for_status()
+        status = response.headers.get("X-Goog-Upload-Status")
+        if status not in ("active", "final"):
+            self._delete_session()
+            raise UploadSessionExpired(self.local_path)
+        return int(response.headers.get("X-Goog-Upload-Size-Received", 0)), status == "final"
+
+    def _load_session(self):
+        """Return the upload URL of the saved session, if there is one for this file as it is now."""
+        try:
+            with open(self.session_path) as session_file:
+                session = json.load(session_file)
+        except (OSError, ValueError):
+            return None
+        signature = {key: session.get(key) for key in self.file_signature}
+        if signature != self.file_signature or session.get("cloud_path") != self.cloud_path:
+            self._delete_session()
+            return None
+        return session.get("upload_url")
+
+    def _delete_session(self):
+        try:
+            os.remove(self.session_path)
+        except FileNotFoundError:
+            pass
+
+
+def object_url(base_url, bucket, cloud_path):
+    """URL of an uploaded object, in the format pyrebase's get_url uses."""
+    return f"{base_url}{bucket}/o/{quote(cloud_path, safe='')}?alt=media"
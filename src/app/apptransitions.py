@@ -11,16 +11,17 @@ class UITransitionManager(QObject):
         self.parent = parent
     
     def show_loading_screen(self, message="Processing...", disable_sender_controls=False):
-        """Show the loading screen with customizable message and button states."""
+        """
+        Show the loading screen with customizable message and button states.
+
+        The file buttons stay enabled: choosing another file cancels the running load.
+        """
         self.parent.loading_frame.show()
         self.parent.sender_frame.hide()
         self.parent.update_btn.hide()
-        self.parent.TXT_folder_btn.setEnabled(False)
-        self.parent.TXT_file_btn.setEnabled(False)
-        self.parent.CSV_folder_btn.setEnabled(False)
-        self.parent.CSV_file_btn.setEnabled(False)
         self.parent.loading_label.setText(message)
         self.parent.progress_text.setText("")
+        self.parent.progress_bar.setRange(0, 0)  # Indeterminate until progress is reported
         
         if disable_sender_controls:
             self.parent.update_btn.setEnabled(False)
@@ -48,6 +49,11 @@ class UITransitionManager(QObject):
     def update_progress_text(self, message):
         """Update progress text."""
         self.parent.progress_text.setText(message)
+
+    def update_progress_bar(self, progress):
+        """Show how far a conversion is, from a ConversionProgress.as_dict()."""
+        self.parent.progress_bar.setRange(0, 1000)
+        self.parent.progress_bar.setValue(int(progress["fraction"] * 1000))
     
     def update_checkbox_highlight(self, index):
         """Update the visual highlight for the selected checkbox."""
@@ -1,8 +1,9 @@
 import os
+import threading
 from PyQt5.QtWidgets import (
-    QDialog, QMessageBox, QApplication
+    QDialog, QMessageBox, QApplication, QProgressDialog
 )
-from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal
 from api.firebase_client import FirebaseClient
 from app.cloudaccessgui import CloudAccessGUI
 
@@ -12,6 +13,8 @@ class CloudAccessPanel(QDialog):
     
     file_selected_signal = pyqtSignal(str)
     folder_selected_signal = pyqtSignal(str)
+    download_progress_signal = pyqtSignal(int, str)
+    download_finished_signal = pyqtSignal(str, str)
     
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -27,9 +30,16 @@ class CloudAccessPanel(QDialog):
         # Dictionaries to store data by item
         self.folder_items = {}  # Will store folder data by item id
         self.file_items = {}    # Will store file data by item id
+
+        # Progress dialog of a running folder download, and whether it should stop
+        self.download_dialog = None
+        self.cancel_requested = False
         
         # Initialize the GUI
         self.gui = CloudAccessGUI(self)
+
+        self.download_progress_signal.connect(self.update_download_progress)
+        self.download_finished_signal.connect(self.on_download_finished)
         
         # Load data
         self.load_cloud_data()
@@ -212,20 +222,64 @@ class CloudAccessPanel(QDialog):
             QMessageBox.warning(self, "Warning", "Please select a folder to download!")
             return
             
+        if self.download_dialog is not None:
+            QMessageBox.warning(self, "Warning", "A folder is already being downloaded!")
+            return
+
+        # Download the folder and all its files and subfolders in a background thread
+        self.cancel_requested = False
+        self.download_dialog = QProgressDialog(f"Downloading folder '{folder['name']}'...", "Cancel", 0, 100, self)
+        self.download_dialog.setWindowTitle("Downloading")
+        self.download_dialog.setWindowModality(Qt.WindowModal)
+        self.download_dialog.setMinimumDuration(0)
+        self.download_dialog.canceled.connect(self.cancel_download)
+        self.download_dialog.setValue(0)
+        thread = threading.Thread(target=self._download_folder_thread, args=(folder["id"],), daemon=True)
+        thread.start()
+
+    def _download_folder_thread(self, folder_id):
+        """Thread function to download a folder."""
         try:
-            # Show processing
-            QApplication.processEvents()
-            
-            # Get folder ID
-            folder_id = folder["id"]
-            folder_name = folder["name"]
-            
-            # Download the folder
-            QMessageBox.information(self, "Download Started", f"Starting recursive download of folder '{folder_name}' and all its subfolders.\nThis may take a while depending on the folder size and structure.")
-            
-            # Download the folder and all its files and subfolders recursively
-            local_path = self.firebase.download_folder_recursive(folder_id)
-            
-            QMessageBox.information(self, "Download Complete", f"Folder and all subfolders downloaded to:\n{local_path}")
+            result = self.firebase.download_folder_recursive(folder_id, check_cancel_func=self.is_cancel_requested,
+                                                             progress_func=self.on_download_progress)
+            if result["cancelled"]:
+                self.download_finished_signal.emit(
+                    "", f"Download cancelled, the {result['file_count']} files downloaded so far are in:\n{result['path']}")
+            else:
+                self.download_finished_signal.emit("", f"Folder and all subfolders downloaded to:\n{result['path']}")
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to download folder: {str(e)}")
+            self.download_finished_signal.emit(f"Failed to download folder: {str(e)}", "")
+
+    def cancel_download(self):
+        """Ask the running folder download to stop."""
+        self.cancel_requested = True
+
+    def is_cancel_requested(self):
+        return self.cancel_requested
+
+    def on_download_progress(self, bytes_done, total_bytes, files_done, total_files):
+        """Report the progress of a folder download (called from the download threads)."""
+        percent = int(100 * files_done / total_files) if total_files else 100
+        self.download_progress_signal.emit(percent, f"Downloaded {files_done} of {total_files} files ({bytes_done / 1e6:.1f} MB)")
+
+    def update_download_progress(self, percent, message):
+        """Update the progress dialog from the signal."""
+        if self.download_dialog is not None and not self.cancel_requested:
+            self.download_dialog.setLabelText(message)
+            # Reaching the maximum would close the dialog before the download has finished
+            self.download_dialog.setValue(min(percent, 99))
+
+    def on_download_finished(self, error, message):
+        """Close the progress dialog and show the result (called on main thread)."""
+        self.download_dialog.canceled.disconnect(self.cancel_download)
+        self.download_dialog.close()
+        self.download_dialog = None
+        if error:
+            QMessageBox.critical(self, "Error", error)
+        else:
+            QMessageBox.information(self, "Download Complete", message)
+
+    def closeEvent(self, event):
+        """Stop a running download when the panel is closed."""
+        self.cancel_download()
+        super().closeEvent(event)
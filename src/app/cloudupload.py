@@ -23,6 +23,9 @@ class CloudUploadPanel(QDialog):
         
         # Initialize Firebase client
         self.firebase = FirebaseClient.get_instance()
+
+        # Set to stop a running folder upload
+        self.cancel_requested = False
         
         # Initialize the GUI
         self.gui = CloudUploadGUI(self)
@@ -53,6 +56,7 @@ class CloudUploadPanel(QDialog):
             return
         
         # Show progress UI
+        self.cancel_requested = False
         self.gui.show_progress()
         
         # Start upload in a background thread
@@ -108,10 +112,11 @@ class CloudUploadPanel(QDialog):
             self.update_progress_from_thread(20, f"Analyzing folder structure for '{folder_name}'...")
             
             # Use the comprehensive upload_folder method that properly handles subfolders
-            result = self.firebase.upload_folder(folder_path)
+            result = self.firebase.upload_folder(folder_path, check_cancel_func=self.is_cancel_requested,
+                                                 progress_func=self.on_folder_progress)
             
             # Update progress
-            self.update_progress_from_thread(100, "Upload complete!")
+            self.update_progress_from_thread(100, "Upload cancelled" if result["cancelled"] else "Upload complete!")
             
             # Show success message with details from the upload result
             folder_name = result["folder_name"]
@@ -124,12 +129,38 @@ class CloudUploadPanel(QDialog):
                 print(f"Folder '{folder_name}' (ID: {folder_id}) successfully stored in Firestore")
             else:
                 print(f"WARNING: Folder '{folder_name}' (ID: {folder_id}) not found in Firestore after upload!")
+
+            if result["cancelled"]:
+                self.on_success_from_thread(f"Upload of '{folder_name}' cancelled, {len(result['urls'])} files were uploaded.")
+                return
                 
-            self.on_success_from_thread(f"Folder '{folder_name}' with {file_count} files uploaded successfully!")
+            message = f"Folder '{folder_name}' with {file_count} files uploaded successfully!"
+            if result["unchanged_count"]:
+                message += f"\n{result['unchanged_count']} unchanged files were already in the cloud and were skipped."
+            self.on_success_from_thread(message)
             
         except Exception as e:
             self.on_error_from_thread(f"Error uploading folder: {str(e)}")
     
+    def cancel_upload(self):
+        """Ask the running folder upload to stop."""
+        self.cancel_requested = True
+
+    def is_cancel_requested(self):
+        return self.cancel_requested
+
+    def on_folder_progress(self, bytes_done, total_bytes, files_done, total_files):
+        """Report the byte progress of a folder upload (called from the upload threads)."""
+        # The first 20% of the bar is preparing the folder
+        percent = 20 + int(79 * bytes_done / total_bytes) if total_bytes else 99
+        self.update_progress_from_thread(
+            percent, f"Uploaded {files_done} of {total_files} files ({bytes_done / 1e6:.1f} of {total_bytes / 1e6:.1f} MB)")
+
+    def closeEvent(self, event):
+        """Stop a running upload when the panel is closed."""
+        self.cancel_upload()
+        super().closeEvent(event)
+
     def update_progress_from_thread(self, progress, message):
         """Update progress from the background thread via signal."""
         self.upload_progress_signal.emit(progress, message)
@@ -84,7 +84,7 @@ class CloudUploadGUI:
         progress_layout.addWidget(self.progress_label)
         
         self.upload_progress = QProgressBar()
-        self.upload_progress.setRange(0, 0)  # Indeterminate progress
+        self.upload_progress.setRange(0, 100)
         self.upload_progress.setObjectName("progress_bar")
         progress_layout.addWidget(self.upload_progress)
         
@@ -92,6 +92,11 @@ class CloudUploadGUI:
         self.progress_text.setAlignment(Qt.AlignCenter)
         self.progress_text.setObjectName("progress_text")
         progress_layout.addWidget(self.progress_text)
+
+        self.cancel_btn = QPushButton("Cancel Upload")
+        self.cancel_btn.clicked.connect(self.parent.cancel_upload)
+        self.cancel_btn.setObjectName("close_btn")
+        progress_layout.addWidget(self.cancel_btn)
         
         # Initially hide the progress frame
         self.progress_frame.hide()
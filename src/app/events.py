@@ -0,0 +1,106 @@
+import json
+
+import numpy as np
+
+from app.signalstore import sample_values
+
+# Most samples per signal sent in one event, larger backlogs are split over several events
+MAX_EVENT_SAMPLES = 16384
+
+
+class SampleCursor:
+    """
+    Remembers how far each signal has been sent on an event stream, so every new
+    snapshot only costs a binary search per signal to find what was appended.
+
+    Positions are kept as (time of the last sent sample, samples sent at that time), which
+    stays correct when a live store drops old samples or later batches add samples with
+    the same timestamp.
+    """
+
+    def __init__(self, signals=None, since_ms=None):
+        self.signals = signals
+        self.since_ms = since_ms  # Samples after this are new for signals not seen yet
+        self.positions = {}
+        self.pending = set()  # Signals with samples left over by the last batch
+
+    def skip_to_end(self, store):
+        """Mark everything in store as sent, so only data published later is streamed."""
+        newest = None
+        for name in store.resolve_signals(self.signals):
+            times = store.series[name].times
+            if len(times):
+                last = int(times[-1])
+                count = len(times) - int(np.searchsorted(times, last, side="left"))
+                self.positions[name] = (last, count)
+                newest = last if newest is None else max(newest, last)
+        if newest is not None:
+            self.since_ms = newest
+
+    def next_batch(self, store, max_samples=MAX_EVENT_SAMPLES):
+        """
+        Return {name: (times, values)} of up to max_samples unsent samples per signal and advance past them.
+
+        An empty dict means everything has been sent.
+        """
+        batch = {}
+        self.pending = set()
+        for name in store.resolve_signals(self.signals):
+            series = store.series[name]
+            times = series.times
+            if name in self.positions:
+                last, count = self.positions[name]
+                lo = int(np.searchsorted(times, last, side="right"))
+                # Samples at that time beyond the ones sent were added by a later batch. If old
+                # samples were dropped, fewer (or none) are left at that time and nothing new is skipped.
+                same = lo - int(np.searchsorted(times, last, side="left"))
+                lo -= max(same - count, 0)
+            elif self.since_ms is not None:
+                lo = int(np.searchsorted(times, self.since_ms, side="right"))
+            else:
+                lo = 0
+            hi = min(len(times), lo + max_samples)
+            if lo >= hi:
+                continue
+
+            block_times = times[lo:hi]
+            labels = None if series.labels is None else series.labels[lo:hi]
+            batch[name] = (block_times, sample_values(series.values[lo:hi], labels))
+
+            last = int(block_times[-1])
+            count = hi - int(np.searchsorted(times, last, side="left"))
+            self.positions[name] = (last, count)
+            if hi < len(times):
+                self.pending.add(name)
+        return batch
+
+    def last_event_id(self):
+        """
+        Timestamp up to which every signal has been sent, used as the event id so a reconnecting
+        client resumes after it.
+
+        While a backlog is split over several events, that is the oldest last sent sample of the
+        signals with samples left, so their unsent samples aren't lost on a reconnect (others may
+        be sent again). Once all is sent, it is the newest sent timestamp.
+        """
+        if self.pending:
+            return min(self.positions[name][0] for name in self.pending)
+        if not self.positions:
+            return self.since_ms
+        return max(last for last, _ in self.positions.values())
+
+
+def batch_to_event(batch, event_id=None):
+    """
+    Format a batch as a server-sent event with columnar JSON data,
+    e.g. {"IVT_T": {"time": [...], "value": [...]}}.
+    """
+    data = {
+        name: {"time": times.tolist(), "value": [None if value != value else value for value in values]}
+        for name, (times, values) in batch.items()
+    }
+    lines = ["event: samples"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
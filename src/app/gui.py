@@ -11,18 +11,16 @@ import threading
 import re
 
 from app.server import run_server
+from app.sharedserving import run_shared_server
 from app.threadmanagement import ThreadManager
 from app.apptransitions import UITransitionManager
 from app.uploadselection import UploadSelection
 from app.checkboxmanagement import CheckboxManager
 from app.threading_scripts.shared_data import shared_data_manager
-from app.cloudupload import CloudUploadPanel
-from app.cloudaccess import CloudAccessPanel
-from api.login import LoginDialog
 
 
 class CANLogUploader(QWidget):
-    def __init__(self):
+    def __init__(self, server_workers=0):
         self.csv_data_id = None  # Store data ID instead of data
         self.sender_checkboxes = {}
         self.parsed_data = StringIO()
@@ -33,8 +31,13 @@ class CANLogUploader(QWidget):
         self.thread_manager.parsing_completed.connect(self.on_parsing_completed)
         self.thread_manager.processing_completed.connect(self.on_processing_completed)
 
-        server_thread = threading.Thread(target=run_server, daemon=True)
-        server_thread.start()
+        # Serve from a thread in this process, or from a pool of processes sharing the snapshot memory
+        self.server_pool = None
+        if server_workers > 0:
+            self.server_pool = run_shared_server(server_workers)
+        else:
+            server_thread = threading.Thread(target=run_server, daemon=True)
+            server_thread.start()
 
         super().__init__()
         
@@ -45,6 +48,7 @@ class CANLogUploader(QWidget):
         
         # Connect thread manager signals directly to UI transition manager methods
         self.thread_manager.progress_update.connect(self.ui_transitions.update_progress_text)
+        self.thread_manager.conversion_progress.connect(self.ui_transitions.update_progress_bar)
         self.thread_manager.show_loading.connect(self.ui_transitions.show_loading_screen)
         self.thread_manager.hide_loading.connect(self.ui_transitions.hide_loading_screen)
         
@@ -99,6 +103,12 @@ class CANLogUploader(QWidget):
         self.TXT_folder_btn.setObjectName("file_btn")
         button_layout_TXT.addWidget(self.TXT_folder_btn)
 
+        # Live follow button
+        self.TXT_follow_btn = QPushButton("Follow Live TXT File")
+        self.TXT_follow_btn.clicked.connect(self.upload_selection.follow_TXT_file)
+        self.TXT_follow_btn.setObjectName("file_btn")
+        button_layout_TXT.addWidget(self.TXT_follow_btn)
+
         layout.addLayout(button_layout_CSV)
         layout.addLayout(button_layout_TXT)
 
@@ -146,6 +156,11 @@ class CANLogUploader(QWidget):
         self.progress_text.setAlignment(Qt.AlignCenter)
         self.progress_text.setObjectName("progress_text")
         loading_layout.addWidget(self.progress_text)
+
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.cancel_loading)
+        self.cancel_btn.setObjectName("file_btn")
+        loading_layout.addWidget(self.cancel_btn)
         
         # Initially hide the loading frame
         self.loading_frame.hide()
@@ -248,6 +263,10 @@ class CANLogUploader(QWidget):
     
     def open_cloud_upload_panel(self):
         """Open the cloud upload panel."""
+        # The cloud panels pull in firebase, so they are only imported once they are opened
+        from api.login import LoginDialog
+        from app.cloudupload import CloudUploadPanel
+
         login_dialog = LoginDialog(self)
         result = login_dialog.exec_()
             
@@ -257,6 +276,9 @@ class CANLogUploader(QWidget):
     
     def open_cloud_access_panel(self):
         """Open the cloud access panel."""
+        from api.login import LoginDialog
+        from app.cloudaccess import CloudAccessPanel
+
         login_dialog = LoginDialog(self)
         result = login_dialog.exec_()
             
@@ -274,7 +296,7 @@ class CANLogUploader(QWidget):
         # Update server with filtered data
         self.update_server_filtered()
     
-    def on_processing_completed(self, csv_bytes):
+    def on_processing_completed(self, snapshot):
         """Handle completion of CSV processing."""
         self.ui_transitions.show_sender_frame()
         self.ui_transitions.recenter_window()
@@ -282,6 +304,14 @@ class CANLogUploader(QWidget):
         filtered_count = len(self.checkbox_manager.get_filtered_data())
         QMessageBox.information(self, "Success", f"Server updated with {filtered_count} rows from selected senders.")
 
+    def cancel_loading(self):
+        """Cancel the running load and go back to where it was started from."""
+        self.thread_manager.cancel_current_job()
+        self.ui_transitions.hide_loading_screen()
+        if self.thread_manager.csv_data_id:
+            # Only processing for the server was cancelled, the parsed signals are still there
+            self.ui_transitions.show_sender_frame()
+
     def update_server_filtered(self):
         """Update server with filtered data based on selected checkboxes."""
         selected_senders = self.checkbox_manager.get_selected_senders()
@@ -308,4 +338,6 @@ class CANLogUploader(QWidget):
         """Clean up resources when window closes."""
         # Clean up resources using thread manager
         self.thread_manager.cleanup()
+        if self.server_pool is not None:
+            self.server_pool.stop()
         event.accept()
\ No newline at end of file
@@ -0,0 +1,112 @@
+"""
+Headless ingest-and-serve: convert or parse a path, keep the signals matching a regex and
+serve them through app.server, without a GUI.
+
+Used by `python main.py serve PATH` on machines without a display, e.g. a lab server or a
+container next to Grafana. Nothing imported here may pull in PyQt5.
+"""
+import os
+import re
+import time
+from pathlib import Path
+
+from app.server import publish_snapshot, make_dataset_id
+from app.signalstore import SignalStore
+from app.snapshot import Snapshot
+from parsing.csv_reading.csv_parse import parse_csv, rows_to_csv_bytes
+from parsing.raw_parsing.parse_tcu_data import iter_parse_raw_files
+
+# Minimum time between two printed conversion progress lines, in seconds
+PROGRESS_PRINT_INTERVAL = 2.0
+
+
+def find_input_files(path):
+    """
+    Find the logs to load from a file or folder.
+
+    Returns:
+        (files, raw) where raw tells whether the files are raw .TXT logs that need converting.
+        A folder is raw if it has any .TXT logs, like "Select Folder of TXTs" in the GUI.
+    """
+    if os.path.isfile(path):
+        return [path], path.lower().endswith('.txt')
+    raw_files = [str(file) for file in Path(path).rglob('*.TXT')]
+    if raw_files:
+        return raw_files, True
+    csv_files = []
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            if file.lower().endswith('.csv'):
+                csv_files.append(os.path.join(root, file))
+    return csv_files, False
+
+
+def _print_progress():
+    """Conversion progress callback printing at most every PROGRESS_PRINT_INTERVAL seconds."""
+    last_print = [0.0]
+
+    def on_progress(progress):
+        now = time.monotonic()
+        if now - last_print[0] >= PROGRESS_PRINT_INTERVAL:
+            last_print[0] = now
+            print(progress.format())
+    return on_progress
+
+
+def load_rows(path):
+    """Convert (if raw) and parse the logs at path into rows, like the GUI does."""
+    files, raw = find_input_files(path)
+    if not files:
+        print(f"No logs found in {path}")
+        return []
+    if raw:
+        folder = path if os.path.isdir(path) else os.path.dirname(path)
+        files = [str(file) for file in iter_parse_raw_files(folder, files, _print_progress())]
+
+    rows = []
+    for i, file in enumerate(files):
+        print(f"Processing file {i+1} of {len(files)}: {os.path.basename(file)}")
+        file_data = parse_csv(file)
+        if file_data is None:
+            print(f"Skipping invalid file: {os.path.basename(file)}")
+            continue
+        rows.extend(file_data)
+    print(f"Total rows loaded: {len(rows)}")
+    return rows
+
+
+def filter_rows(rows, signal_pattern=None):
+    """Keep the rows whose signal matches signal_pattern (searched case-insensitively, like the GUI's regex filter)."""
+    if not signal_pattern:
+        return rows
+    regex = re.compile(signal_pattern, re.IGNORECASE)
+    matches = {}
+    filtered = []
+    for row in rows:
+        sender = str(row['sender']).strip()
+        if sender not in matches:
+            matches[sender] = regex.search(sender) is not None
+        if matches[sender]:
+            filtered.append(row)
+    print(f"{sum(matches.values())} of {len(matches)} signals match {signal_pattern!r}")
+    return filtered
+
+
+def build_snapshot(rows):
+    """Build a publishable snapshot of rows, as CSVProcessingThread does."""
+    return Snapshot(rows_to_csv_bytes(rows), SignalStore.from_rows(rows))
+
+
+def load_and_publish(path, signal_pattern=None, dataset_id=None):
+    """
+    Load the logs at path, keep the matching signals and publish them.
+
+    Returns:
+        The published Snapshot
+    """
+    dataset_id = dataset_id or make_dataset_id(path)
+    rows = filter_rows(load_rows(path), signal_pattern)
+    snapshot = build_snapshot(rows)
+    publish_snapshot(snapshot, dataset_id)
+    print(f"Serving {len(rows)} rows as /datasets/{dataset_id}")
+    return snapshot
@@ -0,0 +1,171 @@
+"""Grafana JSON datasource protocol (SimpleJSON / JSON API) on top of the published store."""
+import re
+from datetime import datetime
+
+import numpy as np
+
+from parsing.raw_parsing.dtc import load_dtc_codes
+
+# Signals that carry diagnostic trouble codes, served as annotations. Each board sends them in
+# its own message, decoded as "<message>.DTC_CODE"; older CSVs only have the bare names.
+DTC_CODE_SIGNAL = "DTC_CODE"
+DTC_DATA_SIGNAL = "DTC_Data"
+
+# Default number of points per target when Grafana doesn't send maxDataPoints
+DEFAULT_MAX_POINTS = 1000
+
+
+def parse_time(value):
+    """Convert a Grafana range bound (ISO 8601 string or epoch ms) to epoch milliseconds."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def parse_range(body):
+    """Return (start_ms, end_ms) from a request's range, or (None, None) if there is none."""
+    time_range = body.get("range") or {}
+    return parse_time(time_range.get("from")), parse_time(time_range.get("to"))
+
+
+def search(store, body):
+    """List signal names, optionally filtered by the target as a case-insensitive regex."""
+    names = store.signal_names() if store is not None else []
+    target = (body.get("target") or "").strip()
+    if target:
+        try:
+            pattern = re.compile(target, re.IGNORECASE)
+        except re.error:
+            raise ValueError(f"Invalid search pattern: {target}")
+        names = [name for name in names if pattern.search(name)]
+    return sorted(names)
+
+
+def metrics(store, body):
+    """Same as search, in the {label, value} shape used by the JSON API datasource."""
+    body = {"target": body.get("metric", body.get("target", ""))}
+    return [{"label": name, "value": name} for name in search(store, body)]
+
+
+def query_cache_key(body):
+    """Normalize a /query body to the fields that change its result."""
+    start_ms, end_ms = parse_range(body)
+    targets = tuple(sorted((str(target.get("target")), str(target.get("type")), str(target.get("refId")))
+                           for target in body.get("targets", []) if target.get("target") and not target.get("hide")))
+    return repr((start_ms, end_ms, int(body.get("maxDataPoints") or DEFAULT_MAX_POINTS), targets))
+
+
+def query(store, body):
+    """
+    Answer every target of a /query request in one pass over the store.
+
+    The range and point budget are resolved once and all targets are looked up
+    together, each from the rollup level that fits maxDataPoints.
+    """
+    start_ms, end_ms = parse_range(body)
+    max_points = int(body.get("maxDataPoints") or DEFAULT_MAX_POINTS)
+    targets = [target for target in body.get("targets", []) if target.get("target") and not target.get("hide")]
+    if store is None or not targets:
+        return []
+
+    results = store.query([target["target"] for target in targets], start_ms, end_ms, max_points)
+
+    response = []
+    for target, name in [(target, name) for target in targets for name in store.resolve_signals([target["target"]])]:
+        level = results[name]
+        means = level.sums / level.counts
+        valid = ~np.isnan(means)
+        values = means[valid].tolist()
+        times = level.times[valid].tolist()
+        if target.get("type") == "table":
+            response.append({
+                "type": "table",
+                "refId": target.get("refId"),
+                "columns": [{"text": "Time", "type": "time"}, {"text": name, "type": "number"}],
+                "rows": [[time, value] for time, value in zip(times, values)],
+            })
+        else:
+            response.append({
+                "target": name,
+                "refId": target.get("refId"),
+                "datapoints": [[value, time] for value, time in zip(values, times)],
+            })
+    return response
+
+
+def dtc_messages(store):
+    """Return (message, code signal, data signal) for every DTC message in the store."""
+    messages = []
+    for name in store.signal_names():
+        message, _, signal = name.rpartition(".")
+        if signal == DTC_CODE_SIGNAL:
+            prefix = f"{message}." if message else ""
+            messages.append((message, name, f"{prefix}{DTC_DATA_SIGNAL}"))
+    return messages
+
+
+def annotations(store, body):
+    """
+    Serve DTC events as annotations.
+
+    An event is emitted whenever a DTC message's DTC_CODE changes to a non-zero code, so
+    the boards sending DTCs are followed separately and tagged with their message.
+    The annotation query, when set, filters events by DTC name, origin or message.
+    """
+    annotation = body.get("annotation") or {}
+    if store is None:
+        return []
+
+    start_ms, end_ms = parse_range(body)
+    query_filter = (annotation.get("query") or "").strip().lower()
+    dtc_codes = load_dtc_codes()
+
+    response = []
+    for message, code_signal, data_signal in dtc_messages(store):
+        codes = store.series[code_signal]
+        lo, hi = codes.range_indices(codes.times, start_ms, end_ms)
+        times = codes.times[lo:hi]
+        values = codes.values[lo:hi]
+
+        # Only keep transitions to a new non-zero code
+        changed = np.concatenate(([True], values[1:] != values[:-1])) if len(values) else np.zeros(0, dtype=bool)
+        events = np.flatnonzero(changed & (values > 0))
+
+        data = store.series.get(data_signal)
+        for index in events.tolist():
+            time = int(times[index])
+            code = int(values[index])
+            dtc = dtc_codes.get(code, {"name": f"DTC {code}", "origin": "", "severity": "", "message": ""})
+            if query_filter and not any(query_filter in field.lower() for field in (dtc["name"], dtc["origin"], message)):
+                continue
+
+            text = dtc["message"]
+            if data is not None and "#data" in text:
+                position = int(np.searchsorted(data.times, time))
+                if position < len(data) and data.times[position] == time:
+                    text = text.replace("#data", f"{data.values[position]:g}")
+
+            tags = (message, dtc["origin"], f"severity {dtc['severity']}" if dtc["severity"] else "")
+            response.append({
+                "annotation": annotation,
+                "time": time,
+                "title": dtc["name"],
+                "text": text,
+                "tags": [tag for tag in tags if tag],
+            })
+    response.sort(key=lambda event: event["time"])
+    return response
+
+
+# Protocol endpoints served over POST
+ROUTES = {
+    "/search": search,
+    "/metrics": metrics,
+    "/query": query,
+    "/annotations": annotations,
+}
@@ -0,0 +1,269 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.signalstore import ROLLUP_BUCKETS_MS, RollupLevel, SignalSeries, SignalStore
+
+# Raw log timestamps (ms since the logger started) are placed on the same base date parse_csv uses
+LIVE_BASE_TIME_MS = int(datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+class _Column:
+    """
+    Append-only numpy array with spare capacity, handed out as views of its filled part.
+
+    Appends write past the end of earlier views and nothing is ever rewritten in place, so
+    views taken for a published snapshot stay valid and unchanged.
+
+    Dropping from the front only moves the start. The kept part is moved into a new buffer
+    once the buffer is full, so a column that is trimmed as it grows works as a ring buffer
+    whose memory stays bounded by its retained length.
+    """
+
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.start = 0
+        self.end = 0
+
+    def view(self):
+        return self.data[self.start:self.end]
+
+    def drop_front(self, count):
+        self.start = min(self.start + count, self.end)
+
+    def append(self, values):
+        length = self.end - self.start
+        needed = self.end + len(values)
+        if needed > len(self.data):
+            # Grow geometrically so appends are amortized O(len(values)), and drop the trimmed front.
+            # A new buffer is used so views of the old one stay intact.
+            capacity = max(len(self.data), 2 * (length + len(values)))
+            grown = np.empty(capacity, dtype=self.data.dtype)
+            grown[:length] = self.data[self.start:self.end]
+            self.data, self.start, self.end = grown, 0, length
+            needed = length + len(values)
+        self.data[self.end:needed] = values
+        self.end = needed
+
+    def __getitem__(self, index):
+        return self.data[self.start + index]
+
+    def __len__(self):
+        return self.end - self.start
+
+
+class _LiveLevel:
+    """
+    A rollup level: its closed buckets in growable columns and its last, still open bucket
+    in a separate one-bucket level that is replaced (never modified) as samples arrive.
+    """
+
+    FIELDS = RollupLevel.FIELDS
+    DTYPES = (np.int64, np.float64, np.float64, np.float64, np.int64)
+
+    def __init__(self, bucket_ms):
+        self.bucket_ms = bucket_ms
+        self.columns = {field: _Column(dtype) for field, dtype in zip(self.FIELDS, self.DTYPES)}
+        self.open = RollupLevel.empty(bucket_ms)
+
+    def view(self):
+        """The level as a RollupLevel sharing the closed buckets, with the open bucket as its tail."""
+        return RollupLevel(self.bucket_ms, *(self.columns[field].view() for field in self.FIELDS), tail=self.open)
+
+    def open_since(self):
+        """Time from which buckets may still change: the open bucket's start, None if there are no buckets."""
+        if len(self.open):
+            return int(self.open.times[0])
+        times = self.columns["times"]
+        if len(times):
+            return int(times[len(times) - 1]) + self.bucket_ms
+        return None
+
+    def drop_before(self, time_ms):
+        """Drop the buckets that end at or before time_ms."""
+        # A bucket ends at or before time_ms if it starts at or before time_ms - bucket_ms
+        times = self.columns["times"].view()
+        count = int(np.searchsorted(times, time_ms - self.bucket_ms, side="right"))
+        for column in self.columns.values():
+            column.drop_front(count)
+        if not len(self.columns["times"]) and len(self.open) and self.open.times[0] + self.bucket_ms <= time_ms:
+            self.open = RollupLevel.empty(self.bucket_ms)
+
+    def replace_open(self, level):
+        """Replace the open bucket with the buckets of level; all but its last one are closed."""
+        closed = len(level) - 1
+        if closed > 0:
+            for field in self.FIELDS:
+                self.columns[field].append(getattr(level, field)[:closed])
+        self.open = level.slice(max(closed, 0), len(level))
+
+    def __len__(self):
+        return len(self.columns["times"]) + len(self.open)
+
+
+class LiveSeries:
+    """A signal that grows while it is being served, with its rollup pyramid kept up to date."""
+
+    def __init__(self, name, buckets_ms=ROLLUP_BUCKETS_MS):
+        self.name = name
+        self.times = _Column(np.int64)
+        self.values = _Column(np.float64)
+        self.labels = None  # Only kept once the signal has non-numeric values
+        self.levels = [_LiveLevel(bucket_ms) for bucket_ms in buckets_ms]
+
+    def append(self, times, values, labels=None):
+        """
+        Append samples and update the rollups.
+
+        Only the new samples and the last bucket of each level are recomputed, so the cost
+        follows the amount of new data rather than the size of the series.
+        """
+        order = np.argsort(times, kind="stable")
+        times, values = times[order], values[order]
+        if labels is not None:
+            labels = labels[order]
+
+        if len(self.times) and times[0] < self.times[len(self.times) - 1]:
+            # Older than what is already stored, merge everything and start over
+            self._rebuild(times, values, labels)
+            return
+
+        if labels is not None and self.labels is None:
+            self.labels = _Column(object)
+            self.labels.append(_labels_from_values(self.values.view()))
+        if self.labels is not None:
+            self.labels.append(labels if labels is not None else _labels_from_values(values))
+        self.times.append(times)
+        self.values.append(values)
+        self._update_rollups()
+
+    def _rebuild(self, times, values, labels):
+        all_times = np.concatenate((self.times.view(), times))
+        all_values = np.concatenate((self.values.view(), values))
+        all_labels = None
+        if labels is not None or self.labels is not None:
+            old_labels = self.labels.view() if self.labels is not None else _labels_from_values(self.values.view())
+            new_labels = labels if labels is not None else _labels_from_values(values)
+            all_labels = np.concatenate((old_labels, new_labels))
+        self.__init__(self.name, [level.bucket_ms for level in self.levels])
+        self.append(all_times, all_values, all_labels)
+
+    def _update_rollups(self):
+        """Recompute each level from the start of its open bucket, which may have gained samples."""
+        source = None
+        for level in self.levels:
+            since = level.open_since()
+            if source is None:
+                times, values = self.times.view(), self.values.view()
+                lo = 0 if since is None else int(np.searchsorted(times, since, side="left"))
+                tail = RollupLevel.from_samples(level.bucket_ms, times[lo:], values[lo:])
+            else:
+                lo = source.bucket_range(since, None)[0]
+                tail = source.slice(lo, len(source)).coarsen(level.bucket_ms)
+            level.replace_open(tail)
+            source = level.view()
+
+    def trim(self, before_ms=None, max_samples=None):
+        """Drop samples older than before_ms and keep at most max_samples, along with their rollup buckets."""
+        times = self.times.view()
+        count = 0
+        if before_ms is not None:
+            count = int(np.searchsorted(times, before_ms, side="left"))
+        if max_samples is not None:
+            count = max(count, len(times) - max_samples)
+        if count <= 0:
+            return
+        for column in (self.times, self.values, self.labels):
+            if column is not None:
+                column.drop_front(count)
+        # Buckets ending before the oldest kept sample (all of them if none is left) go as well
+        oldest = self.times[0] if len(self.times) else np.iinfo(np.int64).max
+        for level in self.levels:
+            level.drop_before(oldest)
+
+    def freeze(self):
+        """
+        Return a SignalSeries viewing the current samples and rollups, without copying them.
+
+        Later appends never modify what the views see: samples and closed buckets are only
+        written past the end of the views, and open buckets are replaced rather than updated.
+        """
+        labels = self.labels.view() if self.labels is not None else None
+        series = SignalSeries(self.name, self.times.view(), self.values.view(), labels)
+        series.levels = [level.view() for level in self.levels]
+        return series
+
+    def __len__(self):
+        return len(self.times)
+
+
+def _labels_from_values(values):
+    return np.array([str(value) for value in values.tolist()], dtype=object)
+
+
+def _numeric_values(values):
+    """Split decoded values into floats (NaN where not numeric) and text labels if any weren't numeric."""
+    numeric = np.empty(len(values), dtype=np.float64)
+    has_text = False
+    for i, value in enumerate(values):
+        try:
+            numeric[i] = float(value)
+        except (TypeError, ValueError):
+            numeric[i] = np.nan
+            has_text = True
+    labels = np.array([str(value).strip() for value in values], dtype=object) if has_text else None
+    return numeric, labels
+
+
+class LiveStore:
+    """
+    Appendable store of live samples, published as SignalStore views of its current state.
+
+    With a capacity (samples per signal) and/or a retention (ms before the newest sample)
+    older samples are dropped as new ones arrive, so memory stays constant however long
+    the store is fed.
+    """
+
+    def __init__(self, capacity=None, retention_ms=None):
+        self.series = {}
+        self.capacity = capacity
+        self.retention_ms = retention_ms
+        self.newest_ms = None
+
+    def append_samples(self, samples):
+        """
+        Append (time_ms, signal, value) samples.
+
+        Returns:
+            Dict of signal name to the number of samples appended to it
+        """
+        grouped = {}
+        for time_ms, signal, value in samples:
+            times, values = grouped.setdefault(str(signal).strip(), ([], []))
+            times.append(time_ms)
+            values.append(value)
+
+        counts = {}
+        for name, (times, values) in grouped.items():
+            series = self.series.get(name)
+            if series is None:
+                series = self.series[name] = LiveSeries(name)
+            numeric, labels = _numeric_values(values)
+            times = np.asarray(times, dtype=np.int64)
+            series.append(times, numeric, labels)
+            counts[name] = len(times)
+            newest = int(times.max())
+            self.newest_ms = newest if self.newest_ms is None else max(self.newest_ms, newest)
+
+        if self.capacity is not None or self.retention_ms is not None:
+            before_ms = self.newest_ms - self.retention_ms if self.retention_ms is not None else None
+            for series in self.series.values():
+                series.trim(before_ms, self.capacity)
+        return counts
+
+    def freeze(self):
+        """Return a SignalStore of the current state, sharing memory with this store."""
+        return SignalStore({name: series.freeze() for name, series in self.series.items()})
+
+    def __len__(self):
+        return sum(len(series) for series in self.series.values())
@@ -0,0 +1,198 @@
+"""
+Replay a recorded log through the live ingest path to load-test the server and dashboards.
+
+Raw .TXT logs are fed as raw lines (so they are decoded like bench data), parsed .csv files
+as decoded samples. Frames are released at the pace of their timestamps, sped up by a
+factor or as fast as possible, and the run reports the achieved ingest rate and the
+end-to-end latency from releasing a frame until a snapshot containing it is published.
+"""
+import argparse
+import bisect
+import threading
+import time
+
+from app import server
+from app.livestore import LIVE_BASE_TIME_MS
+from app.socketingest import LiveIngest, DEFAULT_CAPACITY, DEFAULT_RETENTION_MS
+from parsing.csv_reading.csv_parse import timestamp_to_ms
+
+# Frames released together when they are due within this many seconds of each other
+BATCH_WINDOW = 0.01
+
+
+def read_raw_log(filepath):
+    """Read a raw .TXT log as a list of (timestamp_ms, line) with malformed lines skipped."""
+    frames = []
+    with open(filepath, 'r') as input_file:
+        for line in input_file:
+            line = line.strip()
+            if len(line) < 17 or line[8] != 'x':
+                continue
+            try:
+                frames.append((int(line[:8], 16), line))
+            except ValueError:
+                continue
+    return frames
+
+
+def read_parsed_csv(filepath):
+    """Read a parsed "timestamp, signal, value" .csv as a list of (timestamp_ms, sample)."""
+    frames = []
+    with open(filepath, 'r') as input_file:
+        for line in input_file:
+            parts = [part.strip() for part in line.split(",", 2)]
+            if len(parts) != 3:
+                continue
+            try:
+                timestamp_ms = timestamp_to_ms(parts[0])
+            except ValueError:
+                continue
+            frames.append((timestamp_ms, (LIVE_BASE_TIME_MS + timestamp_ms, parts[1], parts[2])))
+    return frames
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class ReplayEngine:
+    """Feeds a recorded log into a LiveIngest at real-time, accelerated or maximum speed."""
+
+    def __init__(self, filepath, ingest, speed=1.0):
+        self.filepath = filepath
+        self.ingest = ingest
+        self.speed = speed
+        self.raw = filepath.lower().endswith('.txt')
+        self.frames = read_raw_log(filepath) if self.raw else read_parsed_csv(filepath)
+        self.frames.sort(key=lambda frame: frame[0])
+
+        # Release times of the batches still waiting to be published, by newest timestamp
+        self._lock = threading.Lock()
+        self._waiting_times = []
+        self._waiting_released = []
+        self.latencies = []
+        self.last_published = None
+
+    def on_publish(self, snapshot, dataset_id, make_current):
+        """Publish listener measuring how long released frames took to be published."""
+        if dataset_id != self.ingest.dataset_id or snapshot.store is None:
+            return
+        now = time.monotonic()
+        newest = max((int(series.times[-1]) for series in snapshot.store.series.values() if len(series.times)),
+                     default=None)
+        if newest is None:
+            return
+        with self._lock:
+            count = bisect.bisect_right(self._waiting_times, newest)
+            if count:
+                self.last_published = now
+            self.latencies.extend(now - released for released in self._waiting_released[:count])
+            del self._waiting_times[:count], self._waiting_released[:count]
+
+    def release(self, batch, newest_ms):
+        with self._lock:
+            self._waiting_times.append(LIVE_BASE_TIME_MS + newest_ms)
+            self._waiting_released.append(time.monotonic())
+        if self.raw:
+            self.ingest.receive(("\n".join(batch) + "\n").encode("ascii"))
+        else:
+            self.ingest.receive_samples(batch)
+
+    def run(self):
+        """
+        Replay the whole log and wait for it to be published.
+
+        Returns:
+            Dict with the achieved rate and the publish latency percentiles
+        """
+        if not self.frames:
+            return {"frames": 0}
+        server.add_publish_listener(self.on_publish)
+        first_ms = self.frames[0][0]
+        start = time.monotonic()
+        batch = []
+        batch_due = None
+        for timestamp_ms, frame in self.frames:
+            due = (timestamp_ms - first_ms) / 1000 / self.speed if self.speed > 0 else 0
+            if batch and due - batch_due > BATCH_WINDOW:
+                self.release(batch, previous_ms)
+                batch = []
+            if not batch:
+                batch_due = due
+                delay = start + due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            batch.append(frame)
+            previous_ms = timestamp_ms
+            if len(batch) >= 10000:
+                self.release(batch, previous_ms)
+                batch = []
+        if batch:
+            self.release(batch, previous_ms)
+        released = time.monotonic() - start
+
+        # Wait for the last frames to be published. Frames that can't be decoded never are,
+        # so give up once everything queued has been decoded and nothing was published for a while.
+        idle_since = time.monotonic()
+        waiting = len(self._waiting_times)
+        while self._waiting_times and time.monotonic() - idle_since < 1.0:
+            if len(self._waiting_times) != waiting or not self.ingest.pending.empty():
+                idle_since = time.monotonic()
+                waiting = len(self._waiting_times)
+            time.sleep(0.01)
+        server.remove_publish_listener(self.on_publish)
+
+        # The ingest rate counts until the last frames were published, not just released
+        ingested = max(released, (self.last_published or start) - start)
+        log_seconds = (self.frames[-1][0] - first_ms) / 1000
+        latencies = sorted(self.latencies)
+        return {
+            "frames": len(self.frames),
+            "log_seconds": log_seconds,
+            "replay_seconds": ingested,
+            "speed": log_seconds / ingested if ingested > 0 else None,
+            "frames_per_second": len(self.frames) / ingested if ingested > 0 else None,
+            "samples": len(self.ingest.store),
+            "latency_p50_ms": None if not latencies else 1000 * _percentile(latencies, 0.5),
+            "latency_p95_ms": None if not latencies else 1000 * _percentile(latencies, 0.95),
+            "latency_max_ms": None if not latencies else 1000 * latencies[-1],
+        }
+
+
+def format_report(report):
+    """Human readable summary of a replay report."""
+    if not report["frames"]:
+        return "Nothing to replay"
+    lines = [
+        f"Replayed {report['frames']} frames ({report['log_seconds']:.1f}s of log) in {report['replay_seconds']:.1f}s",
+        f"Achieved {report['frames_per_second']:.0f} frames/s, {report['speed']:.1f}x real time",
+    ]
+    if report["latency_p50_ms"] is not None:
+        lines.append(f"Publish latency p50 {report['latency_p50_ms']:.0f} ms, p95 {report['latency_p95_ms']:.0f} ms, "
+                     f"max {report['latency_max_ms']:.0f} ms")
+    return "\n".join(lines)
+
+
+def replay_file(filepath, speed=1.0, capacity=DEFAULT_CAPACITY, retention_ms=DEFAULT_RETENTION_MS, dataset_id="replay"):
+    """Replay a log into a new live dataset and return the report."""
+    ingest = LiveIngest(capacity, retention_ms, dataset_id)
+    ingest.start()
+    try:
+        return ReplayEngine(filepath, ingest, speed).run()
+    finally:
+        ingest.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded log through the live ingest path and serve it")
+    parser.add_argument('file', help="Raw .TXT log or parsed .csv file")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed, 0 for as fast as possible")
+    parser.add_argument('--keep-serving', action="store_true", help="Keep serving the data after the replay")
+    args = parser.parse_args()
+
+    threading.Thread(target=server.run_server, daemon=True).start()
+    print(format_report(replay_file(args.file, args.speed, dataset_id=server.make_dataset_id(args.file))))
+    if args.keep_serving:
+        threading.Event().wait()
@@ -1,49 +1,507 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+from collections import namedtuple
+import hashlib
+import json
+import os
+import re
 import threading
 
+from app import jsonapi
+from app.events import SampleCursor, batch_to_event
+from app.querycache import QueryCache
+from app.signalstore import (
+    rollups_to_csv_bytes, rollups_to_json_bytes, iter_csv_blocks, iter_json_blocks,
+    store_columns, iter_wide_csv_blocks, iter_wide_json_blocks, iter_columnar_json_blocks
+)
+from app.snapshot import (
+    Snapshot, compress, stream_compressor, negotiate_encoding, is_not_modified, http_date, MIN_COMPRESS_SIZE
+)
+from app.threading_scripts.shared_data import shared_data_manager
+
+# Default CSV header sent when no data has been published
+DEFAULT_CSV = b"sender,value,date_time\n"
+
+# Responses are written in blocks of this size straight from the snapshot's memory
+WRITE_BLOCK_SIZE = 256 * 1024
+
+# Number of samples generated per block when streaming from the store
+STREAM_BLOCK_ROWS = 16384
+
+CONTENT_TYPES = {"csv": "text/csv", "json": "application/json"}
+
+# Response layouts: one row per sample, one row per timestamp with a column per signal,
+# or one JSON array per field
+LAYOUTS = ("long", "wide", "columns")
+
+# Named datasets are served under /datasets/<id>
+DATASETS_PATH = "/datasets"
+
+# Idle event streams get a comment line this often (seconds) so proxies and clients keep them open
+EVENT_KEEPALIVE = 15
+
 _data_lock = threading.Lock()
-_data = StringIO()
+_snapshot = Snapshot(DEFAULT_CSV)
+
+# Cached (encoding, body) of bounded query responses, keyed by snapshot version and normalized query
+_query_cache = QueryCache(sizeof=lambda entry: len(entry[1]))
+
+# Callbacks run with every newly published snapshot (e.g. to share it with server processes)
+_publish_listeners = []
+
+# Counts publishes and wakes up event streams waiting for new data
+_published = threading.Condition()
+_publish_generation = 0
+
+def add_publish_listener(callback):
+    """Call callback(snapshot, dataset_id, make_current) whenever a snapshot is published."""
+    _publish_listeners.append(callback)
+
+def remove_publish_listener(callback):
+    """Stop calling a callback added with add_publish_listener."""
+    if callback in _publish_listeners:
+        _publish_listeners.remove(callback)
+
+def make_dataset_id(path):
+    """Derive a URL-safe dataset id from the file or folder a dataset was loaded from."""
+    name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("._") or "dataset"
+
+def publish_snapshot(snapshot, dataset_id=None, make_current=True):
+    """
+    Swap in a new snapshot; the lock only guards the reference, never any I/O.
+
+    With a dataset_id the snapshot also stays resident under /datasets/<dataset_id>,
+    alongside earlier datasets, until it is replaced or dropped for the memory budget.
+    Live data (socket ingest, replay, watched folders) is published with make_current
+    False, so it only updates its dataset and / keeps serving the data loaded last.
+    """
+    global _snapshot
+    if snapshot.is_empty:
+        snapshot = Snapshot(DEFAULT_CSV, snapshot.store)
+    served = _served_snapshots()
+    if make_current:
+        with _data_lock:
+            _snapshot = snapshot
+    if dataset_id is not None:
+        for evicted in shared_data_manager.store_dataset(dataset_id, snapshot, snapshot.nbytes):
+            print(f"Dropped dataset {evicted} to stay within the memory budget")
+    for callback in _publish_listeners:
+        callback(snapshot, dataset_id, make_current)
+    _published_changed(served)
+
+def mirror_published(current, datasets):
+    """
+    Serve exactly the given current snapshot and (dataset_id, snapshot, size) datasets,
+    as published by another process (see sharedserving). Listeners aren't called.
+    """
+    global _snapshot
+    served = _served_snapshots()
+    shared_data_manager.replace_datasets(datasets)
+    if current is not None:
+        with _data_lock:
+            _snapshot = current
+    _published_changed(served)
+
+def _served_snapshots():
+    """The current snapshot and the resident datasets."""
+    return [current_snapshot()] + [snapshot for _, snapshot, _ in shared_data_manager.list_datasets()]
+
+def _published_changed(served_before):
+    """Drop the cached results of snapshots no longer served and wake up waiting event streams."""
+    global _publish_generation
+    served = {snapshot.version for snapshot in _served_snapshots()}
+    gone = {snapshot.version for snapshot in served_before} - served
+    if gone:
+        # Cache keys are (kind, snapshot version, ...), entries of other snapshots stay valid
+        _query_cache.discard(lambda key: key[1] in gone)
+    with _published:
+        _publish_generation += 1
+        _published.notify_all()
+
+def publish_generation():
+    """Number of snapshots published so far."""
+    with _published:
+        return _publish_generation
 
-def update_data(new_data):
-    global _data
+def wait_for_publish(generation, timeout):
+    """
+    Wait until something is published after the given publish generation.
+
+    Returns the current generation, which is unchanged if the timeout passed first.
+    """
+    with _published:
+        _published.wait_for(lambda: _publish_generation != generation, timeout)
+        return _publish_generation
+
+def query_cache_stats():
+    """Hit/miss counters of the query result cache."""
+    return _query_cache.stats()
+
+def current_snapshot():
+    """Return the currently published snapshot."""
     with _data_lock:
-        _data = StringIO(new_data)
+        return _snapshot
+
+def get_dataset(dataset_id):
+    """Return the snapshot of a named dataset, or None if it isn't resident."""
+    return shared_data_manager.get_dataset(dataset_id)
+
+def list_datasets():
+    """Describe the resident datasets, most recently used last."""
+    current = current_snapshot()
+    return [
+        {
+            "id": dataset_id,
+            "url": f"{DATASETS_PATH}/{dataset_id}",
+            "bytes": size,
+            "rows": len(snapshot.store) if snapshot.store is not None else 0,
+            "signals": len(snapshot.store.series) if snapshot.store is not None else 0,
+            "last_modified": http_date(snapshot.last_modified),
+            "current": snapshot is current,
+        }
+        for dataset_id, snapshot, size in shared_data_manager.list_datasets()
+    ]
+
+def update_data(new_data, store=None):
+    """Publish new CSV data (str or bytes) as a snapshot."""
+    if isinstance(new_data, str):
+        new_data = new_data.encode("utf-8")
+    publish_snapshot(Snapshot(new_data, store))
+
+class RangeQuery(namedtuple("RangeQuery", "signals start_ms end_ms max_points format layout stream")):
+    """A parsed query against the published store."""
+
+    def cache_key(self):
+        return repr((sorted(self.signals), self.start_ms, self.end_ms, self.max_points, self.format, self.layout))
+
+def parse_range_query(query):
+    """
+    Parse from/to/maxDataPoints/signal/format/layout/stream query parameters.
+
+    Returns a RangeQuery, or None if none of them were given.
+    """
+    params = parse_qs(query)
+    if not any(key in params for key in ("from", "to", "maxDataPoints", "signal", "format", "layout", "stream")):
+        return None
+
+    signals = []
+    for value in params.get("signal", []):
+        signals.extend(name.strip() for name in value.split(",") if name.strip())
+
+    def int_param(key):
+        return int(params[key][0]) if key in params else None
+
+    layout = params.get("layout", ["long"])[0]
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout: {layout}")
+    # Columnar output only exists as JSON
+    output_format = params.get("format", ["json" if layout == "columns" else "csv"])[0]
+    if output_format not in CONTENT_TYPES or (layout == "columns" and output_format != "json"):
+        raise ValueError(f"Unknown format: {output_format}")
+    stream = params.get("stream", ["0"])[0] not in ("0", "false", "")
+
+    return RangeQuery(signals, int_param("from"), int_param("to"), int_param("maxDataPoints"),
+                      output_format, layout, stream)
 
 class CSVDownloadHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 is needed for chunked transfer encoding (and gives keep-alive to Grafana)
+    protocol_version = "HTTP/1.1"
+
     def do_GET(self):
-        global _data
-        if self.path == "/":
-            with _data_lock:
-                csv_content = _data.getvalue()
-
-            csv_bytes = csv_content.encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "text/csv")
-            self.send_header("Content-Disposition", "attachment; filename=LOG.csv")
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            stats = {
+                "query_cache": query_cache_stats(),
+                "datasets": {
+                    "count": len(shared_data_manager.list_datasets()),
+                    "bytes": shared_data_manager.get_datasets_size(),
+                    "budget": shared_data_manager.dataset_budget,
+                },
+            }
+            self.send_body(json.dumps(stats).encode("utf-8"), "application/json")
+            return
+        if url.path.rstrip("/") == DATASETS_PATH:
+            self.send_body(json.dumps(list_datasets()).encode("utf-8"), "application/json")
+            return
+
+        snapshot, endpoint = self.resolve_path(url.path)
+        if snapshot is not None and endpoint == "/events":
+            self.send_events(self.split_path(url.path)[0], url.query)
+        elif snapshot is not None and endpoint == "/":
+            try:
+                range_query = parse_range_query(url.query)
+            except ValueError:
+                self.send_text(400, b"Invalid query parameters")
+                return
+
+            if range_query is not None:
+                self.send_range_query(snapshot, range_query)
+                return
+
+            encoding = negotiate_encoding(self.headers.get("Accept-Encoding"), len(snapshot))
+            etag = snapshot.etag(encoding)
+            if is_not_modified(self.headers, etag, snapshot.last_modified):
+                self.send_not_modified(etag, snapshot.last_modified)
+                return
+            self.send_body(snapshot.encoded(encoding), "text/csv", encoding, etag, snapshot.last_modified)
 
-            if csv_content:
-                self.send_header("Content-Length", str(len(csv_bytes)))
-                self.end_headers()
-                self.wfile.write(csv_bytes)
+        else:
+            self.send_text(404, b"Not found")
+
+    def do_POST(self):
+        """Serve the Grafana JSON datasource protocol (/search, /metrics, /query, /annotations)."""
+        snapshot, path = self.resolve_path(urlsplit(self.path).path)
+        endpoint = jsonapi.ROUTES.get(path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        if snapshot is None or endpoint is None:
+            self.send_text(404, b"Not found")
+            return
+
+        try:
+            body = json.loads(raw_body) if raw_body else {}
+
+            def build():
+                return json.dumps(endpoint(snapshot.store, body)).encode("utf-8")
+
+            if endpoint is jsonapi.query:
+                # Panels often send identical queries, answer them from the cache
+                key = ("query", snapshot.version, jsonapi.query_cache_key(body))
+                encoding, response = self.cached_body(key, build)
             else:
-                # Send default CSV header when no data
-                default_csv = b"sender,value,date_time\n"
-                self.send_header("Content-Length", str(len(default_csv)))
-                self.end_headers()
-                self.wfile.write(default_csv)
+                response = build()
+                encoding = negotiate_encoding(self.headers.get("Accept-Encoding"), len(response))
+                response = compress(response, encoding)
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_text(400, f"Invalid request: {e}".encode("utf-8"))
+            return
+
+        self.send_body(response, "application/json", encoding)
+
+    def split_path(self, path):
+        """Split a request path into the dataset id it addresses (None for the current data) and the endpoint."""
+        if path.startswith(DATASETS_PATH + "/"):
+            dataset_id, _, rest = path[len(DATASETS_PATH) + 1:].partition("/")
+            return unquote(dataset_id), "/" + rest
+        return None, path
+
+    def resolve_path(self, path):
+        """
+        Split a request path into the snapshot it targets and the endpoint within it.
+
+        /datasets/<id>/... addresses a named dataset, any other path the current snapshot.
+        The snapshot is None when the named dataset isn't resident.
+        """
+        dataset_id, endpoint = self.split_path(path)
+        if dataset_id is not None:
+            return get_dataset(dataset_id), endpoint
+        return current_snapshot(), endpoint
+
+    def send_events(self, dataset_id, query):
+        """
+        Stream newly published samples as server-sent events until the client disconnects.
 
+        Each event carries the samples appended since the previous one as columnar JSON, so
+        live views only pay for deltas. Without a from parameter (or Last-Event-ID header)
+        the stream starts with data published after connecting.
+        """
+        params = parse_qs(query)
+        signals = []
+        for value in params.get("signal", []):
+            signals.extend(name.strip() for name in value.split(",") if name.strip())
+        since = self.headers.get("Last-Event-ID") or params.get("from", [None])[0]
+        try:
+            cursor = SampleCursor(signals, int(since) if since is not None else None)
+        except ValueError:
+            self.send_text(400, b"Invalid query parameters")
+            return
+
+        def snapshot():
+            return get_dataset(dataset_id) if dataset_id is not None else current_snapshot()
+
+        chunked = self.request_version != "HTTP/1.0"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
         else:
-            self.send_response(404)
-            self.end_headers()
-            self.wfile.write(b"Not found")
+            self.send_header("Connection", "close")
+        self.close_connection = True
+        self.end_headers()
+
+        generation = publish_generation()
+        current = snapshot()
+        if since is None and current is not None and current.store is not None:
+            cursor.skip_to_end(current.store)
+        try:
+            self.write_chunk(b"retry: 1000\n\n", chunked)
+            while True:
+                if current is not None and current.store is not None:
+                    batch = cursor.next_batch(current.store)
+                    while batch:
+                        self.write_chunk(batch_to_event(batch, cursor.last_event_id()), chunked)
+                        batch = cursor.next_batch(current.store)
+                    self.wfile.flush()
+
+                new_generation = wait_for_publish(generation, EVENT_KEEPALIVE)
+                if new_generation == generation:
+                    self.write_chunk(b": keepalive\n\n", chunked)
+                generation = new_generation
+                current = snapshot()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_range_query(self, snapshot, query):
+        """
+        Answer a range query from a snapshot's store.
+
+        Downsampled queries (maxDataPoints) are small and answered from the rollups in one piece.
+        Raw exports can be as large as the whole dataset, so they are streamed block by block.
+        """
+        store = snapshot.store
+        last_modified = snapshot.last_modified
+
+        # The result only depends on the published snapshot and the query, so both make up the ETag.
+        # It is weak because it is checked before knowing which content coding will be sent.
+        query_hash = hashlib.blake2b(query.cache_key().encode("utf-8"), digest_size=8).hexdigest()
+        etag = f'W/"{snapshot.digest}-{query_hash}"'
+        if is_not_modified(self.headers, etag, last_modified):
+            self.send_not_modified(etag, last_modified)
+            return
+
+        content_type = CONTENT_TYPES[query.format]
+        if query.max_points is None or query.stream:
+            encoding = negotiate_encoding(self.headers.get("Accept-Encoding"), STREAM_BLOCK_ROWS)
+            self.send_stream(self.query_blocks(store, query), content_type, encoding, etag, last_modified)
+            return
+
+        # Downsampled results are bounded in size, so they can be cached and shared between requests
+        key = ("range", snapshot.version, query.cache_key())
+        encoding, body = self.cached_body(key, lambda: b"".join(self.query_blocks(store, query)))
+        self.send_body(body, content_type, encoding, etag, last_modified)
+
+    def query_blocks(self, store, query):
+        """Generate the body of a range query block by block."""
+        if query.layout != "long":
+            # Timestamp-aligned outputs, one column per signal so Grafana doesn't have to pivot
+            columns = store_columns(store, query.signals, query.start_ms, query.end_ms, query.max_points)
+            if query.layout == "columns":
+                iter_blocks = iter_columnar_json_blocks
+            else:
+                iter_blocks = iter_wide_json_blocks if query.format == "json" else iter_wide_csv_blocks
+            yield from iter_blocks(columns, STREAM_BLOCK_ROWS)
+        elif query.max_points is None:
+            iter_blocks = iter_json_blocks if query.format == "json" else iter_csv_blocks
+            yield from iter_blocks(store, query.signals, query.start_ms, query.end_ms, STREAM_BLOCK_ROWS)
+        else:
+            results = store.query(query.signals, query.start_ms, query.end_ms, query.max_points) if store is not None else {}
+            yield rollups_to_json_bytes(results) if query.format == "json" else rollups_to_csv_bytes(results)
+
+    def cached_body(self, key, build):
+        """
+        Return (encoding, body) for a bounded response from the query cache.
+
+        The cache key includes the preferred content coding, so each encoding is
+        compressed once and concurrent identical requests only build the body once.
+        """
+        preferred = negotiate_encoding(self.headers.get("Accept-Encoding"), MIN_COMPRESS_SIZE)
+
+        def compute():
+            body = build()
+            encoding = preferred if len(body) >= MIN_COMPRESS_SIZE else "identity"
+            return encoding, compress(body, encoding)
+
+        return _query_cache.get_or_compute(key + (preferred,), compute)
+
+    def send_validators(self, etag, last_modified):
+        """Send the caching headers shared by 200 and 304 responses."""
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Cache-Control", "no-cache")
+        if etag:
+            self.send_header("ETag", etag)
+        if last_modified is not None:
+            self.send_header("Last-Modified", http_date(last_modified))
+
+    def send_not_modified(self, etag, last_modified):
+        """Tell the client its cached copy is still current, without a body."""
+        self.send_response(304)
+        self.send_validators(etag, last_modified)
+        self.end_headers()
+
+    def send_headers(self, content_type, encoding, etag, last_modified):
+        """Send the status line and headers of a 200 response, up to the length/framing headers."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if content_type == "text/csv":
+            self.send_header("Content-Disposition", "attachment; filename=LOG.csv")
+        self.send_validators(etag, last_modified)
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+
+    def send_body(self, body, content_type="text/csv", encoding="identity", etag=None, last_modified=None):
+        """Send a body that is already in the given content coding."""
+        self.send_headers(content_type, encoding, etag, last_modified)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.write_body(body)
+
+    def send_stream(self, blocks, content_type, encoding="identity", etag=None, last_modified=None):
+        """
+        Send a body generated block by block with chunked transfer encoding.
+
+        Only one block (plus the compressor's window) is held at a time, so memory stays
+        flat however large the response is. HTTP/1.0 clients get a close-delimited body.
+        """
+        chunked = self.request_version != "HTTP/1.0"
+        self.send_headers(content_type, encoding, etag, last_modified)
+        if chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        self.end_headers()
+
+        compressor = stream_compressor(encoding)
+        for block in blocks:
+            if compressor is not None:
+                block = compressor.compress(block)
+            self.write_chunk(block, chunked)
+        if compressor is not None:
+            self.write_chunk(compressor.flush(), chunked)
+        if chunked:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data, chunked):
+        if not data:
+            return
+        if chunked:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii"))
+            self.write_body(data)
+            self.wfile.write(b"\r\n")
+        else:
+            self.write_body(data)
+
+    def send_text(self, code, message):
+        """Send a short plain text response, e.g. for errors."""
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(message)))
+        self.end_headers()
+        self.wfile.write(message)
+
+    def write_body(self, body):
+        """Write a body in blocks through a memoryview, without copying it."""
+        view = memoryview(body)
+        for start in range(0, len(view), WRITE_BLOCK_SIZE):
+            self.wfile.write(view[start:start + WRITE_BLOCK_SIZE])
 
-def run_server():
-    port = 8000
+def run_server(port=8000):
     server_address = ('', port)
-    httpd = HTTPServer(server_address, CSVDownloadHandler)
+    httpd = ThreadingHTTPServer(server_address, CSVDownloadHandler)
     print(f"Serving on http://localhost:{port}/")
     httpd.serve_forever()
 
 if __name__ == "__main__":
-    run_server()
\ No newline at end of file
+    run_server()
@@ -0,0 +1,449 @@
+"""
+Optional multi-process serving of published snapshots.
+
+The GUI process writes published snapshots (the columnar store, and the CSV body once it
+exists) into shared memory segments from a background thread. A pool of separate server
+processes maps the segments and answers requests from them without copying, so serving
+doesn't compete with the GUI and parsing threads for the GIL.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from app import server
+from app.signalstore import RollupLevel, SignalSeries, SignalStore
+from app.snapshot import Snapshot
+from app.threading_scripts.shared_data import shared_data_manager
+
+# Control block layout: generation (odd while being written), segment size, segment name
+_CONTROL = struct.Struct("<QQ96s")
+
+# Arrays are placed at multiples of this in a segment so numpy views stay aligned
+_ALIGNMENT = 8
+
+# Number of published catalogs (and the segments they list) kept alive so workers still
+# attaching an older one find it
+_RETAINED_CATALOGS = 2
+
+_LEVEL_FIELDS = ("times", "mins", "maxs", "sums", "counts")
+
+# How often server processes check the control block for a new catalog, in seconds, so
+# event streams get new data while no requests come in
+_REFRESH_INTERVAL = 0.05
+
+# Minimum time between two catalogs announcing only live data (datasets published without
+# making them current), in seconds
+_LIVE_PUBLISH_INTERVAL = 0.5
+
+
+def _open_shared_memory(name, shares_tracker=False):
+    """
+    Attach to an existing segment without handing it to this process' resource tracker.
+
+    shares_tracker tells that this process uses the publisher's resource tracker, as the
+    processes started by SharedServerPool do.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # track was added in Python 3.13
+        segment = shared_memory.SharedMemory(name=name)
+        # Older versions register attached segments too, so a tracker of this process would warn
+        # about them and unlink them when it exits, even though the publisher owns them. The
+        # publisher's own tracker already holds them and must keep them.
+        if os.name == "posix" and not shares_tracker:
+            resource_tracker.unregister("/" + segment.name, "shared_memory")
+        return segment
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+class _SegmentLayout:
+    """Collects the buffers of a snapshot and their offsets for writing into one segment."""
+
+    def __init__(self):
+        self.buffers = []
+        self.size = 0
+
+    def add(self, data):
+        """Reserve space for a buffer, returning its [offset, length, dtype] reference."""
+        offset = _aligned(self.size)
+        if isinstance(data, np.ndarray):
+            data = np.ascontiguousarray(data)
+            reference = [offset, len(data), data.dtype.str]
+            data = data.view(np.uint8).reshape(-1)
+        else:
+            reference = [offset, len(data), None]
+        self.buffers.append((offset, data))
+        self.size = offset + len(data)
+        return reference
+
+
+def pack_snapshot(snapshot, dataset_id=None):
+    """Describe a snapshot as a JSON manifest plus the buffers to lay out after it."""
+    layout = _SegmentLayout()
+    signals = []
+    store = snapshot.store
+    for series in (store.series.values() if store is not None else []):
+        signals.append({
+            "name": series.name,
+            "times": layout.add(series.times),
+            "values": layout.add(series.values),
+            "labels": None if series.labels is None else series.labels.tolist(),
+            "levels": [dict({field: layout.add(getattr(full, field)) for field in _LEVEL_FIELDS},
+                            bucket_ms=level.bucket_ms)
+                       for level in series.levels
+                       for full in [level.slice(0, len(level))]],
+        })
+    manifest = {
+        "dataset_id": dataset_id,
+        # A body not generated or hashed yet is left to the server processes, on first request
+        "digest": snapshot.known_digest,
+        "last_modified": snapshot.last_modified,
+        "body": layout.add(snapshot.view) if snapshot.has_body else None,
+        "has_store": store is not None,
+        "signals": signals,
+    }
+    return manifest, layout
+
+
+def unpack_snapshot(buffer):
+    """
+    Rebuild a snapshot whose body and arrays are views into a shared memory buffer.
+
+    Returns (snapshot, dataset_id).
+    """
+    manifest_length = struct.unpack_from("<Q", buffer, 0)[0]
+    manifest = json.loads(bytes(buffer[8:8 + manifest_length]))
+    data = buffer[_aligned(8 + manifest_length):]
+
+    def view(reference):
+        offset, length, dtype = reference
+        if dtype is None:
+            return data[offset:offset + length]
+        return np.frombuffer(data, dtype=np.dtype(dtype), count=length, offset=offset)
+
+    store = None
+    if manifest["has_store"]:
+        series = {}
+        for signal in manifest["signals"]:
+            labels = None if signal["labels"] is None else np.array(signal["labels"], dtype=object)
+            item = SignalSeries(signal["name"], view(signal["times"]), view(signal["values"]), labels)
+            item.levels = [RollupLevel(level["bucket_ms"], *(view(level[field]) for field in _LEVEL_FIELDS))
+                           for level in signal["levels"]]
+            series[item.name] = item
+        store = SignalStore(series)
+    body = None if manifest["body"] is None else view(manifest["body"])
+    snapshot = Snapshot(body, store, manifest["digest"], manifest["last_modified"])
+    return snapshot, manifest["dataset_id"]
+
+
+class SharedSnapshotPublisher:
+    """
+    Writes published snapshots into shared memory and announces them in a control block.
+
+    The control block points at a catalog segment naming the current snapshot's segment and
+    the segments of the resident named datasets, so every server process serves the same
+    datasets, whichever publishes it happened to see.
+
+    Publishing only notes that something changed; a background thread then writes what is
+    served at that point, so snapshots replaced in the meantime are never written at all.
+    """
+
+    def __init__(self):
+        self.control = shared_memory.SharedMemory(create=True, size=_CONTROL.size)
+        _CONTROL.pack_into(self.control.buf, 0, 0, 0, b"")
+        self.generation = 0
+        self.segments = {}  # Snapshot segments by name
+        self.written = {}  # Snapshot version -> name of the segment holding it
+        self.catalogs = []  # (catalog segment, names of the segments it lists), oldest first
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._pending = None  # What changed since the last catalog: None, "live" or "current"
+        self._closed = False
+        self._thread = None
+
+    def start(self):
+        """Announce later publishes from a background thread."""
+        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self._thread.start()
+
+    def on_publish(self, snapshot, dataset_id, make_current):
+        """Publish listener, only wakes up the publishing thread so the publisher never waits on it."""
+        with self._changed:
+            self._pending = "current" if make_current or self._pending == "current" else "live"
+            self._changed.notify()
+
+    def _publish_loop(self):
+        last_publish = 0.0
+        while True:
+            with self._changed:
+                while self._pending is None and not self._closed:
+                    self._changed.wait()
+                if self._closed:
+                    return
+                if self._pending == "live":
+                    # Live data is published many times a second, only its latest state is passed on
+                    delay = last_publish + _LIVE_PUBLISH_INTERVAL - time.monotonic()
+                    if delay > 0:
+                        self._changed.wait(delay)
+                        continue
+                self._pending = None
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Error publishing to the server processes: {e}")
+            last_publish = time.monotonic()
+
+    def publish(self):
+        """Write the current snapshot and the resident datasets that aren't in shared memory yet and announce them."""
+        current = server.current_snapshot()
+        datasets = shared_data_manager.list_datasets()
+        with self._lock:
+            for dataset_id, snapshot in [*((dataset_id, snapshot) for dataset_id, snapshot, _ in datasets),
+                                         (None, current)]:
+                if snapshot.version not in self.written:
+                    segment = _write_segment(*pack_snapshot(snapshot, dataset_id))
+                    self.segments[segment.name] = segment
+                    self.written[snapshot.version] = segment.name
+            catalog = {
+                "current": self.written[current.version],
+                "datasets": [[dataset_id, self.written[snapshot.version], size] for dataset_id, snapshot, size in datasets],
+                "budget": shared_data_manager.dataset_budget,
+            }
+            catalog_bytes = json.dumps(catalog).encode("utf-8")
+            catalog_segment = shared_memory.SharedMemory(create=True, size=8 + len(catalog_bytes))
+            struct.pack_into("<Q", catalog_segment.buf, 0, len(catalog_bytes))
+            catalog_segment.buf[8:8 + len(catalog_bytes)] = catalog_bytes
+
+            # Seqlock: readers retry while the generation is odd or changes under them
+            self.generation += 1
+            _CONTROL.pack_into(self.control.buf, 0, self.generation, 0, b"")
+            self.generation += 1
+            _CONTROL.pack_into(self.control.buf, 0, self.generation, catalog_segment.size,
+                               catalog_segment.name.encode("utf-8"))
+
+            self.catalogs.append((catalog_segment, {catalog["current"], *(entry[1] for entry in catalog["datasets"])}))
+            while len(self.catalogs) > _RETAINED_CATALOGS:
+                old, _ = self.catalogs.pop(0)
+                old.close()
+                old.unlink()
+            # Snapshot segments go once no retained catalog lists them
+            listed = set().union(*(names for _, names in self.catalogs))
+            for name in [name for name in self.segments if name not in listed]:
+                old = self.segments.pop(name)
+                old.close()
+                old.unlink()
+            self.written = {version: name for version, name in self.written.items() if name in self.segments}
+
+    def close(self):
+        """Stop publishing and unlink every segment, including the catalogs and the control block."""
+        with self._changed:
+            self._closed = True
+            self._changed.notify()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            for segment in [*self.segments.values(), *(catalog for catalog, _ in self.catalogs), self.control]:
+                segment.close()
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+            self.segments = {}
+            self.written = {}
+            self.catalogs = []
+
+
+def _write_segment(manifest, layout):
+    """Create a segment holding a packed snapshot: manifest length, manifest, then its buffers."""
+    manifest_bytes = json.dumps(manifest).encode("utf-8")
+    data_start = _aligned(8 + len(manifest_bytes))
+    segment = shared_memory.SharedMemory(create=True, size=max(data_start + layout.size, 1))
+    struct.pack_into("<Q", segment.buf, 0, len(manifest_bytes))
+    segment.buf[8:8 + len(manifest_bytes)] = manifest_bytes
+    for offset, data in layout.buffers:
+        start = data_start + offset
+        segment.buf[start:start + len(data)] = memoryview(data).cast("B")
+    return segment
+
+
+def _read_catalog(name, shares_tracker=False):
+    """Read a catalog segment written by SharedSnapshotPublisher.publish."""
+    segment = _open_shared_memory(name, shares_tracker)
+    try:
+        length = struct.unpack_from("<Q", segment.buf, 0)[0]
+        return json.loads(bytes(segment.buf[8:8 + length]))
+    finally:
+        segment.close()
+
+
+class SharedSnapshotReader:
+    """
+    Follows the control block from a server process and mirrors the published catalog locally:
+    the current snapshot and the resident datasets.
+
+    Pass shares_tracker=True in processes started by the publisher's process, which share
+    its resource tracker.
+    """
+
+    def __init__(self, control_name, shares_tracker=False):
+        self.shares_tracker = shares_tracker
+        self.control = _open_shared_memory(control_name, shares_tracker)
+        self.generation = 0
+        self.attached = {}  # Segment name -> (segment, snapshot) of the segments in the current catalog
+        self.retired = []  # Segments no longer listed, closed once no views into them are left
+        self._lock = threading.Lock()
+
+    def read_control(self):
+        while True:
+            generation, size, name = _CONTROL.unpack_from(self.control.buf, 0)
+            if generation % 2 == 0 and _CONTROL.unpack_from(self.control.buf, 0)[0] == generation:
+                return generation, name.rstrip(b"\0").decode("utf-8")
+            time.sleep(0.001)
+
+    def refresh(self):
+        """Load the latest catalog if the publisher has announced a new one."""
+        generation, name = self.read_control()
+        if generation == self.generation or not name:
+            if self.retired:
+                with self._lock:
+                    self._close_retired()
+            return
+        with self._lock:
+            if generation == self.generation:
+                return
+            attached = {}
+            try:
+                catalog = _read_catalog(name, self.shares_tracker)
+                for segment_name in [catalog["current"], *(entry[1] for entry in catalog["datasets"])]:
+                    if segment_name is not None and segment_name not in attached:
+                        attached[segment_name] = self.attached.get(segment_name) or self._attach(segment_name)
+            except FileNotFoundError:
+                # Already replaced by a newer catalog, picked up by the next refresh
+                self.retired.extend(segment for segment_name, (segment, _) in attached.items()
+                                    if segment_name not in self.attached)
+                del attached
+                self._close_retired()
+                return
+
+            shared_data_manager.dataset_budget = catalog["budget"]
+            current = catalog["current"]
+            server.mirror_published(None if current is None else attached[current][1],
+                                    [(dataset_id, attached[segment_name][1], size)
+                                     for dataset_id, segment_name, size in catalog["datasets"]])
+            self.retired.extend(segment for segment_name, (segment, _) in self.attached.items()
+                                if segment_name not in attached)
+            self.attached = attached
+            self.generation = generation
+            self._close_retired()
+
+    def _attach(self, name):
+        segment = _open_shared_memory(name, self.shares_tracker)
+        return segment, unpack_snapshot(segment.buf)[0]
+
+    def _close_retired(self):
+        """Close retired segments once no snapshot views into them are left."""
+        still_open = []
+        for segment in self.retired:
+            try:
+                segment.close()
+            except BufferError:
+                still_open.append(segment)  # A request is still using it, retry later
+        self.retired = still_open
+
+
+class _ReusePortHTTPServer(ThreadingHTTPServer):
+    """HTTP server that lets several processes listen on the same port."""
+
+    def server_bind(self):
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def _watch_parent():
+    """Exit the server process when the GUI process goes away."""
+    parent = multiprocessing.parent_process()
+    while parent is not None and parent.is_alive():
+        time.sleep(1)
+    os._exit(0)
+
+
+def _follow_publisher(reader):
+    """Keep loading new catalogs; publishing them locally wakes up the event streams of this process."""
+    while True:
+        try:
+            reader.refresh()
+        except Exception as e:
+            print(f"Error loading a published snapshot: {e}")
+        time.sleep(_REFRESH_INTERVAL)
+
+
+def _worker_main(control_name, port):
+    """Entry point of a server process."""
+    # Spawned by SharedServerPool, so this process uses the publisher's resource tracker
+    reader = SharedSnapshotReader(control_name, shares_tracker=True)
+
+    class SharedSnapshotHandler(server.CSVDownloadHandler):
+        def handle_one_request(self):
+            reader.refresh()
+            super().handle_one_request()
+
+    threading.Thread(target=_watch_parent, daemon=True).start()
+    reader.refresh()
+    threading.Thread(target=_follow_publisher, args=(reader,), daemon=True).start()
+    httpd = _ReusePortHTTPServer(('', port), SharedSnapshotHandler)
+    httpd.serve_forever()
+
+
+class SharedServerPool:
+    """A pool of server processes answering requests from snapshots in shared memory."""
+
+    def __init__(self, workers, port=8000):
+        if not hasattr(socket, "SO_REUSEPORT") and workers > 1:
+            print("SO_REUSEPORT is not available, using a single server process")
+            workers = 1
+        self.port = port
+        self.publisher = SharedSnapshotPublisher()
+        # Start from the data already served
+        self.publisher.publish()
+        server.add_publish_listener(self.publisher.on_publish)
+
+        # Spawn instead of fork, forking a process that runs Qt threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.processes = [
+            context.Process(target=_worker_main, args=(self.publisher.control.name, port), daemon=True)
+            for _ in range(workers)
+        ]
+
+    def start(self):
+        self.publisher.start()
+        for process in self.processes:
+            process.start()
+        print(f"Serving on http://localhost:{self.port}/ with {len(self.processes)} server processes")
+
+    def stop(self):
+        server.remove_publish_listener(self.publisher.on_publish)
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.publisher.close()
+
+
+def run_shared_server(workers, port=8000):
+    """Start a pool of server processes and return it (call stop() to shut it down)."""
+    pool = SharedServerPool(workers, port)
+    pool.start()
+    return pool
@@ -0,0 +1,520 @@
+import json
+
+import numpy as np
+
+# Bucket sizes (in ms) of the rollup pyramid, finest first
+ROLLUP_BUCKETS_MS = (10, 100, 1000, 10000, 60000)
+
+DATE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def format_date_times(times):
+    """Format epoch-ms timestamps the same way parse_csv formats date_time."""
+    return np.datetime_as_string(times.astype('datetime64[ms]').astype('datetime64[us]'), unit='us')
+
+
+def _bucket_starts(keys):
+    """Return the index where each run of equal (sorted) bucket keys begins."""
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+
+
+class RollupLevel:
+    """
+    Min/max/sum/count of one signal over fixed-size time buckets.
+
+    A level may end in a separate tail level holding the buckets after its own arrays. Live
+    stores keep their still-open last bucket there, so the other buckets can be shared with
+    published snapshots while the open one is replaced. Use bucket_range() and slice() rather
+    than the arrays to include the tail.
+    """
+
+    __slots__ = ("bucket_ms", "times", "mins", "maxs", "sums", "counts", "labels", "tail")
+
+    FIELDS = ("times", "mins", "maxs", "sums", "counts")
+
+    def __init__(self, bucket_ms, times, mins, maxs, sums, counts, labels=None, tail=None):
+        self.bucket_ms = bucket_ms
+        self.times = times
+        self.mins = mins
+        self.maxs = maxs
+        self.sums = sums
+        self.counts = counts
+        self.labels = labels  # Text values of raw samples from non-numeric signals
+        self.tail = tail
+
+    @classmethod
+    def from_samples(cls, bucket_ms, times, values):
+        """Build the finest level straight from raw samples (non-numeric values are ignored)."""
+        valid = ~np.isnan(values)
+        times, values = times[valid], values[valid]
+        keys = times // bucket_ms
+        starts = _bucket_starts(keys)
+        if len(starts) == 0:
+            return cls.empty(bucket_ms)
+        counts = np.diff(np.append(starts, len(values)))
+        return cls(bucket_ms, keys[starts] * bucket_ms,
+                   np.minimum.reduceat(values, starts),
+                   np.maximum.reduceat(values, starts),
+                   np.add.reduceat(values, starts),
+                   counts)
+
+    @classmethod
+    def empty(cls, bucket_ms):
+        return cls(bucket_ms, np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0),
+                   np.zeros(0, dtype=np.int64))
+
+    def coarsen(self, bucket_ms):
+        """Merge this level's buckets into larger ones of bucket_ms."""
+        if self.tail is not None:
+            return self.slice(0, len(self)).coarsen(bucket_ms)
+        return self.merge_runs(_bucket_starts(self.times // bucket_ms), bucket_ms)
+
+    def merge_runs(self, starts, bucket_ms):
+        """Merge consecutive buckets, each run beginning at an index in starts."""
+        if self.tail is not None:
+            return self.slice(0, len(self)).merge_runs(starts, bucket_ms)
+        if len(starts) == 0:
+            return RollupLevel.empty(bucket_ms)
+        return RollupLevel(bucket_ms, (self.times[starts] // bucket_ms) * bucket_ms,
+                           np.minimum.reduceat(self.mins, starts),
+                           np.maximum.reduceat(self.maxs, starts),
+                           np.add.reduceat(self.sums, starts),
+                           np.add.reduceat(self.counts, starts))
+
+    def bucket_range(self, start_ms=None, end_ms=None):
+        """Return the (lo, hi) indices of the buckets starting in [start_ms, end_ms], tail included."""
+        count = len(self.times)
+        lo = 0 if start_ms is None else int(np.searchsorted(self.times, start_ms, side='left'))
+        hi = count if end_ms is None else int(np.searchsorted(self.times, end_ms, side='right'))
+        if self.tail is not None:
+            tail_lo, tail_hi = self.tail.bucket_range(start_ms, end_ms)
+            if lo == count:
+                lo += tail_lo
+            if hi == count:
+                hi += tail_hi
+        return lo, hi
+
+    def slice(self, lo, hi):
+        """Buckets lo to hi as a level without a tail; only copies where the slice reaches into the tail."""
+        count = len(self.times)
+        if self.tail is None or hi <= count:
+            return RollupLevel(self.bucket_ms, *(getattr(self, field)[lo:hi] for field in self.FIELDS))
+        tail = self.tail.slice(max(lo - count, 0), hi - count)
+        if lo >= count:
+            return tail
+        return RollupLevel(self.bucket_ms, *(np.concatenate((getattr(self, field)[lo:], getattr(tail, field)))
+                                             for field in self.FIELDS))
+
+    def __len__(self):
+        return len(self.times) + (len(self.tail) if self.tail is not None else 0)
+
+    @property
+    def nbytes(self):
+        tail_bytes = self.tail.nbytes if self.tail is not None else 0
+        return sum(getattr(self, field).nbytes for field in self.FIELDS) + tail_bytes
+
+
+def _merge_to_budget(level, max_points):
+    """
+    Merge a level's buckets into the narrowest buckets giving at most max_points.
+
+    The buckets needn't be a multiple of the level's, a level bucket then counts in the
+    merged bucket it starts in.
+    """
+    if len(level) <= max_points:
+        return level
+    span = int(level.times[-1] - level.times[0]) + level.bucket_ms
+    width = max(-(-span // max_points), level.bucket_ms)
+    while True:
+        # Aligning to the merged buckets can add one, so widen a little until it fits
+        merged = level.coarsen(width)
+        if len(merged) <= max_points:
+            return merged
+        width += max(width // 16, 1)
+
+
+class SignalSeries:
+    """Time-sorted samples of a single signal plus its rollup pyramid."""
+
+    def __init__(self, name, times, values, labels=None):
+        self.name = name
+        self.times = times      # int64 epoch milliseconds
+        self.values = values    # float64, NaN where the value is not numeric
+        self.labels = labels    # original values as text, only kept for non-numeric signals
+        self.levels = []
+
+    def build_rollups(self, buckets_ms=ROLLUP_BUCKETS_MS):
+        """Build the pyramid, each level from the one below so the cost shrinks as it goes up."""
+        levels = []
+        for bucket_ms in buckets_ms:
+            if not levels:
+                levels.append(RollupLevel.from_samples(bucket_ms, self.times, self.values))
+            else:
+                levels.append(levels[-1].coarsen(bucket_ms))
+        self.levels = levels
+
+    def range_indices(self, times, start_ms, end_ms):
+        lo = 0 if start_ms is None else int(np.searchsorted(times, start_ms, side='left'))
+        hi = len(times) if end_ms is None else int(np.searchsorted(times, end_ms, side='right'))
+        return lo, hi
+
+    def query(self, start_ms=None, end_ms=None, max_points=None):
+        """
+        Return samples in [start_ms, end_ms] with at most max_points entries.
+
+        Returns a RollupLevel; raw samples come back as one-sample buckets (bucket_ms 0).
+        The coarsest level still over the budget is merged down to about max_points buckets,
+        so the cost follows the number of output points and the budget is actually used.
+        Text-only signals aren't averaged: every change of their value is returned instead.
+        """
+        lo, hi = self.range_indices(self.times, start_ms, end_ms)
+        if max_points is None or hi - lo <= max_points:
+            return self._raw(lo, hi)
+        if self.labels is not None and np.isnan(self.values[lo:hi]).all():
+            labels = self.labels[lo:hi]
+            changed = lo + np.flatnonzero(np.concatenate(([True], labels[1:] != labels[:-1])))
+            return self._raw(changed)
+
+        source = None
+        for level in self.levels:
+            level_lo, level_hi = level.bucket_range(start_ms, end_ms)
+            if level_hi - level_lo <= max_points:
+                break
+            source = level.slice(level_lo, level_hi)
+        if source is None:
+            # Even the finest level fits, merge the raw samples instead
+            source = RollupLevel.from_samples(1, self.times[lo:hi], self.values[lo:hi])
+        return _merge_to_budget(source, max(max_points, 1))
+
+    def _raw(self, lo, hi=None):
+        """Samples lo:hi (or at the indices in lo) as one-sample buckets."""
+        index = slice(lo, hi) if hi is not None else lo
+        values = self.values[index]
+        labels = None if self.labels is None else self.labels[index]
+        return RollupLevel(0, self.times[index], values, values, values, np.ones(len(values), dtype=np.int64), labels)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        """Memory held by the samples and rollups (text labels are counted by reference only)."""
+        nbytes = self.times.nbytes + self.values.nbytes + sum(level.nbytes for level in self.levels)
+        if self.labels is not None:
+            nbytes += self.labels.nbytes
+        return nbytes
+
+
+class SignalStore:
+    """Columnar, per-signal store of the published data used to answer range queries."""
+
+    def __init__(self, series=None):
+        self.series = series or {}
+
+    @classmethod
+    def from_rows(cls, rows, build_rollups=True):
+        """Build a store from parse_csv style rows ({'sender', 'value', 'date_time'})."""
+        if not rows:
+            return cls()
+
+        # Imported on first use, it is slow to import and not needed to start the server
+        import pandas as pd
+
+        df = pd.DataFrame(rows, columns=["sender", "value", "date_time"])
+        df["sender"] = df["sender"].astype(str).str.strip()
+        df["time_ms"] = pd.to_datetime(df["date_time"], format=DATE_TIME_FORMAT).astype("datetime64[ms]").astype(np.int64)
+        df["numeric"] = pd.to_numeric(df["value"], errors="coerce").astype(np.float64)
+
+        series = {}
+        for sender, group in df.groupby("sender", sort=False):
+            group = group.sort_values("time_ms", kind="stable")
+            values = group["numeric"].to_numpy()
+            labels = None
+            if np.isnan(values).any():
+                labels = group["value"].astype(str).str.strip().to_numpy(dtype=object)
+            signal = SignalSeries(sender, group["time_ms"].to_numpy(), values, labels)
+            if build_rollups:
+                signal.build_rollups()
+            series[sender] = signal
+        return cls(series)
+
+    @classmethod
+    def merge(cls, stores, build_rollups=True):
+        """
+        Combine stores, e.g. of separately parsed files, into one. The samples of a signal in
+        several stores are merged by time, keeping the order of the stores for equal times.
+        """
+        parts = {}
+        for store in stores:
+            for name, signal in store.series.items():
+                parts.setdefault(name, []).append(signal)
+
+        series = {}
+        for name, signals in parts.items():
+            # Each part is sorted already, which the stable sort takes advantage of
+            times = np.concatenate([signal.times for signal in signals])
+            order = np.argsort(times, kind="stable")
+            values = np.concatenate([signal.values for signal in signals])[order]
+            labels = None
+            if any(signal.labels is not None for signal in signals):
+                # Labels are only read where the value is not numeric
+                labels = np.concatenate([signal.labels if signal.labels is not None
+                                         else np.full(len(signal), None, dtype=object)
+                                         for signal in signals])[order]
+            signal = SignalSeries(name, times[order], values, labels)
+            if build_rollups:
+                signal.build_rollups()
+            series[name] = signal
+        return cls(series)
+
+    def signal_names(self):
+        return list(self.series)
+
+    def resolve_signals(self, signals=None):
+        """
+        Return the requested signal names that exist in the store (all of them if none requested).
+
+        DTC signals used to be named without their message (DTC_CODE rather than
+        WSBRL_DTC.DTC_CODE), so a bare name missing from the store stands for every
+        "<message>.<name>" signal, keeping older queries and dashboards working.
+        """
+        if not signals:
+            return list(self.series)
+        resolved = []
+        for name in signals:
+            if name in self.series:
+                resolved.append(name)
+            else:
+                resolved.extend(series for series in self.series if series.endswith("." + name))
+        return list(dict.fromkeys(resolved))
+
+    def iter_samples(self, signals=None, start_ms=None, end_ms=None, block_size=65536):
+        """
+        Yield (name, times, values, labels) slices of raw samples in [start_ms, end_ms].
+
+        Each slice holds at most block_size samples and is a view into the store, so
+        walking a whole dataset never holds more than one block of output at a time.
+        """
+        for name in self.resolve_signals(signals):
+            series = self.series[name]
+            lo, hi = series.range_indices(series.times, start_ms, end_ms)
+            for start in range(lo, hi, block_size):
+                stop = min(start + block_size, hi)
+                labels = None if series.labels is None else series.labels[start:stop]
+                yield name, series.times[start:stop], series.values[start:stop], labels
+
+    def query(self, signals=None, start_ms=None, end_ms=None, max_points=None):
+        """Run query() for each requested signal, returning {name: RollupLevel}."""
+        return {name: self.series[name].query(start_ms, end_ms, max_points) for name in self.resolve_signals(signals)}
+
+    def __len__(self):
+        return sum(len(signal) for signal in self.series.values())
+
+    @property
+    def nbytes(self):
+        return sum(signal.nbytes for signal in self.series.values())
+
+
+def rollups_to_csv_bytes(results):
+    """Convert query results to CSV bytes with sender,value,date_time,min,max,count columns."""
+    lines = ["sender,value,date_time,min,max,count\n"]
+    for name, level in results.items():
+        if not len(level):
+            continue
+        date_times = format_date_times(level.times).tolist()
+        counts = level.counts.tolist()
+        if level.labels is not None:
+            # Raw samples of a non-numeric signal, keep their text value
+            for label, date_time in zip(level.labels.tolist(), date_times):
+                lines.append(f"{name},{label},{date_time},,,1\n")
+            continue
+        means = (level.sums / level.counts).tolist()
+        mins = level.mins.tolist()
+        maxs = level.maxs.tolist()
+        for i in range(len(date_times)):
+            lines.append(f"{name},{means[i]},{date_times[i]},{mins[i]},{maxs[i]},{counts[i]}\n")
+    return "".join(lines).encode("utf-8")
+
+
+def rollups_to_json_bytes(results):
+    """Convert query results to a JSON array of row objects with the same fields as the CSV."""
+    rows = []
+    for name, level in results.items():
+        date_times = format_date_times(level.times).tolist()
+        counts = level.counts.tolist()
+        if level.labels is not None:
+            rows.extend({"sender": name, "value": label, "date_time": date_time,
+                         "min": None, "max": None, "count": 1}
+                        for label, date_time in zip(level.labels.tolist(), date_times))
+            continue
+        means = (level.sums / level.counts).tolist()
+        mins = level.mins.tolist()
+        maxs = level.maxs.tolist()
+        rows.extend({"sender": name, "value": means[i], "date_time": date_times[i],
+                     "min": mins[i], "max": maxs[i], "count": counts[i]}
+                    for i in range(len(date_times)))
+    return json.dumps(rows).encode("utf-8")
+
+
+def sample_values(values, labels):
+    """Python values for a block of samples, using the text value where it is not numeric."""
+    if labels is None:
+        return values.tolist()
+    return [label if value != value else value for value, label in zip(values.tolist(), labels.tolist())]
+
+
+def samples_to_csv_bytes(name, times, values, labels=None):
+    """Format one block of raw samples as sender,value,date_time CSV lines."""
+    date_times = format_date_times(times).tolist()
+    return "".join(f"{name},{value},{date_time}\n"
+                   for value, date_time in zip(sample_values(values, labels), date_times)).encode("utf-8")
+
+
+def samples_to_json_bytes(name, times, values, labels=None):
+    """Format one block of raw samples as comma separated JSON row objects (without brackets)."""
+    date_times = format_date_times(times).tolist()
+    rows = [{"sender": name, "value": None if value != value else value, "date_time": date_time}
+            for value, date_time in zip(sample_values(values, labels), date_times)]
+    return json.dumps(rows)[1:-1].encode("utf-8")
+
+
+def iter_csv_blocks(store, signals=None, start_ms=None, end_ms=None, block_size=65536):
+    """Yield the raw samples of a store as sender,value,date_time CSV, one block at a time."""
+    yield b"sender,value,date_time\n"
+    if store is None:
+        return
+    for block in store.iter_samples(signals, start_ms, end_ms, block_size):
+        yield samples_to_csv_bytes(*block)
+
+
+def iter_json_blocks(store, signals=None, start_ms=None, end_ms=None, block_size=65536):
+    """Yield the raw samples of a store as a JSON array of row objects, one block at a time."""
+    yield b"["
+    if store is not None:
+        first = True
+        for block in store.iter_samples(signals, start_ms, end_ms, block_size):
+            if not first:
+                yield b","
+            yield samples_to_json_bytes(*block)
+            first = False
+    yield b"]"
+
+
+def iter_aligned_blocks(columns, block_size=65536):
+    """
+    Align several time-sorted (times, values) columns on their union of timestamps.
+
+    Yields (times, [values, ...]) blocks where every column has one entry per timestamp
+    (NaN where that column has no sample). A column with several samples at the same
+    timestamp contributes the last of them, as a wide row has one cell per signal. Each
+    block takes at most block_size samples from any one column, so memory stays bounded
+    however long the columns are.
+    """
+    cursors = [0] * len(columns)
+    while True:
+        remaining = [i for i, (times, _) in enumerate(columns) if cursors[i] < len(times)]
+        if not remaining:
+            return
+
+        # End the block at the earliest time any column reaches its block_size-th sample
+        end = min(columns[i][0][min(cursors[i] + block_size, len(columns[i][0])) - 1] for i in remaining)
+
+        slices = []
+        for i, (times, values) in enumerate(columns):
+            hi = int(np.searchsorted(times, end, side='right')) if cursors[i] < len(times) else cursors[i]
+            slices.append((times[cursors[i]:hi], values[cursors[i]:hi]))
+            cursors[i] = hi
+
+        block_times = np.unique(np.concatenate([times for times, _ in slices]))
+        aligned = []
+        for times, values in slices:
+            column = np.full(len(block_times), np.nan)
+            # Keep the last sample of each run of equal timestamps (a block never splits a run)
+            last = np.concatenate((times[1:] != times[:-1], [True])) if len(times) else np.zeros(0, dtype=bool)
+            column[np.searchsorted(block_times, times[last])] = values[last]
+            aligned.append(column)
+        yield block_times, aligned
+
+
+def store_columns(store, signals=None, start_ms=None, end_ms=None, max_points=None):
+    """
+    Return {name: (times, values)} for a query, using bucket means when downsampled.
+
+    Non-numeric samples are NaN, wide and columnar outputs only carry numbers.
+    """
+    if store is None:
+        return {}
+    if max_points is None:
+        columns = {}
+        for name in store.resolve_signals(signals):
+            series = store.series[name]
+            lo, hi = series.range_indices(series.times, start_ms, end_ms)
+            columns[name] = (series.times[lo:hi], series.values[lo:hi])
+        return columns
+    results = store.query(signals, start_ms, end_ms, max_points)
+    return {name: (level.times, level.sums / level.counts) for name, level in results.items()}
+
+
+def _csv_field(name):
+    """Quote a CSV header field if needed."""
+    if any(char in name for char in ',"\n'):
+        return '"' + name.replace('"', '""') + '"'
+    return name
+
+
+def iter_wide_csv_blocks(columns, block_size=65536):
+    """Yield a wide CSV (time in epoch ms, then one column per signal) one block at a time."""
+    names = list(columns)
+    yield ("time," + ",".join(_csv_field(name) for name in names) + "\n").encode("utf-8") if names else b"time\n"
+    for times, aligned in iter_aligned_blocks(list(columns.values()), block_size):
+        cells = [["" if value != value else repr(value) for value in column.tolist()] for column in aligned]
+        lines = [",".join([str(time), *row]) for time, row in zip(times.tolist(), zip(*cells))]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_wide_json_blocks(columns, block_size=65536):
+    """Yield a JSON array with one {"time": epoch_ms, "<signal>": value, ...} object per timestamp."""
+    names = list(columns)
+
+    def blocks():
+        for times, aligned in iter_aligned_blocks(list(columns.values()), block_size):
+            cells = [[None if value != value else value for value in column.tolist()] for column in aligned]
+            rows = [{"time": time, **dict(zip(names, row))} for time, row in zip(times.tolist(), zip(*cells))]
+            yield json.dumps(rows)[1:-1].encode("utf-8")
+
+    yield from _json_array_blocks(blocks())
+
+
+def _json_array_blocks(blocks):
+    """Join blocks of JSON values (without brackets) into one array."""
+    yield b"["
+    first = True
+    for block in blocks:
+        if not block:
+            continue
+        if not first:
+            yield b","
+        yield block
+        first = False
+    yield b"]"
+
+
+def iter_columnar_json_blocks(columns, block_size=65536):
+    """
+    Yield columnar JSON ({"time": [...], "<signal>": [...], ...}) one block at a time.
+
+    Every field is a full array, so the aligned blocks are regenerated once per field
+    instead of holding the aligned dataset in memory.
+    """
+    column_list = list(columns.values())
+    yield b'{"time":'
+    yield from _json_array_blocks(json.dumps(times.tolist())[1:-1].encode("utf-8")
+                                  for times, _ in iter_aligned_blocks(column_list, block_size))
+    for index, name in enumerate(columns):
+        yield ("," + json.dumps(name) + ":").encode("utf-8")
+        yield from _json_array_blocks(
+            json.dumps([None if value != value else value for value in aligned[index].tolist()])[1:-1].encode("utf-8")
+            for _, aligned in iter_aligned_blocks(column_list, block_size))
+    yield b"}"
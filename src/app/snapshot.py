@@ -0,0 +1,217 @@
+import gzip
+import hashlib
+import zlib
+import itertools
+import threading
+import time
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip is always available
+    zstandard = None
+
+from app.signalstore import iter_csv_blocks
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Preferred order when the client accepts several encodings equally
+_PREFERRED_ENCODINGS = ("zstd", "gzip", "identity")
+
+_versions = itertools.count(1)
+
+
+def supported_encodings():
+    """Content codings this server can produce."""
+    return [encoding for encoding in _PREFERRED_ENCODINGS if encoding != "zstd" or zstandard is not None]
+
+
+def compress(body, encoding):
+    """Compress body with the given content coding."""
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+
+def stream_compressor(encoding):
+    """
+    Return an object with compress()/flush() for compressing a streamed body,
+    or None for the identity coding.
+    """
+    if encoding == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip header
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    return None
+
+
+def negotiate_encoding(accept_encoding, body_size):
+    """
+    Pick the content coding for a response from an Accept-Encoding header.
+
+    Returns "identity" when the header is missing, the body is small, or nothing better is accepted.
+    """
+    if not accept_encoding or body_size < MIN_COMPRESS_SIZE:
+        return "identity"
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding] = q
+
+    default = weights.get("*", 0.0)
+    best, best_q = "identity", 0.0
+    for encoding in supported_encodings():
+        if encoding == "identity":
+            continue
+        q = weights.get(encoding, default)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def http_date(timestamp):
+    """Format an epoch timestamp as an HTTP date (for Last-Modified)."""
+    return formatdate(timestamp, usegmt=True)
+
+
+def _parse_etags(header):
+    """Split an If-None-Match header into opaque tags, ignoring weak prefixes."""
+    tags = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag:
+            tags.add(tag)
+    return tags
+
+
+def is_not_modified(headers, etag, last_modified):
+    """
+    Evaluate If-None-Match / If-Modified-Since request headers against a representation.
+
+    If-None-Match takes precedence, If-Modified-Since is only used when it is absent.
+    """
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        # If-None-Match always uses weak comparison
+        tags = _parse_etags(if_none_match)
+        return "*" in tags or etag.replace("W/", "", 1) in tags
+
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates only have second resolution
+        return int(last_modified) <= since
+    return False
+
+
+class Snapshot:
+    """
+    An immutable published dataset: the CSV body, the SignalStore behind it and
+    compressed variants of the body built on first request.
+
+    Snapshots are built once by the processing thread and handed to the server by
+    reference, so publishing never copies or re-encodes the body. The body may be
+    bytes or a memoryview (e.g. into shared memory), which is used as is.
+
+    With body None the CSV is generated from the store the first time it is requested,
+    so live data can be published often at a cost independent of its total size.
+    Such snapshots get a unique digest unless one is given.
+    """
+
+    def __init__(self, body, store=None, digest=None, last_modified=None):
+        self._body = None
+        if body is not None:
+            self._body = body if isinstance(body, (bytes, memoryview)) else bytes(body)
+        self.store = store
+        self.version = next(_versions)
+        if digest is None and body is None:
+            digest = uuid.uuid4().hex
+        self._digest = digest
+        self.last_modified = time.time() if last_modified is None else last_modified
+        self._encoded = {}
+        # Reentrant because encoded() reads the lazily built body while holding it
+        self._lock = threading.RLock()
+
+    @property
+    def body(self):
+        if self._body is None:
+            with self._lock:
+                if self._body is None:
+                    self._body = b"".join(iter_csv_blocks(self.store))
+        return self._body
+
+    @property
+    def view(self):
+        return memoryview(self.body)
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.body, digest_size=16).hexdigest()
+        return self._digest
+
+    @property
+    def has_body(self):
+        """False while a lazily built body hasn't been generated yet."""
+        return self._body is not None
+
+    @property
+    def known_digest(self):
+        """The digest if it is known already, without hashing the body."""
+        return self._digest
+
+    @property
+    def is_empty(self):
+        """True for a snapshot with an empty body (a lazily built body always has a header)."""
+        return self._body is not None and not len(self._body)
+
+    def encoded(self, encoding):
+        """Return the body in the given content coding, compressing it once per snapshot."""
+        if encoding == "identity":
+            return self.body
+        body = self._encoded.get(encoding)
+        if body is None:
+            # Hold the lock while compressing so concurrent requests don't all compress the same body
+            with self._lock:
+                body = self._encoded.get(encoding)
+                if body is None:
+                    body = compress(self.body, encoding)
+                    self._encoded[encoding] = body
+        return body
+
+    def etag(self, encoding="identity"):
+        """Strong ETag of the body in the given content coding."""
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the body and the store."""
+        nbytes = len(self._body) if self._body is not None else 0
+        if self.store is not None:
+            nbytes += self.store.nbytes
+        return nbytes
+
+    def __len__(self):
+        return len(self.body)
@@ -0,0 +1,192 @@
+"""
+Live ingest of raw CAN frames streamed over a local socket.
+
+Bench setups pipe raw TTTTTTTTxIIIIIIIIDD... lines over TCP or UDP. They are decoded with
+the DBC into a LiveStore bounded by a per-signal capacity and a time retention, and
+published to the server as a named dataset, so memory stays constant however long the
+session runs.
+"""
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from app.livestore import LiveStore, LIVE_BASE_TIME_MS
+from app.server import publish_snapshot
+from app.snapshot import Snapshot
+from parsing.raw_parsing.parse_tcu_data import load_dbc, decode_line
+
+DEFAULT_INGEST_PORT = 9000
+
+# Samples kept per signal and how far back from the newest sample they are kept
+DEFAULT_CAPACITY = 100000
+DEFAULT_RETENTION_MS = 10 * 60 * 1000
+
+# Batches of received lines waiting to be decoded; a full queue slows TCP senders down
+MAX_PENDING_BATCHES = 256
+
+# Most batches decoded at once, which bounds the memory of decoded but not yet stored samples
+MAX_DECODE_BATCHES = 16
+
+# Minimum time between two published snapshots, in seconds
+PUBLISH_INTERVAL = 0.1
+
+RECEIVE_SIZE = 65536
+
+
+class _TCPLineHandler(socketserver.BaseRequestHandler):
+    """Splits a TCP stream into complete lines and queues them in batches."""
+
+    def handle(self):
+        remainder = b""
+        while True:
+            data = self.request.recv(RECEIVE_SIZE)
+            if not data:
+                break
+            data = remainder + data
+            end = data.rfind(b"\n") + 1
+            remainder = data[end:]
+            if end:
+                self.server.service.receive(data[:end])
+
+
+class _UDPLineHandler(socketserver.BaseRequestHandler):
+    """Queues the lines of one datagram (a trailing newline is optional)."""
+
+    def handle(self):
+        self.server.service.receive(self.request[0])
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class LiveIngest:
+    """
+    The live ingest path: decodes queued raw lines (or takes decoded samples) into a
+    bounded LiveStore on one thread and publishes it as a named dataset.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, retention_ms=DEFAULT_RETENTION_MS, dataset_id="live"):
+        self.dataset_id = dataset_id
+        self.store = LiveStore(capacity, retention_ms)
+        self.pending = queue.Queue(maxsize=MAX_PENDING_BATCHES)
+        self.running = False
+        self.threads = []
+        self.received_lines = 0
+        self.skipped_lines = 0
+
+    def receive(self, data):
+        """Queue a block of complete raw lines (bytes) for decoding."""
+        self.pending.put(data)
+
+    def receive_samples(self, samples):
+        """Queue already decoded (time_ms, signal, value) samples, with time_ms on the live base date."""
+        self.pending.put(samples)
+
+    def start(self):
+        """Start decoding in a background thread."""
+        self.running = True
+        self.threads = [threading.Thread(target=self.decode_loop, daemon=True)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def decode_loop(self):
+        """Decode queued lines into the store, publishing at most every PUBLISH_INTERVAL seconds."""
+        db = load_dbc()
+        last_publish = 0.0
+        dirty = False
+        while self.running:
+            try:
+                blocks = [self.pending.get(timeout=PUBLISH_INTERVAL)]
+            except queue.Empty:
+                blocks = []
+            # Take more of what is already waiting, so a backlog is decoded in few steps
+            while len(blocks) < MAX_DECODE_BATCHES:
+                try:
+                    blocks.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            samples = []
+            for block in blocks:
+                if not isinstance(block, bytes):
+                    samples.extend(block)
+                    continue
+                for line in block.decode("ascii", errors="replace").splitlines():
+                    if not line.strip():
+                        continue
+                    self.received_lines += 1
+                    decoded = decode_line(db, line)
+                    if decoded is None:
+                        self.skipped_lines += 1
+                        continue
+                    samples.extend((LIVE_BASE_TIME_MS + timestamp, signal, value) for timestamp, signal, value in decoded)
+            if samples:
+                self.store.append_samples(samples)
+                dirty = True
+
+            now = time.monotonic()
+            if dirty and now - last_publish >= PUBLISH_INTERVAL:
+                publish_snapshot(Snapshot(None, self.store.freeze()), self.dataset_id, make_current=False)
+                last_publish = now
+                dirty = False
+
+    def stats(self):
+        return {
+            "received_lines": self.received_lines,
+            "skipped_lines": self.skipped_lines,
+            "samples": len(self.store),
+            "signals": len(self.store.series),
+        }
+
+
+class SocketIngestService(LiveIngest):
+    """Receives raw frames on a local socket and feeds them into the live ingest path."""
+
+    def __init__(self, port=DEFAULT_INGEST_PORT, protocol="tcp", host="127.0.0.1",
+                 capacity=DEFAULT_CAPACITY, retention_ms=DEFAULT_RETENTION_MS, dataset_id="live"):
+        if protocol not in ("tcp", "udp"):
+            raise ValueError(f"Unknown protocol: {protocol}")
+        super().__init__(capacity, retention_ms, dataset_id)
+        self.port = port
+        self.protocol = protocol
+        self.host = host
+        self.server = None
+
+    def start(self):
+        """Start listening and decoding in background threads."""
+        if self.protocol == "tcp":
+            self.server = _TCPServer((self.host, self.port), _TCPLineHandler)
+        else:
+            self.server = socketserver.UDPServer((self.host, self.port), _UDPLineHandler)
+            # A large receive buffer rides out decoding pauses without dropping datagrams
+            self.server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.server.service = self
+        self.port = self.server.server_address[1]
+        super().start()
+        server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        server_thread.start()
+        self.threads.append(server_thread)
+        print(f"Ingesting raw frames on {self.protocol}://{self.host}:{self.port}/ into /datasets/{self.dataset_id}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        super().stop()
+
+
+def run_socket_ingest(port=DEFAULT_INGEST_PORT, protocol="tcp", capacity=DEFAULT_CAPACITY,
+                      retention_ms=DEFAULT_RETENTION_MS, dataset_id="live"):
+    """Start an ingest service and return it (call stop() to shut it down)."""
+    service = SocketIngestService(port, protocol, capacity=capacity, retention_ms=retention_ms, dataset_id=dataset_id)
+    service.start()
+    return service
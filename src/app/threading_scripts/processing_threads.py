@@ -1,48 +1,168 @@
+import multiprocessing
 import os
+import queue
+import time
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from app.threading_scripts.shared_data import shared_data_manager
+from app.livestore import LiveStore, LIVE_BASE_TIME_MS
+from app.server import publish_snapshot
+from app.signalstore import SignalStore
+from app.snapshot import Snapshot
 from parsing.csv_reading.csv_parse import parse_csv, rows_to_csv_bytes
-from parsing.raw_parsing.parse_tcu_data import parse_raw_folder, parse_raw_file
+from parsing.raw_parsing.parse_tcu_data import (
+    iter_parse_raw_folder, iter_parse_raw_files, RawLogTail, ConversionCancelled
+)
+
+# Converted files waiting to be parsed; a full queue holds conversion back until parsing catches up
+PIPELINE_QUEUE_SIZE = 8
+
+# How often a followed log is checked for new lines, in seconds
+LIVE_POLL_INTERVAL = 0.2
+
+# How long a thread blocked on the pipeline queue waits before checking for cancellation, in seconds
+CANCEL_POLL_INTERVAL = 0.2
+
+# Rows filtered between two checks for cancellation
+CANCEL_CHECK_ROWS = 65536
+
+# While files are still being parsed, the ones parsed so far are published at most this often, in seconds
+PARTIAL_PUBLISH_INTERVAL = 1.0
+
+class CancelToken:
+    """
+    Cancels one load job: the threads check it between steps and the conversion worker
+    processes share its multiprocessing.Event, so cancelling reaches into them too.
+    """
+
+    def __init__(self):
+        self.event = multiprocessing.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+def put_unless_cancelled(file_queue, item, cancel_token):
+    """Put item on a bounded queue, giving up if the job is cancelled while the queue is full."""
+    while True:
+        try:
+            file_queue.put(item, timeout=CANCEL_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            if cancel_token is not None and cancel_token.cancelled:
+                return False
 
 class CSVConversionThread(QThread):
-    """Thread for turning raw hexadecimal data into structured data for parsing."""
+    """
+    Thread for turning raw hexadecimal data into structured data for parsing.
+
+    Each converted file is put on output_queue as soon as it is written, followed by None
+    once all are done, so a CSVParsingThread reading the queue can start on the first file
+    while the rest are still being converted.
+
+    Cancelling cancel_token stops the conversion workers; conversion_complete is then not emitted.
+    """
     progress_update = pyqtSignal(str)  # Signal to update progress text
-    conversion_complete = pyqtSignal(str)  # Signal with data_id instead of data
+    conversion_progress = pyqtSignal(object)  # Signal with ConversionProgress.as_dict() while converting
+    conversion_complete = pyqtSignal(object)  # Signal with the list of converted file paths
     
-    def __init__(self, path):
+    def __init__(self, path, output_queue=None, cancel_token=None):
         super().__init__()
         self.path = path
+        self.output_queue = output_queue
+        self.cancel_token = cancel_token
         
     def run(self):
         """Convert raw hexadecimal data into structured data for parsing."""
         print(f"Processing folder {self.path}")
-        if os.path.isfile(self.path):
-            file_path = parse_raw_file(self.path)
-            file_paths = [file_path]
-            self.conversion_complete.emit(','.join(str(path) for path in file_paths))
-        else:
-            self.progress_update.emit(f"Processing folder {self.path}")
-            file_paths = parse_raw_folder(self.path)
-            self.conversion_complete.emit(','.join(str(path) for path in file_paths))    
+        file_paths = []
+        cancel_event = self.cancel_token.event if self.cancel_token is not None else None
+        try:
+            if os.path.isfile(self.path):
+                converted = iter_parse_raw_files(os.path.dirname(self.path), [self.path], self.on_progress, cancel_event)
+            else:
+                self.progress_update.emit(f"Processing folder {self.path}")
+                converted = iter_parse_raw_folder(self.path, self.on_progress, cancel_event)
+            for file_path in converted:
+                file_paths.append(str(file_path))
+                if self.output_queue is not None:
+                    put_unless_cancelled(self.output_queue, str(file_path), self.cancel_token)
+        except ConversionCancelled:
+            return
+        except Exception as e:
+            # An exception leaving run() would take the application down, hand on what was converted
+            print(f"Error converting {self.path}: {e}")
+            self.progress_update.emit(f"Error converting {os.path.basename(self.path)}: {e}")
+        finally:
+            # Always end the stream, or the parsing thread would wait forever
+            if self.output_queue is not None:
+                put_unless_cancelled(self.output_queue, None, self.cancel_token)
+        self.conversion_complete.emit(file_paths)
+
+    def on_progress(self, progress):
+        """Forward the progress reported by the conversion workers."""
+        self.progress_update.emit(progress.format())
+        self.conversion_progress.emit(progress.as_dict())
+
+def iter_queue(file_queue, cancel_token=None):
+    """Yield items from a queue until the None that ends it, or until the job is cancelled."""
+    while True:
+        try:
+            item = file_queue.get(timeout=CANCEL_POLL_INTERVAL)
+        except queue.Empty:
+            if cancel_token is not None and cancel_token.cancelled:
+                return
+            continue
+        if item is None:
+            return
+        yield item
 
 class CSVParsingThread(QThread):
-    """Thread for parsing CSV files in the background."""
+    """
+    Thread for parsing CSV files in the background.
+
+    With a dataset_id, the files parsed so far are merged into one store and published under
+    it while parsing goes on (at most every PARTIAL_PUBLISH_INTERVAL seconds), so the first
+    file can be queried at /datasets/<dataset_id> while the rest are still being converted
+    and parsed. Once all are parsed, parsing_complete hands the rows on for sender selection
+    as before; only the filtered result is served at /.
+    """
     progress_update = pyqtSignal(str)  # Signal to update progress text
     parsing_complete = pyqtSignal(str)  # Signal with data_id instead of data
     
-    def __init__(self, file_list):
+    def __init__(self, file_list, cancel_token=None, dataset_id=None):
+        """file_list is a list of paths, or a queue of paths ended by None that is read as files arrive."""
         super().__init__()
         self.file_list = file_list
+        self.cancel_token = cancel_token
+        self.dataset_id = dataset_id
+
+    def is_cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.cancelled
         
     def run(self):
         """Parse CSV files in background thread."""
         csv_data = []
-        total_files = len(self.file_list)
+        store = SignalStore()  # Files published so far
+        unpublished = []  # Stores of the files parsed since then
+        last_publish = 0.0
+        publish_interval = PARTIAL_PUBLISH_INTERVAL
+        if isinstance(self.file_list, queue.Queue):
+            files = iter_queue(self.file_list, self.cancel_token)
+            total_files = None
+        else:
+            files = self.file_list
+            total_files = len(self.file_list)
         
-        for i, file in enumerate(self.file_list):
+        for i, file in enumerate(files):
+            if self.is_cancelled():
+                return
             print(f"Processing {file}")
-            self.progress_update.emit(f"Processing file {i+1} of {total_files}: {os.path.basename(file)}")
+            of_total = f" of {total_files}" if total_files is not None else ""
+            self.progress_update.emit(f"Processing file {i+1}{of_total}: {os.path.basename(file)}")
             file_data = parse_csv(file)
             
             # Skip files that couldn't be parsed
@@ -50,8 +170,26 @@ class CSVParsingThread(QThread):
                 self.progress_update.emit(f"Skipping invalid file: {os.path.basename(file)}")
                 continue
                 
+            if self.is_cancelled():
+                return
             csv_data.extend(file_data)
+            if self.dataset_id is not None:
+                # Files arrive in any order, so they are only merged by time when published
+                unpublished.append(SignalStore.from_rows(file_data, build_rollups=False))
+                if time.monotonic() - last_publish >= publish_interval:
+                    started = time.monotonic()
+                    store = self.publish_partial(store, unpublished)
+                    if store is None:
+                        return
+                    unpublished = []
+                    last_publish = time.monotonic()
+                    # Merging takes longer as data accumulates, keep it to a fraction of the parsing time
+                    publish_interval = max(PARTIAL_PUBLISH_INTERVAL, 4 * (last_publish - started))
 
+        if self.is_cancelled():
+            return
+        if unpublished and self.publish_partial(store, unpublished) is None:
+            return
         print(f"Total rows loaded: {len(csv_data)}")
         
         # Check if we have any data after parsing
@@ -65,18 +203,38 @@ class CSVParsingThread(QThread):
         data_id = shared_data_manager.store_data(csv_data)
         self.parsing_complete.emit(data_id)
 
+    def publish_partial(self, store, new_stores):
+        """
+        Publish all signals of the files parsed so far (the CSV body is only generated if someone
+        downloads it), without making them current since senders haven't been selected yet.
+
+        Returns:
+            The merged store, or None if the job was cancelled
+        """
+        store = SignalStore.merge([store, *new_stores])
+        # A superseded job must not replace the dataset of the one that took over
+        if self.is_cancelled():
+            return None
+        publish_snapshot(Snapshot(None, store), self.dataset_id, make_current=False)
+        self.progress_update.emit(f"Serving {len(store)} samples parsed so far")
+        return store
+
 class CSVProcessingThread(QThread):
     """Thread for processing CSV data to bytes in the background."""
     progress_update = pyqtSignal(str)  # Signal to update progress text
-    processing_complete = pyqtSignal(bytes)  # Signal when processing is done
+    processing_complete = pyqtSignal(object)  # Signal with the Snapshot to publish when processing is done
     
-    def __init__(self, data_id: str, selected_senders: set):
+    def __init__(self, data_id: str, selected_senders: set, cancel_token=None):
         super().__init__()
         self.data_id = data_id
         self.selected_senders = selected_senders
+        self.cancel_token = cancel_token
+
+    def is_cancelled(self):
+        return self.cancel_token is not None and self.cancel_token.cancelled
         
     def run(self):
-        """Process CSV data to bytes in background thread."""
+        """Process CSV data into a publishable snapshot in background thread."""
         # Get data from shared manager
         csv_data = shared_data_manager.get_data(self.data_id)
         if not csv_data:
@@ -85,10 +243,52 @@ class CSVProcessingThread(QThread):
         
         # Filter data based on selected senders
         filtered_data = []
-        for row in csv_data:
+        for i, row in enumerate(csv_data):
+            if i % CANCEL_CHECK_ROWS == 0 and self.is_cancelled():
+                return
             if 'sender' in row and row['sender'].strip() in self.selected_senders:
                 filtered_data.append(row)
         
         self.progress_update.emit(f"Processing {len(filtered_data)} rows for server update...")
         csv_bytes = rows_to_csv_bytes(filtered_data)
-        self.processing_complete.emit(csv_bytes)
\ No newline at end of file
+        if self.is_cancelled():
+            return
+
+        # Build the columnar store and its rollup pyramid here so zoomed-out queries never scan raw rows
+        self.progress_update.emit("Building rollups for zoomed-out views...")
+        store = SignalStore.from_rows(filtered_data)
+        if self.is_cancelled():
+            return
+
+        # The snapshot is passed on by reference, the CSV bytes are never copied or re-encoded again
+        self.processing_complete.emit(Snapshot(csv_bytes, store))
+
+class LiveTailThread(QThread):
+    """Thread that follows a raw TXT log while it is written and publishes what gets appended."""
+    progress_update = pyqtSignal(str)  # Signal to update progress text
+
+    def __init__(self, path, dataset_id=None, poll_interval=LIVE_POLL_INTERVAL):
+        super().__init__()
+        self.path = path
+        self.dataset_id = dataset_id
+        self.poll_interval = poll_interval
+        self.running = True
+
+    def run(self):
+        """Decode newly appended lines and publish a snapshot of the grown data after each batch."""
+        tail = RawLogTail(self.path)
+        store = LiveStore()
+        while self.running:
+            samples = tail.read_new()
+            if not samples:
+                time.sleep(self.poll_interval)
+                continue
+
+            store.append_samples((LIVE_BASE_TIME_MS + timestamp, signal, value) for timestamp, signal, value in samples)
+            # Publish straight from this thread, the CSV body is only generated if someone downloads it
+            publish_snapshot(Snapshot(None, store.freeze()), self.dataset_id)
+            self.progress_update.emit(f"Following {os.path.basename(self.path)}: {len(store)} samples")
+
+    def stop(self):
+        """Stop following the log, the last published data stays served."""
+        self.running = False
@@ -1,13 +1,20 @@
 import threading
-from typing import Dict, List, Any
+from collections import OrderedDict
+from typing import Dict, List, Any, Tuple
 import uuid
 
+# Memory that resident datasets may use together before the least recently used are dropped
+DATASET_MEMORY_BUDGET = 1024 * 1024 * 1024
+
 class SharedDataManager:
     """Manages shared data between threads using references instead of copying."""
     
-    def __init__(self):
+    def __init__(self, dataset_budget: int = DATASET_MEMORY_BUDGET):
         self._data_store: Dict[str, Any] = {}
         self._lock = threading.Lock()
+        # Named datasets as name -> (dataset, size), least recently used first
+        self._datasets: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self.dataset_budget = dataset_budget
     
     def store_data(self, data: List[Dict]) -> str:
         """Store data and return a unique identifier."""
@@ -31,6 +38,56 @@ class SharedDataManager:
         with self._lock:
             data = self._data_store.get(data_id)
             return len(data) if data else 0
+    
+    def store_dataset(self, name: str, dataset: Any, size: int) -> List[str]:
+        """
+        Keep a named dataset resident, replacing any dataset with the same name.
+
+        Least recently used datasets are dropped until all of them fit in the memory budget.
+        The dataset just stored is always kept, even if it is larger than the budget on its own.
+
+        Returns:
+            The names of the datasets that were dropped.
+        """
+        evicted = []
+        with self._lock:
+            self._datasets.pop(name, None)
+            self._datasets[name] = (dataset, size)
+            total = sum(size for _, size in self._datasets.values())
+            while total > self.dataset_budget and len(self._datasets) > 1:
+                evicted_name, (_, evicted_size) = self._datasets.popitem(last=False)
+                total -= evicted_size
+                evicted.append(evicted_name)
+        return evicted
+    
+    def get_dataset(self, name: str) -> Any:
+        """Retrieve a named dataset, marking it as recently used."""
+        with self._lock:
+            entry = self._datasets.get(name)
+            if entry is None:
+                return None
+            self._datasets.move_to_end(name)
+            return entry[0]
+    
+    def remove_dataset(self, name: str):
+        """Drop a named dataset to free memory."""
+        with self._lock:
+            self._datasets.pop(name, None)
+    
+    def replace_datasets(self, datasets: List[Tuple[str, Any, int]]):
+        """Make (name, dataset, size) the resident datasets, in that order and without dropping any."""
+        with self._lock:
+            self._datasets = OrderedDict((name, (dataset, size)) for name, dataset, size in datasets)
+    
+    def list_datasets(self) -> List[Tuple[str, Any, int]]:
+        """Get (name, dataset, size) of all resident datasets, most recently used last."""
+        with self._lock:
+            return [(name, dataset, size) for name, (dataset, size) in self._datasets.items()]
+    
+    def get_datasets_size(self) -> int:
+        """Get the memory used by all resident datasets."""
+        with self._lock:
+            return sum(size for _, size in self._datasets.values())
 
 # Global shared data manager
 shared_data_manager = SharedDataManager()
\ No newline at end of file
@@ -1,20 +1,30 @@
 import os
+import queue
 from PyQt5.QtWidgets import QMessageBox
 from PyQt5.QtCore import QObject, pyqtSignal
 
-from app.server import update_data
-from app.threading_scripts.processing_threads import CSVParsingThread, CSVProcessingThread, CSVConversionThread
+from app.server import publish_snapshot, make_dataset_id
+from app.threading_scripts.processing_threads import (
+    CSVParsingThread, CSVProcessingThread, CSVConversionThread, LiveTailThread, CancelToken, PIPELINE_QUEUE_SIZE
+)
 from app.threading_scripts.shared_data import shared_data_manager
 
 
 class ThreadManager(QObject):
-    """Class to manage all thread operations for the CAN Log Uploader."""
+    """
+    Class to manage all thread operations for the CAN Log Uploader.
+
+    Each load (conversion, parsing or processing) is a job with its own CancelToken.
+    Starting a new load cancels the running one, and signals still arriving from the
+    threads of a cancelled job are ignored.
+    """
     
     # Define signals for GUI updates
     progress_update = pyqtSignal(str)
-    conversion_completed = pyqtSignal(str)
+    conversion_completed = pyqtSignal(object)
+    conversion_progress = pyqtSignal(object)
     parsing_completed = pyqtSignal(str)
-    processing_completed = pyqtSignal(bytes)
+    processing_completed = pyqtSignal(object)
     show_loading = pyqtSignal(str, bool)
     hide_loading = pyqtSignal(bool)
     update_ui = pyqtSignal()
@@ -22,37 +32,86 @@ class ThreadManager(QObject):
     def __init__(self):
         super().__init__()
         self.csv_data_id = None
+        self.dataset_id = None  # Name the loaded data is published under, from its file or folder
         self.conversion_thread = None
         self.parsing_thread = None
         self.processing_thread = None
+        self.live_thread = None
+        self.job_token = None
+        self.retired_threads = set()  # Cancelled threads kept referenced until they have stopped
+
+    def start_job(self):
+        """Cancel the running job, if any, and return the token of a new one."""
+        self.cancel_current_job()
+        self.job_token = CancelToken()
+        return self.job_token
+
+    def cancel_current_job(self):
+        """Cancel the running job. Its threads stop at their next check without blocking the GUI."""
+        if self.job_token is not None:
+            self.job_token.cancel()
+        for thread in (self.conversion_thread, self.parsing_thread, self.processing_thread):
+            if thread is not None and thread.isRunning() and thread not in self.retired_threads:
+                self.retired_threads.add(thread)
+                thread.finished.connect(lambda thread=thread: self.retired_threads.discard(thread))
+
+    def is_current(self):
+        """Whether the thread that sent the signal being handled belongs to the current job."""
+        token = getattr(self.sender(), "cancel_token", None)
+        return token is None or token is self.job_token
     
     def process_raw_path(self, path):
-        """Process a raw path."""
+        """
+        Process a raw path.
+
+        Conversion and parsing run as a pipeline: each converted file is handed to the
+        parsing thread through a bounded queue as soon as it is written.
+        """
+        token = self.start_job()
         self.show_loading.emit("Processing raw path...", False)
-        self.conversion_thread = CSVConversionThread(path)
+        self.delete_old_data()
+        self.dataset_id = make_dataset_id(path)
+        file_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+        self.conversion_thread = CSVConversionThread(path, file_queue, token)
         self.conversion_thread.progress_update.connect(self.on_conversion_progress)
+        self.conversion_thread.conversion_progress.connect(self.on_conversion_stats)
         self.conversion_thread.conversion_complete.connect(self.on_conversion_complete)
+
+        self.parsing_thread = CSVParsingThread(file_queue, token, self.dataset_id)
+        self.parsing_thread.progress_update.connect(self.on_parsing_progress)
+        self.parsing_thread.parsing_complete.connect(self.on_parsing_complete)
+
         self.conversion_thread.start()
+        self.parsing_thread.start()
 
     def on_conversion_progress(self, message):
         """Update progress text during conversion."""
-        self.progress_update.emit(message)
+        if self.is_current():
+            self.progress_update.emit(message)
+
+    def on_conversion_stats(self, stats):
+        """Forward the conversion progress of the current job."""
+        if self.is_current():
+            self.conversion_progress.emit(stats)
 
     def on_conversion_complete(self, file_paths):
-        """Handle completion of CSV conversion."""
-        file_paths = file_paths.split(',')
-        self.show_loading.emit("Processing...", False)
-        self.parsing_thread = CSVParsingThread(file_paths)
-        self.parsing_thread.progress_update.connect(self.on_parsing_progress)
-        self.parsing_thread.parsing_complete.connect(self.on_parsing_complete)
-        self.parsing_thread.start()
+        """Handle completion of CSV conversion (the files were already handed to the parsing thread)."""
+        if self.is_current():
+            self.conversion_completed.emit(file_paths)
 
     def on_parsing_progress(self, message):
         """Update progress text during parsing."""
-        self.progress_update.emit(message)
+        if self.is_current():
+            self.progress_update.emit(message)
 
     def on_parsing_complete(self, data_id: str):
         """Handle completion of CSV parsing."""
+        if not self.is_current():
+            # Finished just before it was cancelled, nobody will use its data
+            if data_id:
+                shared_data_manager.remove_data(data_id)
+            return
         self.delete_old_data()
         
         # Check if we have a valid data_id
@@ -67,11 +126,13 @@ class ThreadManager(QObject):
         self.hide_loading.emit(True)
         self.parsing_completed.emit(data_id)
 
-    def on_processing_complete(self, csv_bytes):
+    def on_processing_complete(self, snapshot):
         """Handle completion of CSV processing."""
+        if not self.is_current():
+            return
         self.hide_loading.emit(True)
-        update_data(csv_bytes.decode('utf-8'))
-        self.processing_completed.emit(csv_bytes)
+        publish_snapshot(snapshot, self.dataset_id)
+        self.processing_completed.emit(snapshot)
 
     def update_server_filtered(self, selected_senders):
         """Update server with filtered data based on selected senders."""
@@ -84,10 +145,11 @@ class ThreadManager(QObject):
             return False
             
         # Show processing screen
+        token = self.start_job()
         self.show_loading.emit("Processing data for server...", True)
         
         # Create and start processing thread with data ID
-        self.processing_thread = CSVProcessingThread(self.csv_data_id, selected_senders)
+        self.processing_thread = CSVProcessingThread(self.csv_data_id, selected_senders, token)
         self.processing_thread.progress_update.connect(self.on_parsing_progress)
         self.processing_thread.processing_complete.connect(self.on_processing_complete)
         self.processing_thread.start()
@@ -99,15 +161,33 @@ class ThreadManager(QObject):
             return
             
         # Show loading screen
+        token = self.start_job()
         self.show_loading.emit("Processing...", False)
         self.delete_old_data()
+        # A single file is named after itself, several files after their folder
+        self.dataset_id = make_dataset_id(file_list[0] if len(file_list) == 1 else os.path.dirname(file_list[0]))
         
         # Create and start parsing thread
-        self.parsing_thread = CSVParsingThread(file_list)
+        self.parsing_thread = CSVParsingThread(file_list, token, self.dataset_id)
         self.parsing_thread.progress_update.connect(self.on_parsing_progress)
         self.parsing_thread.parsing_complete.connect(self.on_parsing_complete)
         self.parsing_thread.start()
     
+    def follow_raw_file(self, path):
+        """Follow a raw TXT log that is still being written, serving its data as it grows."""
+        self.stop_following()
+        self.dataset_id = make_dataset_id(path)
+        self.live_thread = LiveTailThread(path, self.dataset_id)
+        self.live_thread.progress_update.connect(self.on_parsing_progress)
+        self.live_thread.start()
+
+    def stop_following(self):
+        """Stop following a live log."""
+        if self.live_thread and self.live_thread.isRunning():
+            self.live_thread.stop()
+            self.live_thread.wait()
+        self.live_thread = None
+
     def get_data(self):
         """Get data from shared manager."""
         if not self.csv_data_id:
@@ -125,15 +205,8 @@ class ThreadManager(QObject):
         # Clean up shared data
         self.delete_old_data()
 
-        # Stop running threads
-        if self.parsing_thread and self.parsing_thread.isRunning():
-            self.parsing_thread.quit()
-            self.parsing_thread.wait()
-
-        if self.processing_thread and self.processing_thread.isRunning():
-            self.processing_thread.quit()
-            self.processing_thread.wait()
-            
-        if self.conversion_thread and self.conversion_thread.isRunning():
-            self.conversion_thread.quit()
-            self.conversion_thread.wait()
+        # Stop running threads. They have no event loop, so cancel them and wait for them to notice.
+        self.stop_following()
+        self.cancel_current_job()
+        for thread in list(self.retired_threads):
+            thread.wait()
@@ -27,6 +27,19 @@ class UploadSelection:
             self.parent.source_label.setText(self.parent.current_source)
             self.parent.thread_manager.process_raw_path(folder_path)
     
+    def follow_TXT_file(self):
+        """Select a TXT file that is still being written and follow it live, or stop following."""
+        if self.parent.thread_manager.live_thread is not None:
+            self.parent.thread_manager.stop_following()
+            self.parent.TXT_follow_btn.setText("Follow Live TXT File")
+            return
+        file_path, _ = QFileDialog.getOpenFileName(self.parent, "Follow TXT File", "", "TXT Files (*.txt)")
+        if file_path:
+            self.parent.current_source = f"Following: {file_path}"
+            self.parent.source_label.setText(self.parent.current_source)
+            self.parent.thread_manager.follow_raw_file(file_path)
+            self.parent.TXT_follow_btn.setText("Stop Following")
+
     def select_CSV_file(self):
         """Select a CSV file for processing."""
         file_path, _ = QFileDialog.getOpenFileName(self.parent, "Open CSV File", "", "CSV Files (*.csv)")
@@ -0,0 +1,355 @@
+"""
+Watch a folder for new or changed logs and append them to a served dataset.
+
+The car's TCU logs land in a synced folder after each run. FolderWatcher notices new and
+grown .TXT and .csv logs (woken by inotify on Linux, polling elsewhere), waits until a file
+has stopped changing for a debounce period, decodes only what was added to it since it was
+last read and appends that to one LiveStore, published as a named dataset. Nothing already
+ingested is read again, so the dataset stays current without reloading the folder.
+"""
+import concurrent.futures
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import struct
+import sys
+import threading
+import time
+
+from app.livestore import LiveStore, LIVE_BASE_TIME_MS
+from app.server import publish_snapshot, make_dataset_id
+from app.snapshot import Snapshot
+from parsing.csv_reading.csv_parse import timestamp_to_ms
+from parsing.raw_parsing.parse_tcu_data import RawLogTail, load_dbc
+
+# A log is ingested once its size and modification time haven't changed for this long, in seconds
+DEFAULT_DEBOUNCE = 2.0
+
+# How often the folder is scanned without inotify, in seconds
+DEFAULT_POLL_INTERVAL = 1.0
+
+# With inotify the folder is still rescanned this often, in case events were dropped
+RESCAN_INTERVAL = 30.0
+
+# Events arriving in quick succession (a log being written) are handled in one scan
+MIN_SCAN_INTERVAL = 0.2
+
+# A last line without a newline is only decoded once its log was closed after writing or has been
+# quiet this long, in seconds; until then the writer may just be in the middle of it
+INCOMPLETE_LINE_TIMEOUT = 60.0
+
+LOG_SUFFIXES = ('.txt', '.csv')
+
+# Written by run_script next to converted logs, not logs themselves
+IGNORED_SUFFIXES = ('.skipped.txt',)
+
+
+class ParsedLogTail(RawLogTail):
+    """Like RawLogTail, for parsed "timestamp, signal, value" .csv logs as written by run_script."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.offset = 0
+        self.skipped = 0
+
+    def decode(self, line):
+        parts = [part.strip() for part in line.split(",", 2)]
+        if len(parts) != 3:
+            return None
+        try:
+            timestamp_ms = timestamp_to_ms(parts[0])
+        except ValueError:
+            return None
+        return [(timestamp_ms, parts[1], parts[2])]
+
+
+# DBC of a watcher worker process, loaded by its first raw log
+_worker_db = None
+
+
+def read_log(path, offset, complete=False):
+    """
+    Decode what was added to a log after offset (a pool task).
+
+    Only complete lines are decoded, unless complete is set because the log is done being written.
+
+    Returns:
+        (samples, new offset, skipped lines) with samples as (timestamp_ms, signal, value)
+    """
+    global _worker_db
+    if path.lower().endswith('.txt'):
+        if _worker_db is None:
+            _worker_db = load_dbc()
+        tail = RawLogTail(path, _worker_db)
+    else:
+        tail = ParsedLogTail(path)
+    tail.offset = offset
+    samples = tail.read_new(complete)
+    # Enum values decode to cantools objects, which are sent back as their names
+    samples = [(timestamp, signal, value if isinstance(value, (int, float)) else str(value))
+               for timestamp, signal, value in samples]
+    return samples, tail.offset, tail.skipped
+
+
+class _Inotify:
+    """Minimal ctypes inotify wrapper, used to sleep until something in the folder changes."""
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    # struct inotify_event without its name: wd, mask, cookie, name length
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.watched = {}  # Watched directory -> watch descriptor
+        self.directories = {}  # Watch descriptor -> directory
+
+    @classmethod
+    def create(cls):
+        """Return an inotify instance, or None where inotify isn't available."""
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(cls.IN_NONBLOCK | cls.IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        return cls(libc, fd)
+
+    def watch(self, directory):
+        """Watch a directory (not recursively) if it isn't watched yet."""
+        if directory in self.watched:
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd >= 0:
+            self.watched[directory] = wd
+            self.directories[wd] = directory
+
+    def wait(self, timeout, wake_fd):
+        """
+        Sleep until a watched directory changes, wake_fd is readable or timeout passes.
+
+        Returns:
+            (whether something changed, paths of the files closed after being written)
+        """
+        readable, _, _ = select.select([self.fd, wake_fd], [], [], timeout)
+        if self.fd not in readable:
+            return False, set()
+        # Other than closed files, the folder is rescanned for the details
+        closed = set()
+        try:
+            while True:
+                data = os.read(self.fd, 65536)
+                if not data:
+                    break
+                offset = 0
+                while offset + self.EVENT.size <= len(data):
+                    wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                    name = data[offset + self.EVENT.size:offset + self.EVENT.size + length].rstrip(b"\0")
+                    offset += self.EVENT.size + length
+                    if mask & self.IN_CLOSE_WRITE and name and wd in self.directories:
+                        closed.add(os.path.join(self.directories[wd], os.fsdecode(name)))
+        except BlockingIOError:
+            pass
+        return True, closed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _WatchedFile:
+    def __init__(self, signature, changed_at):
+        self.signature = signature  # (size, mtime_ns) when last scanned
+        self.changed_at = changed_at  # time.monotonic() of the last change seen
+        self.ingested_signature = None
+        self.offset = 0  # Bytes already ingested
+        self.partial = False  # Whether a last line without a newline was left unread
+        self.closed_signature = None  # Signature when it was last closed after writing
+
+
+class FolderWatcher:
+    """
+    Keeps a dataset in step with the logs in a folder (and its subfolders).
+
+    Logs are read from where the last read stopped, so a grown log only costs its new lines;
+    a log that shrinks is read again from its start. Data of deleted logs stays served.
+
+    A last line without a newline is left for later, as the writer may just have paused in
+    the middle of it. It is read once the log is closed after writing (seen with inotify) or
+    has been quiet for INCOMPLETE_LINE_TIMEOUT.
+    """
+
+    def __init__(self, folder, dataset_id=None, signal_pattern=None, debounce=DEFAULT_DEBOUNCE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True, workers=None):
+        self.folder = os.path.abspath(folder)
+        self.dataset_id = dataset_id or make_dataset_id(self.folder)
+        self.signal_regex = re.compile(signal_pattern, re.IGNORECASE) if signal_pattern else None
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.workers = workers
+        self.store = LiveStore()
+        self.files = {}
+        self.closed = set()  # Paths closed after writing since the last scan
+        self.ingested_files = 0
+        self.skipped_lines = 0
+        self.running = False
+        self.thread = None
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+
+    def start(self):
+        """Ingest the logs already in the folder and keep watching it in a background thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+        os.write(self._wake_w, b"x")
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def run(self):
+        inotify = _Inotify.create() if self.use_inotify else None
+        mode = "inotify" if inotify is not None else f"polling every {self.poll_interval}s"
+        print(f"Watching {self.folder} ({mode}) into /datasets/{self.dataset_id}")
+        try:
+            with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+                while self.running:
+                    next_ready = self.scan(inotify)
+                    self.ingest_ready(pool)
+
+                    timeout = self.poll_interval if inotify is None else RESCAN_INTERVAL
+                    if next_ready is not None:
+                        timeout = min(timeout, next_ready)
+                    if inotify is not None:
+                        changed, closed = inotify.wait(timeout, self._wake_r)
+                        self.closed.update(closed)
+                        if changed:
+                            self._stop.wait(MIN_SCAN_INTERVAL)
+                    else:
+                        self._stop.wait(timeout)
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+    def scan(self, inotify=None):
+        """
+        Stat the logs in the folder and note which changed.
+
+        Returns:
+            Seconds until the next changed log has been quiet for the debounce period, or None
+        """
+        now = time.monotonic()
+        seen = set()
+        for root, dirs, files in os.walk(self.folder):
+            if inotify is not None:
+                inotify.watch(root)
+            for name in files:
+                lower = name.lower()
+                if not lower.endswith(LOG_SUFFIXES) or lower.endswith(IGNORED_SUFFIXES):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                signature = (stat.st_size, stat.st_mtime_ns)
+                watched = self.files.get(path)
+                if watched is None:
+                    # A log that was last modified a while ago (e.g. at startup) needn't wait out the debounce
+                    age = max(time.time() - stat.st_mtime, 0.0)
+                    self.files[path] = _WatchedFile(signature, now - age)
+                elif signature != watched.signature:
+                    watched.signature = signature
+                    watched.changed_at = now
+
+        for path in set(self.files) - seen:
+            del self.files[path]
+        for path in self.closed:
+            watched = self.files.get(path)
+            if watched is not None:
+                watched.closed_signature = watched.signature
+        self.closed.clear()
+
+        waits = [self.debounce - (now - watched.changed_at) for watched in self.files.values()
+                 if watched.signature != watched.ingested_signature]
+        waits += [INCOMPLETE_LINE_TIMEOUT - (now - watched.changed_at) for watched in self.files.values()
+                  if watched.partial and not self.is_complete(watched, now)]
+        waits = [wait for wait in waits if wait > 0]
+        return min(waits) if waits else None
+
+    def is_complete(self, watched, now):
+        """Whether a log is done being written: closed after writing, or quiet for INCOMPLETE_LINE_TIMEOUT."""
+        return watched.signature == watched.closed_signature or now - watched.changed_at >= INCOMPLETE_LINE_TIMEOUT
+
+    def ingest_ready(self, pool):
+        """Decode the new part of every changed log that is no longer being written and publish the grown dataset."""
+        now = time.monotonic()
+        ready = sorted(path for path, watched in self.files.items()
+                       if (watched.signature != watched.ingested_signature
+                           or watched.partial and self.is_complete(watched, now))
+                       and now - watched.changed_at >= self.debounce)
+        if not ready:
+            return
+
+        futures = {path: pool.submit(read_log, path, self.files[path].offset, self.is_complete(self.files[path], now))
+                   for path in ready}
+        samples = []
+        for path in ready:
+            try:
+                file_samples, offset, skipped = futures[path].result()
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                continue
+            watched = self.files.get(path)
+            if watched is None:
+                continue
+            if watched.ingested_signature is None:
+                self.ingested_files += 1
+            watched.offset = offset
+            watched.ingested_signature = watched.signature
+            watched.partial = offset < watched.signature[0]
+            self.skipped_lines += skipped
+            if self.signal_regex is not None:
+                file_samples = [sample for sample in file_samples if self.signal_regex.search(str(sample[1]).strip())]
+            samples.extend((LIVE_BASE_TIME_MS + timestamp, signal, value) for timestamp, signal, value in file_samples)
+
+        if samples:
+            self.store.append_samples(samples)
+            publish_snapshot(Snapshot(None, self.store.freeze()), self.dataset_id, make_current=False)
+        print(f"Ingested {len(ready)} changed log(s), {len(samples)} new samples, {len(self.store)} in /datasets/{self.dataset_id}")
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "ingested_files": self.ingested_files,
+            "skipped_lines": self.skipped_lines,
+            "samples": len(self.store),
+            "signals": len(self.store.series),
+        }
+
+
+def run_watch_folder(folder, dataset_id=None, signal_pattern=None, debounce=DEFAULT_DEBOUNCE,
+                     poll_interval=DEFAULT_POLL_INTERVAL, use_inotify=True):
+    """Start watching a folder and return the watcher (call stop() to stop it)."""
+    watcher = FolderWatcher(folder, dataset_id, signal_pattern, debounce, poll_interval, use_inotify)
+    watcher.start()
+    return watcher
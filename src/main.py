@@ -1,25 +1,143 @@
+import time
+STARTED = time.perf_counter()
+
 import sys
 import argparse
-from PyQt5.QtWidgets import QApplication
+import threading
+
+from app.socketingest import run_socket_ingest, DEFAULT_CAPACITY, DEFAULT_RETENTION_MS
 
-from app.gui import CANLogUploader
+# Slow to import and only needed once a cloud panel is opened or a file is parsed, so they
+# must not be loaded before the window appears
+LAZY_MODULES = ("pandas", "cantools", "firebase_admin", "pyrebase", "dotenv")
 
 def parse_arguments():
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(description="An applcation to upload CAN log files to update the Grafana dashboard")
     parser.add_argument('-v', '--version', action='version', version='%(prog)s 1.0')
+    parser.add_argument('--server-workers', type=int, default=0,
+                        help="Serve the dashboard data from this many processes sharing memory (default: a thread in the GUI process)")
+    parser.add_argument('--ingest-port', type=int, default=None,
+                        help="Decode raw frames streamed to this local port into the live dataset")
+    parser.add_argument('--ingest-protocol', choices=("tcp", "udp"), default="tcp", help="Protocol of the ingest socket")
+    parser.add_argument('--ingest-capacity', type=int, default=DEFAULT_CAPACITY,
+                        help="Samples kept per signal in the live dataset")
+    parser.add_argument('--ingest-retention', type=float, default=DEFAULT_RETENTION_MS / 1000,
+                        help="Seconds of live data kept before the newest sample")
+    parser.add_argument('--profile-startup', action="store_true",
+                        help="Print how long each startup step took until the window was shown, then exit")
     # parser.add_argument('-vb', '--verbose', default=False, action="store_true", help="Enable verbose output")
+
+    subparsers = parser.add_subparsers(dest="command")
+    serve_parser = subparsers.add_parser('serve', help="Convert or parse logs and serve them without the GUI")
+    serve_parser.add_argument('path', help="Raw .TXT or parsed .csv log, or a folder of them")
+    serve_parser.add_argument('--signals', default=None,
+                              help="Regex selecting the signals to serve, matched like the GUI's filter (default: all)")
+    serve_parser.add_argument('--dataset', default=None, help="Dataset name to serve under (default: from the path)")
+    serve_parser.add_argument('--port', type=int, default=8000, help="Port of the HTTP server")
+
+    watch_parser = subparsers.add_parser('watch', help="Serve the logs in a folder and append new or grown logs as they arrive")
+    watch_parser.add_argument('path', help="Folder of raw .TXT and/or parsed .csv logs")
+    watch_parser.add_argument('--signals', default=None,
+                              help="Regex selecting the signals to serve, matched like the GUI's filter (default: all)")
+    watch_parser.add_argument('--dataset', default=None, help="Dataset name to serve under (default: from the folder)")
+    watch_parser.add_argument('--port', type=int, default=8000, help="Port of the HTTP server")
+    watch_parser.add_argument('--debounce', type=float, default=2.0,
+                              help="Seconds a log must stay unchanged before it is ingested")
+    watch_parser.add_argument('--poll', action="store_true", help="Poll the folder instead of using inotify")
+    watch_parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between scans when polling")
     return parser.parse_known_args()
 
-def main():
+def start_ingest(args):
+    """Start the socket ingest service if a port was given."""
+    if args.ingest_port is None:
+        return None
+    return run_socket_ingest(args.ingest_port, args.ingest_protocol, args.ingest_capacity,
+                             int(args.ingest_retention * 1000))
+
+def print_startup_report(steps):
+    """Print the time of each startup step since main.py started and any heavy module loaded too early."""
+    print("Startup profile (seconds since main.py started, interpreter startup not included):")
+    previous = 0.0
+    for name, at in steps:
+        print(f"  {name:<24} {at:7.3f}  (+{at - previous:.3f})")
+        previous = at
+    loaded = [module for module in LAZY_MODULES if module in sys.modules]
+    if loaded:
+        print(f"  Loaded before the window appeared: {', '.join(loaded)}")
+    print("  Run with python -X importtime for the time of every import")
+
+def main(args):
+    steps = [("modules imported", time.perf_counter() - STARTED)]
+
+    def step(name):
+        steps.append((name, time.perf_counter() - STARTED))
+
+    # Qt is only imported for the GUI, so headless mode runs without it
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    step("Qt imported")
+    from app.gui import CANLogUploader
+    step("GUI imported")
+
     app = QApplication(sys.argv)
-    window = CANLogUploader()
+    window = CANLogUploader(server_workers=args.server_workers)
+    step("window created")
     window.show()
-    sys.exit(app.exec_())
+
+    if args.profile_startup:
+        # Runs once the event loop has drawn the window
+        def report():
+            step("window shown")
+            print_startup_report(steps)
+            app.quit()
+        QTimer.singleShot(0, report)
+
+    ingest_service = start_ingest(args)
+    exit_code = app.exec_()
+    if ingest_service is not None:
+        ingest_service.stop()
+    sys.exit(exit_code)
+
+def main_headless(args):
+    """Serve the logs at args.path (once, or watching the folder) until interrupted, without the GUI."""
+    from app.headless import load_and_publish
+    from app.server import run_server
+    from app.sharedserving import run_shared_server
+    from app.watchfolder import run_watch_folder
+
+    # Serve right away; the data appears once it is loaded
+    server_pool = None
+    if args.server_workers > 0:
+        server_pool = run_shared_server(args.server_workers, args.port)
+    else:
+        threading.Thread(target=run_server, args=(args.port,), daemon=True).start()
+    ingest_service = start_ingest(args)
+
+    watcher = None
+    try:
+        if args.command == "watch":
+            watcher = run_watch_folder(args.path, args.dataset, args.signals, args.debounce,
+                                       args.poll_interval, use_inotify=not args.poll)
+        else:
+            load_and_publish(args.path, args.signals, args.dataset)
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if ingest_service is not None:
+            ingest_service.stop()
+        if server_pool is not None:
+            server_pool.stop()
 
 
 if __name__ == "__main__":
     args = parse_arguments()
     # if args[0].verbose:
     #     print("Verbose mode enabled")
-    main()
\ No newline at end of file
+    if args[0].command in ("serve", "watch"):
+        main_headless(args[0])
+    else:
+        main(args[0])
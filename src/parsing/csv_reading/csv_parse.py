@@ -1,12 +1,26 @@
-import pandas as pd
 from datetime import datetime
 
+def timestamp_to_ms(timestamp):
+    """
+    Convert a parsed log timestamp to milliseconds since the logger started.
+
+    The converter writes seconds with a decimal point; older logs have hexadecimal milliseconds
+    (like "000000BB"). Every reader of parsed logs goes through this, so they all agree on the times.
+    """
+    text = str(timestamp).strip()
+    if '.' in text:
+        return int(round(float(text) * 1000))
+    return int(text, 16)
+
 def parse_csv(filepath):
     """
     Parses a CSV file with format: Timestamp, SignalName, Value
     Populates self.rows with dicts: [{'date_time': ..., 'signal': ..., 'value': ...}, ...]
     Returns None if the file is empty or doesn't have the expected format.
     """
+    # pandas is slow to import, so it is only loaded once the first file is parsed
+    import pandas as pd
+
     BASE_TIME = datetime(2025, 1, 1, 0, 0, 0)
     
     try:
@@ -27,12 +41,7 @@ def parse_csv(filepath):
             print(f"Warning: No data rows in CSV file: {filepath}")
             return None
         
-        if '.' in str(df["timestamp"].iloc[0]):
-            # If timestamp contains a decimal point, treat as float
-            df["timestamp_int"] = df["timestamp"].astype(int)
-        else:
-            # Otherwise, assume it's in hex format (like "000000BB")
-            df["timestamp_int"] = df["timestamp"].apply(lambda x: int(x, 16))
+        df["timestamp_int"] = df["timestamp"].map(timestamp_to_ms)
 
         df["date_time"] = pd.to_datetime(BASE_TIME) + pd.to_timedelta(df["timestamp_int"], unit='ms')
 
@@ -55,6 +64,8 @@ def rows_to_csv_bytes(rows):
     if not rows:
         return b""
     
+    import pandas as pd
+
     # Convert back to DataFrame for efficient CSV writing
     df = pd.DataFrame(rows)
     csv_data = df.to_csv(index=False).encode("utf-8")
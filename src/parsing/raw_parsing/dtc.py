@@ -0,0 +1,30 @@
+import csv
+import os
+
+_dtc_codes = None
+
+def load_dtc_codes():
+    """
+    Load the DTC definitions from DTC.csv.
+
+    Returns:
+        Dict mapping DTC code (int) to a dict with name, origin, severity and message
+    """
+    global _dtc_codes
+    if _dtc_codes is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        codes = {}
+        with open(os.path.join(script_dir, 'DTC.csv'), newline='') as dtc_file:
+            for row in csv.DictReader(dtc_file):
+                try:
+                    code = int(row["DTC CODE"])
+                except (TypeError, ValueError):
+                    continue
+                codes[code] = {
+                    "name": row["NAME"],
+                    "origin": row["ORIGIN"],
+                    "severity": row["SEVERITY"],
+                    "message": row["MESSAGE"],
+                }
+        _dtc_codes = codes
+    return _dtc_codes
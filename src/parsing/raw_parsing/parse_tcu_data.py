@@ -1,9 +1,38 @@
 import sys
 import os
-import cantools
+import json
+import queue
+import time
+import multiprocessing
+from datetime import datetime
 from pathlib import Path
 import concurrent.futures
 
+# Workers report their progress after reading this many bytes
+PROGRESS_REPORT_BYTES = 1024 * 1024
+
+# Workers check for cancellation every this many lines
+CANCEL_CHECK_LINES = 2000
+
+# How often the progress reports of the workers are collected, in seconds
+PROGRESS_INTERVAL = 0.25
+
+# Every finished conversion is recorded here, one JSON object per line
+METRICS_FILE = Path("parsed_files") / "conversion_metrics.jsonl"
+
+# Signals every board sends in its own DTC message, named "<message>.<signal>" when decoded
+# Bytes of a followed log read at once, so a large backlog isn't loaded into memory in one piece
+TAIL_READ_SIZE = 4 * 1024 * 1024
+
+DTC_SIGNALS = ("DTC_CODE", "DTC_Data", "DTC_Severity")
+
+# Set in conversion worker processes to the queue they report progress on and the event that cancels them
+_progress_queue = None
+_cancel_event = None
+
+class ConversionCancelled(Exception):
+    """Raised when a conversion is stopped through its cancel event."""
+
 def process_message(message: str, fileName) -> tuple:
     if len(message) < 17 or message[8] != 'x':
         print('Error: CAN Format seems wrong in' + fileName + '! Skipping line')
@@ -18,10 +47,73 @@ def process_message(message: str, fileName) -> tuple:
         id_int = int(id_hex, 16)
         return timestamp, id_int, data_hex
 
-def run_script(folder_path: Path, filepath: Path):
+def load_dbc():
+    """Load the car's DBC file used to decode CAN frames."""
+    # cantools is slow to import, so it is only loaded once something is decoded
+    import cantools
     script_dir = os.path.dirname(os.path.abspath(__file__))
     dbc_path = os.path.join(script_dir, '2024CAR.dbc')
-    db = cantools.database.load_file(dbc_path)
+    return cantools.database.load_file(dbc_path)
+
+def decode_frame(db, can_id: int, can_data: str):
+    """
+    Decode one CAN frame with the DBC.
+
+    DTC signals are named after their message too (e.g. "WSBRL_DTC.DTC_CODE"), since every
+    board's DTC message uses the same signal names. Older conversions used the bare names,
+    which SignalStore.resolve_signals still accepts (see "DTC signal names" in docs/API.md).
+
+    Returns:
+        Dict of signal name to value, or None if the frame is unknown or can't be decoded
+    """
+    try:
+        msg = db.get_message_by_frame_id(can_id)
+    except KeyError:
+        return None
+
+    try:
+        data_bytes = bytes.fromhex(can_data)
+        decoded = msg.decode(data_bytes)
+    except:
+        return None
+    return {(f"{msg.name}.{signal}" if signal in DTC_SIGNALS else signal): value for signal, value in decoded.items()}
+
+def decode_line(db, line: str):
+    """
+    Decode one raw TTTTTTTTxIIIIIIIIDD... log line.
+
+    Returns:
+        List of (timestamp_ms, signal, value) tuples with the raw timestamp in milliseconds,
+        or None if the line is malformed or its frame can't be decoded
+    """
+    line = line.strip()
+    if len(line) < 17 or line[8] != 'x':
+        return None
+    try:
+        timestamp_ms = int(line[:8], 16)
+        can_id = int(line[9:17], 16)
+    except ValueError:
+        return None
+    decoded_signals = decode_frame(db, can_id, line[17:])
+    if decoded_signals is None:
+        return None
+    return [(timestamp_ms, signal, decoded_signals[signal]) for signal in decoded_signals]
+
+def _init_worker(progress_queue, cancel_event):
+    """Pool initializer handing each worker process the progress queue and cancel event."""
+    global _progress_queue, _cancel_event
+    _progress_queue = progress_queue
+    _cancel_event = cancel_event
+
+def _report_progress(filepath, bytes_read, frames):
+    if _progress_queue is not None:
+        _progress_queue.put((str(filepath), bytes_read, frames))
+
+def run_script(folder_path: Path, filepath: Path):
+    if _cancel_event is not None and _cancel_event.is_set():
+        # Queued before the conversion was cancelled
+        raise ConversionCancelled(str(filepath))
+    db = load_dbc()
     fileName = filepath.name
     print(f"Parsing file: {filepath}")
 
@@ -39,8 +131,22 @@ def run_script(folder_path: Path, filepath: Path):
     parsed_file_path.parent.mkdir(parents=True, exist_ok=True)
     skipped_file_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Progress not reported yet, in bytes read and frames decoded
+    unreported_bytes = 0
+    unreported_frames = 0
+    reported_bytes = 0
+    cancelled = False
+
     with open(filepath, 'r') as input_file, open(parsed_file_path, 'w') as output_file, open(skipped_file_path, 'w') as skipped_file:
-        for line in input_file:
+        for line_number, line in enumerate(input_file, 1):
+            if line_number % CANCEL_CHECK_LINES == 0 and _cancel_event is not None and _cancel_event.is_set():
+                cancelled = True
+                break
+            unreported_bytes += len(line)
+            if unreported_bytes >= PROGRESS_REPORT_BYTES:
+                _report_progress(filepath, unreported_bytes, unreported_frames)
+                reported_bytes += unreported_bytes
+                unreported_bytes = unreported_frames = 0
             if len(line.strip()) < 17 or 'x' not in line.strip()[:9]:
                 skipped_file.write(line)
                 skipped_any = True
@@ -56,55 +162,279 @@ def run_script(folder_path: Path, filepath: Path):
             #     skipped_any = True
             #     continue
 
-            try:
-                msg = db.get_message_by_frame_id(can_id)
-            except KeyError:
-                skipped_file.write(line)
-                skipped_any = True
-                continue
-
-            try: 
-                data_bytes = bytes.fromhex(can_data)
-                decoded_signals = msg.decode(data_bytes)
-            except:
+            decoded_signals = decode_frame(db, can_id, can_data)
+            if decoded_signals is None:
                 skipped_file.write(line)
                 skipped_any = True
                 continue
 
+            unreported_frames += 1
             for signal in decoded_signals:
                 output_file.write(f'{timestamp}, {signal}, {decoded_signals[signal]}\n')
+
+    if cancelled:
+        # Don't leave a partial CSV behind that could be mistaken for a converted file
+        os.remove(parsed_file_path)
+        os.remove(skipped_file_path)
+        raise ConversionCancelled(str(filepath))
+
+    # Settle on the file size, which lines counted in characters can miss (e.g. dropped \r)
+    _report_progress(filepath, os.path.getsize(filepath) - reported_bytes, unreported_frames)
     
     # Check if no lines were skipped and delete the skipped file if it's empty
     if not skipped_any:
         os.remove(skipped_file_path)
     return parsed_file_path
 
-def parse_raw_folder(folder_path: str):
+class RawLogTail:
     """
-    Parse all raw .TXT files in a folder and return paths to generated CSV files.
+    Follows a raw .TXT log that is still being written and decodes only what was appended.
+
+    The read offset is kept between calls and a trailing partial line is left for the next
+    call, so every line is decoded exactly once however often the file is polled.
+    """
+
+    def __init__(self, filepath, db=None):
+        self.filepath = Path(filepath)
+        self.db = db if db is not None else load_dbc()
+        self.offset = 0
+        self.skipped = 0
+
+    def read_new(self, complete=False):
+        """
+        Decode the complete lines appended since the last call.
+
+        Args:
+            complete: The file is done being written, so a last line without a newline is decoded too
+
+        Returns:
+            List of (timestamp_ms, signal, value) tuples, with the raw timestamp in milliseconds
+        """
+        try:
+            size = os.path.getsize(self.filepath)
+        except OSError:
+            return []
+        if size < self.offset:
+            # The file was truncated or replaced, start over from its beginning
+            self.offset = 0
+        if size == self.offset:
+            return []
+
+        samples = []
+        remainder = b""  # Partial line at the end of the last chunk
+        with open(self.filepath, 'rb') as input_file:
+            input_file.seek(self.offset)
+            position = self.offset
+            while position < size:
+                chunk = input_file.read(min(TAIL_READ_SIZE, size - position))
+                if not chunk:
+                    break  # Truncated while reading
+                position += len(chunk)
+                data = remainder + chunk
+                end = len(data) if complete and position == size else data.rfind(b'\n') + 1
+                remainder = data[end:]
+                for line in data[:end].decode('ascii', errors='replace').splitlines():
+                    decoded = self.decode(line)
+                    if decoded is None:
+                        self.skipped += 1
+                        continue
+                    samples.extend(decoded)
+                # A partial line is read again by the next call
+                self.offset = position - len(remainder)
+        return samples
+
+    def decode(self, line):
+        """Decode one line into (timestamp_ms, signal, value) tuples, or None if it is malformed or unknown."""
+        return decode_line(self.db, line)
+
+class ConversionProgress:
+    """Running totals of a conversion of files whose total size is known up front."""
+
+    def __init__(self, files):
+        self.total_files = len(files)
+        self.total_bytes = sum(os.path.getsize(file) for file in files)
+        self.bytes_done = 0
+        self.frames_done = 0
+        self.files_done = 0
+        self.start = time.monotonic()
+        self.end = None
+
+    def add(self, bytes_read, frames):
+        self.bytes_done += bytes_read
+        self.frames_done += frames
+
+    def file_done(self):
+        self.files_done += 1
+
+    def finish(self):
+        self.end = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return (self.end or time.monotonic()) - self.start
+
+    @property
+    def fraction(self):
+        if not self.total_bytes:
+            return 1.0 if self.files_done >= self.total_files else 0.0
+        return min(self.bytes_done / self.total_bytes, 1.0)
+
+    @property
+    def mb_per_second(self):
+        elapsed = self.elapsed
+        return self.bytes_done / 1e6 / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def frames_per_second(self):
+        elapsed = self.elapsed
+        return self.frames_done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self):
+        """Seconds left at the rate so far, or None before anything was read."""
+        if not self.bytes_done:
+            return None
+        rate = self.bytes_done / self.elapsed
+        return max(self.total_bytes - self.bytes_done, 0) / rate
+
+    def as_dict(self):
+        return {
+            "files": self.total_files,
+            "files_done": self.files_done,
+            "bytes": self.total_bytes,
+            "bytes_done": self.bytes_done,
+            "frames": self.frames_done,
+            "seconds": round(self.elapsed, 3),
+            "fraction": self.fraction,
+            "mb_per_second": round(self.mb_per_second, 3),
+            "frames_per_second": round(self.frames_per_second, 1),
+            "eta_seconds": None if self.eta_seconds is None else round(self.eta_seconds, 1),
+        }
+
+    def format(self):
+        """Human readable status line, e.g. for the progress bar text."""
+        text = (f"Converted {self.files_done}/{self.total_files} files, "
+                f"{self.bytes_done / 1e6:.1f} of {self.total_bytes / 1e6:.1f} MB "
+                f"({self.mb_per_second:.1f} MB/s, {self.frames_per_second:,.0f} frames/s)")
+        eta = self.eta_seconds
+        if eta is not None and self.end is None:
+            minutes, seconds = divmod(int(round(eta)), 60)
+            text += f", ETA {minutes}:{seconds:02d}"
+        return text
+
+def record_metrics(progress, source, workers, metrics_file=METRICS_FILE):
+    """Append the totals of a finished conversion to the metrics file."""
+    record = {"time": datetime.now().isoformat(timespec="seconds"), "source": str(source), "workers": workers}
+    record.update(progress.as_dict())
+    del record["fraction"], record["eta_seconds"], record["files_done"], record["bytes_done"]
+    try:
+        metrics_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(metrics_file, "a") as output_file:
+            output_file.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Could not record conversion metrics: {e}")
+
+def iter_parse_raw_files(folder_path, files, on_progress=None, cancel_event=None):
+    """
+    Parse raw .TXT files in parallel, yielding each generated CSV path as soon as it is written.
+
+    Workers report bytes read and frames decoded through a multiprocessing queue, which is
+    collected every PROGRESS_INTERVAL seconds into a ConversionProgress passed to on_progress.
+    The totals of the run are recorded in METRICS_FILE.
+
+    Setting cancel_event (a multiprocessing.Event) stops the workers within a few thousand
+    lines, drops the files not started yet and raises ConversionCancelled once the workers
+    are idle again. A file that fails to convert is reported and skipped.
+    
+    Args:
+        folder_path: Folder the files are in, whose structure is kept in the output
+        files: Paths of the raw files
+        on_progress: Optional callback taking the ConversionProgress
+        cancel_event: Optional multiprocessing.Event that cancels the conversion
+        
+    Yields:
+        Paths to the generated CSV files, in the order they finish
+    """
+    folder = Path(folder_path)
+    files = [Path(file) for file in files]
+    progress = ConversionProgress(files)
+    progress_queue = multiprocessing.Queue()
+
+    def collect():
+        while True:
+            try:
+                _, bytes_read, frames = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            progress.add(bytes_read, frames)
+
+    workers = min(len(files), os.cpu_count() or 1) or 1
+    initargs = (progress_queue, cancel_event)
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker, initargs=initargs) as executor:
+        submitted = {executor.submit(run_script, folder, file_path): file_path for file_path in files}
+        pending = set(submitted)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=PROGRESS_INTERVAL,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if cancel_event is not None and cancel_event.is_set():
+                # Leaving the with block waits for the running files, which stop at their next check
+                executor.shutdown(wait=False, cancel_futures=True)
+                print(f"Conversion of {folder} cancelled")
+                raise ConversionCancelled(str(folder))
+            collect()
+            for future in done:
+                progress.file_done()
+            if on_progress is not None:
+                on_progress(progress)
+            for future in done:
+                try:
+                    csv_path = future.result()
+                except ConversionCancelled:
+                    raise
+                except Exception as e:
+                    # One unreadable log shouldn't stop the others
+                    print(f"Error converting {submitted[future]}: {e}")
+                    continue
+                yield csv_path
+
+    # The workers have exited, so their last reports are all in the queue by now
+    collect()
+    progress.finish()
+    if on_progress is not None:
+        on_progress(progress)
+    print(progress.format())
+    record_metrics(progress, folder, workers)
+
+def iter_parse_raw_folder(folder_path: str, on_progress=None, cancel_event=None):
+    """
+    Parse all raw .TXT files in a folder in parallel, yielding each generated CSV path as soon as it is written.
     
     Args:
         folder_path: Path to folder containing raw files
+        on_progress: Optional callback taking the ConversionProgress, see iter_parse_raw_files
+        cancel_event: Optional multiprocessing.Event that cancels the conversion
         
-    Returns:
-        List of paths to the generated CSV files
+    Yields:
+        Paths to the generated CSV files, in the order they finish
     """
     folder = Path(folder_path)
     files = list(folder.rglob('*.TXT'))
-    output_paths = []
     
     print(f"Number of files: {len(files)}")
     
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        futures = []
-        for file_path in files:
-            futures.append(executor.submit(run_script, folder, file_path))
-        
-        # Collect results
-        for future in concurrent.futures.as_completed(futures):
-            output_paths.append(future.result())
+    yield from iter_parse_raw_files(folder, files, on_progress, cancel_event)
+
+def parse_raw_folder(folder_path: str):
+    """
+    Parse all raw .TXT files in a folder and return paths to generated CSV files.
     
-    return output_paths
+    Args:
+        folder_path: Path to folder containing raw files
+        
+    Returns:
+        List of paths to the generated CSV files
+    """
+    return list(iter_parse_raw_folder(folder_path))
 def parse_raw_file(file_path: str):
     """
     Parse a single raw .TXT file and return the path to the generated CSV file.
@@ -0,0 +1,103 @@
+"""
+Stand-in for the bench: streams a raw .TXT log over a local TCP or UDP socket.
+
+Lines are paced by their timestamps (optionally sped up), so the receiver sees the same
+rate the TCU logged at. With --loop the file is replayed forever with timestamps that
+keep increasing.
+"""
+import argparse
+import socket
+import time
+
+# Lines sent per UDP datagram / TCP write
+BATCH_LINES = 50
+
+
+def read_frames(filepath):
+    """Read the raw lines of a log as (timestamp_ms, rest_of_line) pairs, skipping malformed ones."""
+    frames = []
+    with open(filepath, 'r') as input_file:
+        for line in input_file:
+            line = line.strip()
+            if len(line) < 17 or line[8] != 'x':
+                continue
+            try:
+                frames.append((int(line[:8], 16), line[8:]))
+            except ValueError:
+                continue
+    return frames
+
+
+def send_log(filepath, host="127.0.0.1", port=9000, protocol="tcp", speed=1.0, loop=False):
+    """
+    Send a raw log to a socket.
+
+    Args:
+        filepath: Path to the raw .TXT log
+        host, port, protocol: Where to send it ("tcp" or "udp")
+        speed: Replay speed relative to the logged rate, 0 sends as fast as possible
+        loop: Replay the log forever
+    """
+    frames = read_frames(filepath)
+    if not frames:
+        print(f"No frames in {filepath}")
+        return
+    duration_ms = frames[-1][0] - frames[0][0] + 1
+
+    if protocol == "tcp":
+        sock = socket.create_connection((host, port))
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(lines):
+        data = "".join(lines).encode("ascii")
+        if protocol == "tcp":
+            sock.sendall(data)
+        else:
+            sock.sendto(data, (host, port))
+
+    sent = 0
+    start = time.monotonic()
+    offset_ms = 0
+    try:
+        while True:
+            batch = []
+            for timestamp_ms, rest in frames:
+                timestamp_ms += offset_ms
+                if speed > 0:
+                    # Wait until this frame is due
+                    delay = (timestamp_ms - frames[0][0]) / 1000 / speed - (time.monotonic() - start)
+                    if delay > 0:
+                        if batch:
+                            send(batch)
+                            batch = []
+                        time.sleep(delay)
+                batch.append(f"{timestamp_ms & 0xFFFFFFFF:08X}{rest}\n")
+                sent += 1
+                if len(batch) >= BATCH_LINES:
+                    send(batch)
+                    batch = []
+            if batch:
+                send(batch)
+            if not loop:
+                break
+            offset_ms += duration_ms
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+
+    elapsed = time.monotonic() - start
+    print(f"Sent {sent} frames in {elapsed:.1f}s ({sent / max(elapsed, 1e-9):.0f} frames/s)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stream a raw CAN log to the live ingest socket")
+    parser.add_argument('file', help="Raw .TXT log to send")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--protocol', choices=("tcp", "udp"), default="tcp")
+    parser.add_argument('--speed', type=float, default=1.0, help="Replay speed, 0 for as fast as possible")
+    parser.add_argument('--loop', action="store_true", help="Replay the log forever")
+    args = parser.parse_args()
+    send_log(args.file, args.host, args.port, args.protocol, args.speed, args.loop)